@@ -1,8 +1,73 @@
 import streamlit as st
-import openai
-from dotenv import load_dotenv
-import os
+import functools
 import re
+import time
+
+import chat_context
+import faq_index
+import llm_cache
+import llm_client
+import session_memory
+
+# ストリーミング中に吹き出しを描き直す最短間隔（秒）
+STREAM_RENDER_INTERVAL = 0.05
+
+# 一度に表示する過去メッセージの件数（「以前のメッセージを表示」で増やす）
+CHAT_PAGE_SIZE = 20
+
+# --------------------------
+# 簡易Markdown→HTML変換（パターンは読み込み時に1回だけコンパイル）
+# --------------------------
+_H4_RE = re.compile(r'^###\s*(.+)$', flags=re.MULTILINE)
+_H3_RE = re.compile(r'^##\s*(.+)$', flags=re.MULTILINE)
+_H2_RE = re.compile(r'^#\s*(.+)$', flags=re.MULTILINE)
+_BOLD_RE = re.compile(r'\*\*(.+?)\*\*')
+
+
+def simple_markdown_to_html(text):
+    # 見出し
+    text = _H4_RE.sub(r'<h4 style="margin:4px 0;">\1</h4>', text)
+    text = _H3_RE.sub(r'<h3 style="margin:6px 0;">\1</h3>', text)
+    text = _H2_RE.sub(r'<h2 style="margin:8px 0;">\1</h2>', text)
+    # 太字
+    text = _BOLD_RE.sub(r'<strong>\1</strong>', text)
+    # 改行
+    return text.replace('\n', '<br>')
+
+
+# --------------------------
+# 吹き出しHTML
+# --------------------------
+def bubble_html(role, content):
+    content_html = simple_markdown_to_html(content)
+    if role == "user":
+        return f"""
+                    <div style="display:flex; justify-content:flex-end; margin:6px 0;">
+                        <div style="background-color:#1f2937; color:white; padding:12px 16px; 
+                                    border-radius:16px 16px 0 16px; max-width:70%; font-size:16px;">
+                            👤 <strong>あなた:</strong><br>{content_html}
+                        </div>
+                    </div>
+                    """
+    return f"""
+                    <div style="display:flex; justify-content:flex-start; margin:6px 0;">
+                        <div style="background-color:#1f2937; color:#a5d8ff; padding:12px 16px; 
+                                    border-radius:16px 16px 16px 0; max-width:70%; font-size:16px;">
+                            🤖 <strong>AI:</strong><br>{content_html}
+                        </div>
+                    </div>
+                    """
+
+
+def message_html(msg: dict) -> str:
+    # 変換結果をメッセージ自体に持たせ、内容が同じ間は作り直さない（API送信時は除く）
+    key = hash((msg["role"], msg["content"]))
+    cached = msg.get("_html")
+    if cached is None or cached[0] != key:
+        cached = (key, bubble_html(msg["role"], msg["content"]))
+        msg["_html"] = cached
+    return cached[1]
+
 
 def main(container=None):
     if container is None:
@@ -13,12 +78,9 @@ def main(container=None):
     # --------------------------
     # .env読み込み
     # --------------------------
-    load_dotenv()
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    if not llm_client.get_api_key():
         container.error("OpenAI API Key が取得できません。")
         return
-    openai.api_key = api_key
 
     # --------------------------
     # セッションステート初期化
@@ -37,57 +99,53 @@ def main(container=None):
             }
         ]
 
+    # 送信するトークン数を一定に保つための要約状態
+    if "chat_context" not in st.session_state:
+        st.session_state.chat_context = chat_context.new_state()
+
+    # よくある質問から即答した件数
+    if "faq_stats" not in st.session_state:
+        st.session_state.faq_stats = {"lookups": 0, "hits": 0}
+
+    # 表示する過去メッセージの件数
+    if "chat_visible" not in st.session_state:
+        st.session_state.chat_visible = CHAT_PAGE_SIZE
+
     # --------------------------
-    # チャット表示用コンテナ
+    # 以前のメッセージ（古い分は折りたたむ）
     # --------------------------
-    chat_placeholder = container.empty()
+    # ディスクに退避した古い発言（session_memory）も数に含める
+    spilled = st.session_state.get("chat_spilled", 0)
+    hidden = sum(m["role"] in ("user", "assistant") for m in st.session_state.messages) + spilled - st.session_state.chat_visible
+    if hidden > 0:
+        container.button(
+            f"以前のメッセージを表示（残り{hidden}件）",
+            key="chat_show_more",
+            on_click=lambda: st.session_state.update(chat_visible=st.session_state.chat_visible + CHAT_PAGE_SIZE),
+        )
 
     # --------------------------
-    # 簡易Markdown→HTML変換
+    # チャット表示用コンテナ
     # --------------------------
-    def simple_markdown_to_html(text):
-        # 見出し
-        text = re.sub(r'^###\s*(.+)$', r'<h4 style="margin:4px 0;">\1</h4>', text, flags=re.MULTILINE)
-        text = re.sub(r'^##\s*(.+)$', r'<h3 style="margin:6px 0;">\1</h3>', text, flags=re.MULTILINE)
-        text = re.sub(r'^#\s*(.+)$', r'<h2 style="margin:8px 0;">\1</h2>', text, flags=re.MULTILINE)
-        # 太字
-        text = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', text)
-        # 改行
-        text = text.replace('\n', '<br>')
-        return text
+    chat_placeholder = container.empty()
 
     # --------------------------
     # チャット表示関数
     # --------------------------
-    def display_chat():
+    def display_chat(reply_slot=False):
+        # reply_slot=True のときは、最後にAI応答を流し込むための枠を返す
+        # 表示するのは直近 chat_visible 件だけで、HTMLはまとめて1回で描画する
+        turns = [m for m in st.session_state.messages if m["role"] in ("user", "assistant")]
+        visible = turns[-st.session_state.chat_visible:]
+        if spilled and st.session_state.chat_visible > len(turns):
+            visible = session_memory.load_chat(session_memory.session_id(), st.session_state.chat_visible - len(turns)) + visible
+        slot = None
         with chat_placeholder.container():
-            for msg in st.session_state.messages:
-                content_html = simple_markdown_to_html(msg["content"])
-                if msg["role"] == "user":
-                    container.markdown(
-                        f"""
-                        <div style="display:flex; justify-content:flex-end; margin:6px 0;">
-                            <div style="background-color:#1f2937; color:white; padding:12px 16px; 
-                                        border-radius:16px 16px 0 16px; max-width:70%; font-size:16px;">
-                                👤 <strong>あなた:</strong><br>{content_html}
-                            </div>
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
-                elif msg["role"] == "assistant":
-                    container.markdown(
-                        f"""
-                        <div style="display:flex; justify-content:flex-start; margin:6px 0;">
-                            <div style="background-color:#1f2937; color:#a5d8ff; padding:12px 16px; 
-                                        border-radius:16px 16px 16px 0; max-width:70%; font-size:16px;">
-                                🤖 <strong>AI:</strong><br>{content_html}
-                            </div>
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
+            container.markdown("".join(message_html(m) for m in visible), unsafe_allow_html=True)
+            if reply_slot:
+                slot = container.empty()
             container.markdown("<div style='height:1px;'>&nbsp;</div>", unsafe_allow_html=True)
+        return slot
 
     # --------------------------
     # 送信前にまずチャット表示
@@ -105,26 +163,70 @@ def main(container=None):
             # ユーザーメッセージ追加
             st.session_state.messages.append({"role": "user", "content": user_input})
 
-            # 送信後すぐに過去チャットを表示
-            display_chat()
-
-            # AI応答中のスピナー
-            with container.spinner("AIが考えています..."):
-                try:
-                    response = openai.chat.completions.create(
-                        model="gpt-5-mini",
-                        messages=st.session_state.messages
+            # 送信後すぐに過去チャットを表示し、AI応答用の枠を用意
+            reply = display_chat(reply_slot=True)
+            reply.markdown(bubble_html("assistant", "AIが考えています..."), unsafe_allow_html=True)
+
+            # 届いた分から吹き出しに表示（描画は一定間隔にまとめる）
+            try:
+                # personality_data.csv にほぼ同じ質問があれば、保存済みの回答をそのまま返す
+                match = faq_index.get_index().lookup(user_input)
+                st.session_state.faq_stats["lookups"] += 1
+                if match["answer"] is not None:
+                    st.session_state.faq_stats["hits"] += 1
+                    assistant_message = match["answer"]
+                else:
+                    # 古い発言は要約に畳んで、直近の会話だけを送る
+                    messages = chat_context.build_messages(
+                        st.session_state.messages,
+                        st.session_state.chat_context,
+                        summarize=lambda previous, folded: llm_cache.cached_completion(
+                            functools.partial(llm_client.chat_create, task="summary"),
+                            model="gpt-5-mini",
+                            messages=chat_context.summary_prompt(previous, folded)
+                        )
                     )
-                    assistant_message = response.choices[0].message.content
-
-                    # AIメッセージ追加
-                    st.session_state.messages.append({"role": "assistant", "content": assistant_message})
-
-                    # AI応答後に再表示
-                    display_chat()
-
-                except Exception as e:
-                    container.error(f"API呼び出しエラー: {e}")
+                    # 近いQ&Aがあれば例として添える
+                    if match["examples"]:
+                        messages = faq_index.with_fewshot(messages, match["examples"])
+                    assistant_message = ""
+                    last_render = 0.0
+                    for delta in llm_cache.cached_stream(
+                        llm_client.chat_create,
+                        model="gpt-5-mini",
+                        messages=messages
+                    ):
+                        assistant_message += delta
+                        now = time.monotonic()
+                        if now - last_render >= STREAM_RENDER_INTERVAL:
+                            reply.markdown(bubble_html("assistant", assistant_message), unsafe_allow_html=True)
+                            last_render = now
+
+                # AIメッセージ追加
+                st.session_state.messages.append({"role": "assistant", "content": assistant_message})
+
+                # AI応答後に再表示
+                display_chat()
+
+            except Exception as e:
+                reply.empty()
+                container.error(f"API呼び出しエラー: {e}")
+
+    # よくある質問からの即答率
+    faq_stats = st.session_state.faq_stats
+    if faq_stats["lookups"]:
+        container.caption(
+            f"よくある質問から即答: {faq_stats['hits']}/{faq_stats['lookups']}件"
+            f"（{faq_stats['hits'] / faq_stats['lookups']:.0%}）"
+        )
+
+    # 送信トークン数の内訳
+    metrics = st.session_state.chat_context["metrics"]
+    if metrics.get("trimmed_messages"):
+        container.caption(
+            f"送信トークン: 約{metrics['sent_tokens']}（会話全体: 約{metrics['total_tokens']}）"
+            f"／古い発言{metrics['trimmed_messages']}件（約{metrics['trimmed_tokens']}トークン）を要約済み"
+        )
 
 # --------------------------
 # 直接実行用
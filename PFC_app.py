@@ -1,23 +1,42 @@
 # PFC_app.py
-import os
-from dotenv import load_dotenv
-import openai
+import functools
+
 import streamlit as st
 import pandas as pd
-import json
+
+import calorie_engine
+import food_search
+import food_substitutes
+import llm_cache
+import llm_client
+import nutrient_store
+import pfc_solver
+import structured_output
+
+def show_substitutes(found: dict):
+    # PFCバランスが近い同じ食品群の食品を、同じカロリーになるグラム数つきで表示
+    index = food_substitutes.get_index()
+    store = index.store
+    names = list(found)
+    hits = index.similar_many([found[n][0] for n in names], k=food_substitutes.DEFAULT_K)
+    with st.expander("似た食品（PFCバランスが近い置き換え候補）"):
+        for name, candidates in zip(names, hits):
+            row, serving = found[name]
+            if not candidates:
+                st.caption(f"{name}: 候補なし")
+                continue
+            grams = food_substitutes.same_kcal_grams(store, row, serving, [r for r, _ in candidates])
+            items = " / ".join(f"{store.food_name[r]} {g:.0f}g" for (r, _), g in zip(candidates, grams))
+            st.caption(f"{name} {serving:.0f}g ≈ {items}")
 
 def main():
     # --------------------------
-    # .env読み込み
+    # .env読み込み（プロセスで1回）
     # --------------------------
-    load_dotenv()
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    if not openai.api_key:
-        st.error("OpenAI API Key が .env から取得できませんでした。")
-        return
+    api_key = llm_client.get_api_key()
 
     st.title("🍱 グラム計算アプリ")
-    st.caption("GPTに食材ごとの推奨グラム数を計算させます。回答には時間がかかる場合があります。")
+    st.caption("食品成分表から食材ごとの推奨グラム数を計算します。成分表にない食材が含まれる場合はGPTに計算させます（時間がかかる場合があります）。")
 
     # --------------------------
     # セッションステート初期化
@@ -40,8 +59,11 @@ def main():
     # --------------------------
     # GPT計算関数
     # --------------------------
-    @st.cache_data(show_spinner=True)
     def get_gpt_full_pfc(food_names, total_kcal, use_pfc=True, p_ratio=30, f_ratio=20, c_ratio=50, min_gram=50):
+        # キャッシュが効くよう入力を正規化（食材の順番は優先度なので並べ替えない）
+        food_names = llm_cache.normalize_names(food_names, keep_order=True)
+        total_kcal = llm_cache.round_target(total_kcal, 10)
+        p_ratio, f_ratio, c_ratio = (llm_cache.round_target(r) for r in (p_ratio, f_ratio, c_ratio))
         priority = {}
         for i, food in enumerate(food_names):
             if i == 0:
@@ -51,6 +73,14 @@ def main():
             else:
                 priority[food] = "副菜"
 
+        # 出力形式（response_format でスキーマを送るときは例だけ示す）
+        if structured_output.ENABLED:
+            output_format = "- JSONのみで出力。解説なし。foods に食材ごとのグラム数、total_kcal に合計カロリー、pfc に合計のPFC比率(%)"
+        else:
+            output_format = """- JSONのみで出力。解説なし。
+            例:
+            {"foods": [{"name": "ご飯", "grams": 150}, {"name": "鶏むね肉", "grams": 120}], "total_kcal": 610, "pfc": {"P": 30, "F": 20, "C": 50}}"""
+
         # PFCを指定する場合
         if use_pfc:
             prompt = f"""
@@ -64,13 +94,7 @@ def main():
             - 目標総カロリー: {total_kcal} kcal
             - PFC比率: P {p_ratio}%, F {f_ratio}%, C {c_ratio}%
             - 出力は現実的な食材量にしてください。
-            - JSONのみで出力。解説なし。
-            例:
-            {{
-              "食材グラム": {{"ご飯": 150,"鶏むね肉": 120,"納豆": 50}},
-              "合計カロリー": 610,
-              "合計PFC": {{"P": 30,"F": 20,"C": 50}}
-            }}
+            {output_format}
             """
         # PFCを指定しない場合
         else:
@@ -83,33 +107,42 @@ def main():
             - 各食材の最低量: {min_gram}g
             - 食材優先度: {priority}
             - 目標総カロリー: {total_kcal} kcal
-            - PFC比率の指定はなし
+            - PFC比率の指定はなし（pfc は null）
             - 出力は現実的な食材量にしてください。
-            - JSONのみで出力。解説なし。
-            例:
-            {{
-              "食材グラム": {{"ご飯": 150,"鶏むね肉": 120,"納豆": 50}},
-              "合計カロリー": 610
-            }}
+            {output_format}
             """
 
+        # 届いた食材から順に表示する
+        progress = st.empty()
+
+        def show_partial(partial: dict):
+            foods = [f for f in partial.get("foods") or [] if isinstance(f, dict) and "grams" in f]
+            if foods:
+                progress.caption("受信中: " + " / ".join(f"{f.get('name', '')} {f['grams']}g" for f in foods))
+
         try:
-            response = openai.chat.completions.create(
+            plan = structured_output.cached_structured(
+                functools.partial(llm_client.chat_create, task="pfc"),
                 model="gpt-5-mini",
-                messages=[{"role": "user", "content": prompt}]
+                messages=[{"role": "user", "content": prompt}],
+                schema=structured_output.PFCPlan,
+                key_parts={
+                    "task": "pfc",
+                    "foods": food_names,
+                    "total_kcal": total_kcal,
+                    "pfc": [p_ratio, f_ratio, c_ratio] if use_pfc else None,
+                    "min_gram": min_gram,
+                },
+                on_partial=show_partial,
+                task="pfc",
             )
-            content = response.choices[0].message.content.strip()
-            result = json.loads(content)
-
             # 最低グラムを下回る食材を調整
-            for food, gram in result.get("食材グラム", {}).items():
-                if gram < min_gram:
-                    result["食材グラム"][food] = min_gram
-
-            return result
+            return plan.to_result(min_gram)
         except Exception as e:
             st.warning(f"計算に失敗: {e}")
             return None
+        finally:
+            progress.empty()
 
     # --------------------------
     # 入力フォーム
@@ -119,11 +152,26 @@ def main():
         "例）ご飯, 鶏むね肉, 納豆　(主食, 主菜, 副菜・その他の順番で入力)",
         value=st.session_state["food_input"]
     )
+    # 食品成分表でどの食品として扱われそうかを表示
+    matches = []
+    found = {}
+    for name in [s.strip() for s in st.session_state["food_input"].split(",") if s.strip()]:
+        resolved = calorie_engine.resolve_food(name)
+        if resolved:
+            found[name] = resolved
+            matches.append(f"{name} → {nutrient_store.get_store().food_name[resolved[0]]}")
+        else:
+            hits = food_search.suggest(name, k=1)
+            matches.append(f"{name} → {hits[0][1]}？" if hits else f"{name} → 候補なし")
+    if matches:
+        st.caption("成分表の候補: " + " / ".join(matches))
+    if found:
+        show_substitutes(found)
 
     st.subheader("2) 目標設定")
     st.session_state["total_kcal"] = st.number_input(
         "目標総カロリー (kcal)",
-        min_value=0.0,
+        min_value=1.0,
         value=st.session_state["total_kcal"],
         step=10.0
     )
@@ -145,23 +193,53 @@ def main():
     # --------------------------
     # 計算ボタン
     # --------------------------
-    st.subheader("3) GPTに計算してもらう")
+    st.subheader("3) 計算する")
     if st.button("おすすめグラム数を取得"):
         names = [s.strip() for s in st.session_state["food_input"].split(",") if s.strip()]
         if not names:
             st.error("食材名を入力してください。")
+        elif st.session_state["total_kcal"] <= 0:
+            st.error("目標総カロリーは正の数にしてください。")
         elif st.session_state["use_pfc"] and abs((st.session_state["p_ratio"] + st.session_state["f_ratio"] + st.session_state["c_ratio"]) - 100.0) > 1e-6:
             st.error("P+F+C の合計を 100% にしてください。")
         else:
-            st.session_state["pfc_result"] = get_gpt_full_pfc(
-                names,
-                st.session_state["total_kcal"],
-                st.session_state["use_pfc"],
-                st.session_state["p_ratio"],
-                st.session_state["f_ratio"],
-                st.session_state["c_ratio"],
-                min_gram=50
-            )
+            # 全食材が成分表で見つかればローカルで最適化、1つでも無ければGPT
+            resolved = [calorie_engine.resolve_food(n) for n in names]
+            if all(resolved):
+                try:
+                    solution = pfc_solver.solve_grams(
+                        [r[0] for r in resolved],
+                        st.session_state["total_kcal"],
+                        st.session_state["use_pfc"],
+                        st.session_state["p_ratio"],
+                        st.session_state["f_ratio"],
+                        st.session_state["c_ratio"],
+                        min_gram=50
+                    )
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.session_state["pfc_result"] = pfc_solver.to_pfc_result(names, solution)
+            elif not api_key:
+                st.error("OpenAI API Key が .env から取得できませんでした。")
+            else:
+                result = get_gpt_full_pfc(
+                    names,
+                    st.session_state["total_kcal"],
+                    st.session_state["use_pfc"],
+                    st.session_state["p_ratio"],
+                    st.session_state["f_ratio"],
+                    st.session_state["c_ratio"],
+                    min_gram=50
+                )
+                if result and "食材グラム" in result:
+                    # 成分表で引ける食材だけ、食材ごとの値を成分表で計算する
+                    rows = {}
+                    for food in result["食材グラム"]:
+                        r = calorie_engine.resolve_food(food)
+                        rows[food] = r[0] if r else None
+                    result = {**result, "食材栄養": pfc_solver.food_nutrients(result["食材グラム"], rows)}
+                st.session_state["pfc_result"] = result
 
     # --------------------------
     # 計算結果表示
@@ -174,12 +252,18 @@ def main():
         grams = result["食材グラム"]
         total_cal = result.get("合計カロリー", st.session_state["total_kcal"])
 
-        total_grams = sum(grams.values())
+        nutrients = result.get("食材栄養") or {}
         data = []
         for food, gram in grams.items():
-            kcal = total_cal * (gram / total_grams)
-            data.append({"食材名": food, "推奨グラム(g)": gram, "カロリー(kcal)": round(kcal,1)})
+            # 成分表で計算した食材ごとの値（成分表にない食材は "-"）
+            n = nutrients.get(food) or {}
+            data.append({"食材名": food, "推奨グラム(g)": gram, "カロリー(kcal)": n.get("kcal"),
+                         "P(g)": n.get("P"), "F(g)": n.get("F"), "C(g)": n.get("C")})
         df = pd.DataFrame(data)
+        if df.isna().any().any():
+            # 数値と "-" が混ざると表示用の変換に失敗するので、栄養の列は文字列にそろえる
+            cols = ["カロリー(kcal)", "P(g)", "F(g)", "C(g)"]
+            df[cols] = df[cols].map(lambda v: "-" if pd.isna(v) else f"{v:.1f}")
         st.dataframe(df, use_container_width=True)
 
         if st.session_state["use_pfc"] and "合計PFC" in result:
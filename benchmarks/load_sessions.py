@@ -0,0 +1,408 @@
+# benchmarks/load_sessions.py
+"""
+同時セッションの負荷試験。main_app を実際の Streamlit サーバーとして別プロセスで起動し、
+WebSocket で多数のセッションを同時につないで各ページを操作する（OpenAI はスタブ）。
+サーバーの RSS の増え方と再実行のレイテンシ（パーセンタイル）を表示し、
+1セッションあたりのメモリから、メモリ予算に何セッション入るかを見積もる。
+
+    python benchmarks/load_sessions.py --sessions 200 --rounds 5 --budget-mb 1024
+    python benchmarks/load_sessions.py --server-env DIET_APP_SESSION_COMPACT=0   片づけなしと比べる
+    python benchmarks/load_sessions.py --json result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import websocket_connect
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+if str(BENCH_DIR) not in sys.path:
+    sys.path.insert(0, str(BENCH_DIR))
+
+from openai_stub import start_stub  # noqa: E402
+from run_benchmarks import PAGES, prepare_env  # noqa: E402
+
+SERVER_START_TIMEOUT = 120.0
+RERUN_TIMEOUT = 120.0
+# 再実行を送る前に、届いている分を読み捨てるときの待ち時間（秒）
+DRAIN_SECONDS = 0.01
+RSS_SAMPLE_SECONDS = 0.5
+
+DISHES = ("ご飯", "鶏むね肉", "納豆", "味噌汁", "焼き鮭", "ベンチ用創作料理", "食パン", "ゆで卵")
+QUESTIONS = (
+    "減量中のたんぱく質は1日どれくらい必要ですか？",
+    "筋トレの後に食べるといいものは？",
+    "夜遅くに食べると太りますか？",
+    "ベンチ用の質問です。脂質はどこまで減らしていいですか？",
+)
+CONDITIONS = ("fat<5", "0.5<=naclEq<=1", "fib not null", "prot>20", "kcal<100")
+
+
+# --------------------------
+# サーバー
+# --------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def start_server(port: int, env: dict, ready_file: Path) -> subprocess.Popen:
+    # warmup.py serve で起動し、準備完了ファイルが書かれるまで待つ
+    proc = subprocess.Popen(
+        [
+            sys.executable, str(ROOT / "warmup.py"), "serve",
+            "--server.headless", "true",
+            "--server.port", str(port),
+            "--server.fileWatcherType", "none",
+            "--browser.gatherUsageStats", "false",
+        ],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"サーバーが起動できませんでした（終了コード {proc.returncode}）")
+        try:
+            if json.loads(ready_file.read_text(encoding="utf-8")).get("ready"):
+                return proc
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("サーバーの準備が終わりませんでした")
+
+
+# --------------------------
+# 1セッション（ブラウザの代わり）
+# --------------------------
+class Session:
+    """WebSocket で main_app を操作する。ウィジェットはラベルで指定する。"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.ws = None
+        self.widgets = {}      # ラベル -> (種類, ウィジェットID, 要素)
+        self.values = {}       # ウィジェットID -> WidgetState（毎回送る値）
+        self.latencies = []    # (ページ, 秒)
+        self.errors = 0
+        self.page = "(最初の表示)"
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, max_message_size=256 * 1024 * 1024)
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    def _find(self, label: str):
+        for text, widget in self.widgets.items():
+            if text.startswith(label):
+                return widget
+        raise KeyError(f"ウィジェットが見つかりません: {label}")
+
+    def _state(self, label: str, value) -> WidgetState:
+        kind, widget_id, element = self._find(label)
+        state = WidgetState(id=widget_id)
+        if kind in ("radio", "selectbox"):
+            state.int_value = list(element.options).index(value)
+        else:
+            state.string_value = value
+        return state
+
+    def set(self, label: str, value):
+        state = self._state(label, value)
+        self.values[state.id] = state
+
+    async def rerun(self, extra=()):
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.widget_states.widgets.extend(list(self.values.values()) + list(extra))
+        # 操作していない間にサーバーから始まった再実行（session_memory の退避）の分を読み捨てる
+        while True:
+            try:
+                raw = await asyncio.wait_for(self.ws.read_message(), DRAIN_SECONDS)
+            except asyncio.TimeoutError:
+                break
+            self._handle(raw)
+        start = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        started = False
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), RERUN_TIMEOUT)
+            kind, fwd = self._handle(raw)
+            if kind == "new_session":
+                started = True
+            # こちらの再実行に割り込まれて止まったサーバー側の再実行の終わりは数えない
+            elif kind == "script_finished" and started \
+                    and fwd.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                break
+        self.latencies.append((self.page, time.perf_counter() - start))
+
+    def _handle(self, raw):
+        if raw is None:
+            raise ConnectionError("サーバーが接続を閉じました")
+        fwd = ForwardMsg()
+        fwd.ParseFromString(raw)
+        kind = fwd.WhichOneof("type")
+        if kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+            self._record(fwd.delta.new_element)
+        return kind, fwd
+
+    def _record(self, element):
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.errors += 1
+            return
+        sub = getattr(element, kind)
+        widget_id = getattr(sub, "id", "")
+        if widget_id:
+            self.widgets[getattr(sub, "label", widget_id)] = (kind, widget_id, sub)
+
+    async def click(self, label: str, fields: dict | None = None):
+        # ボタン（フォームの送信ボタンなら fields をその回だけ一緒に送る）
+        _, widget_id, _ = self._find(label)
+        extra = [self._state(k, v) for k, v in (fields or {}).items()]
+        await self.rerun(extra + [WidgetState(id=widget_id, trigger_value=True)])
+
+    async def open_page(self, page: str):
+        self.page = page
+        self.set("使用するアプリを選んでください", page)
+        await self.rerun()
+
+
+# --------------------------
+# ページごとの操作
+# --------------------------
+async def act_tdee(s: Session, rng: random.Random, args):
+    await s.rerun()
+
+
+async def act_pfc(s: Session, rng: random.Random, args):
+    await s.click("おすすめグラム数を取得")
+
+
+async def act_calorie(s: Session, rng: random.Random, args):
+    s.set("料理名", rng.choice(DISHES))
+    s.set("量を入力してください", f"{rng.choice((100, 150, 200))}g")
+    await s.rerun()
+    await s.click("料理を追加")
+    await s.click("合計カロリー計算")
+
+
+async def act_chat(s: Session, rng: random.Random, args):
+    for _ in range(args.chat_turns):
+        await s.click("送信", {"質問を入力してください": rng.choice(QUESTIONS)})
+
+
+async def act_food_query(s: Session, rng: random.Random, args):
+    s.set("条件", rng.choice(CONDITIONS))
+    await s.rerun()
+
+
+ACTIONS = {
+    "TDEE計算アプリ": act_tdee,
+    "グラム計算アプリ": act_pfc,
+    "カロリー予測アプリ": act_calorie,
+    "AI質問アプリ": act_chat,
+    "食品検索アプリ": act_food_query,
+}
+
+
+async def run_session(i: int, url: str, args, sessions: list):
+    rng = random.Random(args.seed * 100_003 + i)
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    s = Session(url)
+    sessions.append(s)
+    await s.connect()
+    await s.rerun()
+    pages = list(PAGES)
+    for r in range(args.rounds):
+        page = pages[(i + r) % len(pages)]
+        try:
+            await s.open_page(page)
+            await ACTIONS[page](s, rng, args)
+        except KeyError:
+            # 画面が想定と違う（例外で途中までしか描かれなかった）
+            s.errors += 1
+        await asyncio.sleep(rng.uniform(0, args.think))
+
+
+async def drive(url: str, args, pid: int) -> dict:
+    sessions = []
+    rss = []
+    done = asyncio.Event()
+
+    async def sample():
+        while not done.is_set():
+            rss.append(rss_bytes(pid))
+            await asyncio.sleep(RSS_SAMPLE_SECONDS)
+
+    sampler = asyncio.create_task(sample())
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(run_session(i, url, args, sessions) for i in range(args.sessions)),
+                                    return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    # 全セッションがつながったままの状態
+    await asyncio.sleep(args.settle)
+    loaded_rss = rss_bytes(pid)
+    for s in sessions:
+        s.close()
+    await asyncio.sleep(args.settle)
+    done.set()
+    await sampler
+    return {
+        "sessions": sessions,
+        "failed": [o for o in outcomes if isinstance(o, BaseException)],
+        "elapsed": elapsed,
+        "rss_samples": rss,
+        "loaded_rss": loaded_rss,
+        "closed_rss": rss_bytes(pid),
+    }
+
+
+# --------------------------
+# 集計
+# --------------------------
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    arr = np.asarray(values) * 1000
+    return {f"p{q}": float(np.percentile(arr, q)) for q in (50, 90, 95, 99)} | {"max": float(arr.max())}
+
+
+def last_sessions_event(log_path: Path) -> dict:
+    # サーバーの session_memory が書いた最後の集計
+    event = {}
+    try:
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                if '"type": "sessions"' in line:
+                    event = json.loads(line)
+    except OSError:
+        pass
+    return event
+
+
+def summarize(args, base_rss: int, run: dict, server_stats: dict, llm_requests: int) -> dict:
+    sessions = run["sessions"]
+    latencies = [lat for s in sessions for _, lat in s.latencies]
+    by_page = {}
+    for s in sessions:
+        for page, lat in s.latencies:
+            by_page.setdefault(page, []).append(lat)
+    mb = 1024 * 1024
+    per_session = max(run["loaded_rss"] - base_rss, 0) / max(len(sessions), 1)
+    budget = args.budget_mb * mb
+    return {
+        "settings": {k: v for k, v in vars(args).items() if k not in ("json",)},
+        "sessions": len(sessions),
+        "failed_sessions": len(run["failed"]),
+        "errors": sum(s.errors for s in sessions) + len(run["failed"]),
+        "reruns": len(latencies),
+        "llm_requests": llm_requests,
+        "elapsed_s": run["elapsed"],
+        "reruns_per_sec": len(latencies) / run["elapsed"] if run["elapsed"] else 0.0,
+        "latency_ms": percentiles(latencies),
+        "latency_ms_by_page": {page: percentiles(v) for page, v in sorted(by_page.items())},
+        "rss_mb": {
+            "before": base_rss / mb,
+            "peak": max(run["rss_samples"] + [run["loaded_rss"]]) / mb,
+            "with_sessions": run["loaded_rss"] / mb,
+            "after_close": run["closed_rss"] / mb,
+        },
+        "per_session_kb": per_session / 1024,
+        "server_state_kb": {
+            "tracked_sessions": server_stats.get("sessions"),
+            "total": (server_stats.get("state_bytes") or 0) / 1024,
+            "evicted_total": server_stats.get("evicted_total"),
+        },
+        "budget_mb": args.budget_mb,
+        "sessions_in_budget": int((budget - base_rss) // per_session) if per_session and budget > base_rss else None,
+    }
+
+
+def print_report(report: dict):
+    print(f"セッション {report['sessions']}（失敗 {report['failed_sessions']}、エラー {report['errors']}）"
+          f" / 再実行 {report['reruns']} 回 / {report['elapsed_s']:.1f} 秒（{report['reruns_per_sec']:.1f} 回/秒）"
+          f" / LLM呼び出し {report['llm_requests']} 回")
+    lat = report["latency_ms"]
+    if lat:
+        print(f"再実行レイテンシ(ms): p50 {lat['p50']:.0f}  p90 {lat['p90']:.0f}  p95 {lat['p95']:.0f}"
+              f"  p99 {lat['p99']:.0f}  max {lat['max']:.0f}")
+    for page, p in report["latency_ms_by_page"].items():
+        print(f"  {page:<12} p50 {p['p50']:7.0f}  p95 {p['p95']:7.0f}  p99 {p['p99']:7.0f}")
+    rss = report["rss_mb"]
+    print(f"RSS(MB): 開始 {rss['before']:.1f} → 接続中 {rss['with_sessions']:.1f}（最大 {rss['peak']:.1f}）"
+          f" → 切断後 {rss['after_close']:.1f}")
+    state = report["server_state_kb"]
+    print(f"1セッションあたり: RSS {report['per_session_kb']:.1f} KB"
+          f" / session_state 合計 {state['total']:.1f} KB（{state['tracked_sessions']} セッション、退避 累計{state['evicted_total']}回）")
+    if report["sessions_in_budget"] is not None:
+        print(f"{report['budget_mb']} MB に入るセッション数の見積もり: {report['sessions_in_budget']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多数の同時セッションで main_app のメモリとレイテンシを測る")
+    parser.add_argument("--sessions", type=int, default=200, help="同時セッション数")
+    parser.add_argument("--rounds", type=int, default=5, help="1セッションあたりのページ操作の回数")
+    parser.add_argument("--chat-turns", type=int, default=3, help="AI質問ページで1回に送る質問数")
+    parser.add_argument("--ramp", type=float, default=10.0, help="全セッションがつながるまでの秒数")
+    parser.add_argument("--think", type=float, default=1.0, help="操作の間の待ち（0〜この秒数）")
+    parser.add_argument("--settle", type=float, default=2.0, help="計測前に待つ秒数")
+    parser.add_argument("--latency", type=float, default=0.2, help="スタブLLMの応答待ち（秒）")
+    parser.add_argument("--budget-mb", type=float, default=1024, help="見積もりに使うメモリ予算（MB）")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="サーバーに渡す環境変数（例: DIET_APP_SESSION_COMPACT=0）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+
+    stub = start_stub(latency=args.latency)
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix="diet_app_load_") as workdir:
+        workdir = Path(workdir)
+        prepare_env(stub.base_url, workdir)
+        env = dict(os.environ)
+        env.update(kv.split("=", 1) for kv in args.server_env)
+        proc = start_server(port, env, Path(env["DIET_APP_READY_FILE"]))
+        try:
+            base_rss = rss_bytes(proc.pid)
+            run = asyncio.run(drive(f"ws://127.0.0.1:{port}/_stcore/stream", args, proc.pid))
+            server_stats = last_sessions_event(Path(env["DIET_APP_METRICS_LOG"]))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+            stub.shutdown()
+    report = summarize(args, base_rss, run, server_stats, stub.requests)
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2, default=str) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
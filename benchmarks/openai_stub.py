@@ -0,0 +1,228 @@
+# benchmarks/openai_stub.py
+"""
+ベンチマーク用のOpenAI互換スタブサーバー（ネットワーク不要）。
+/v1/chat/completions に対して、プロンプトの種類に合わせた固定の応答を返す。
+
+    python benchmarks/openai_stub.py --port 8765 --latency 0.3
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run main_app.py
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ストリーミング時に1チャンクへ入れる文字数
+STREAM_CHUNK_CHARS = 8
+
+CHAT_REPLY = (
+    "## ポイント\n"
+    "- たんぱく質は体重1kgあたり1.6〜2.2gを目安にしましょう。\n"
+    "- **睡眠**と**トレーニングの継続**が大切です。\n"
+    "食事は主食・主菜・副菜をそろえると、PFCバランスが整いやすくなります。"
+)
+
+
+# --------------------------
+# 応答の組み立て
+# --------------------------
+def reply_for(messages: list, schema: str | None = None) -> str:
+    # PFC_app / dish_estimator / AI_question_app のプロンプトを見分けて返す
+    # schema は response_format で送られた JSON スキーマの名前（構造化出力）
+    prompt = messages[-1]["content"] if messages else ""
+    foods = re.search(r"- 食材: (.+)", prompt)
+    if foods and "JSON" in prompt:
+        names = [n.strip() for n in foods.group(1).split(",") if n.strip()]
+        return json.dumps(
+            {
+                "foods": [{"name": n, "grams": 100} for n in names],
+                "total_kcal": 150 * len(names),
+                "pfc": {"P": 30, "F": 20, "C": 50},
+            },
+            ensure_ascii=False,
+        )
+    dish = re.search(r"料理: (.+?): ", prompt)
+    if dish:
+        if schema == "DishNutrition":
+            return json.dumps({"kcal": 520, "P": 22.0, "F": 14.0, "C": 70.0})
+        return f"{dish.group(1)}: 520 kcal, たんぱく質 22.0 g, 脂質 14.0 g, 炭水化物 70.0 g"
+    if messages and messages[0]["role"] == "system" and "要約" in messages[0]["content"]:
+        return "- ユーザーは減量中で、たんぱく質の摂り方を気にしている"
+    return CHAT_REPLY
+
+
+def _usage(messages: list, content: str) -> dict:
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(content),
+        "total_tokens": prompt_tokens + len(content),
+    }
+
+
+def completion_body(model: str, messages: list, schema: str | None = None) -> dict:
+    content = reply_for(messages, schema)
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": _usage(messages, content),
+    }
+
+
+def stream_chunks(model: str, messages: list, include_usage: bool, schema: str | None = None):
+    content = reply_for(messages, schema)
+    base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+    for i in range(0, len(content), STREAM_CHUNK_CHARS):
+        delta = {"content": content[i:i + STREAM_CHUNK_CHARS]}
+        if i == 0:
+            delta["role"] = "assistant"
+        yield {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    if include_usage:
+        yield {**base, "choices": [], "usage": _usage(messages, content)}
+
+
+# --------------------------
+# HTTPサーバー
+# --------------------------
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # サーバー側で上書きする
+    latency = 0.0
+    token_interval = 0.0
+    max_concurrent = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+            return
+
+        self.server.requests += 1
+        # 同時実行数の上限を超えたら 429 を返す（レート制限の再現）
+        if not self.server.enter():
+            self.server.throttled += 1
+            data = json.dumps({"error": {"message": "rate limited", "type": "rate_limit_error"}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", "0.2")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        try:
+            self._respond(request)
+        finally:
+            self.server.leave()
+
+    def _respond(self, request: dict):
+        model = request.get("model", "stub")
+        messages = request.get("messages", [])
+        schema = ((request.get("response_format") or {}).get("json_schema") or {}).get("name")
+        time.sleep(self.latency)
+        if not request.get("stream"):
+            self._send_json(200, completion_body(model, messages, schema))
+            return
+
+        include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in stream_chunks(model, messages, include_usage, schema):
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            if self.token_interval:
+                time.sleep(self.token_interval)
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, token_interval: float = 0.0,
+                 max_concurrent: int = 0):
+        handler = type("Handler", (StubHandler,), {"latency": latency, "token_interval": token_interval})
+        super().__init__((host, port), handler)
+        self.max_concurrent = max_concurrent
+        self.requests = 0
+        self.throttled = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def enter(self) -> bool:
+        with self._lock:
+            if self.max_concurrent and self.active >= self.max_concurrent:
+                return False
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_stub(latency: float = 0.0, token_interval: float = 0.0, port: int = 0, max_concurrent: int = 0) -> StubServer:
+    """バックグラウンドスレッドでスタブを起動する。止めるときは server.shutdown()。"""
+    server = StubServer(port=port, latency=latency, token_interval=token_interval, max_concurrent=max_concurrent)
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenAI互換のスタブサーバー")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="応答までの待ち時間（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="ストリーミングのチャンク間隔（秒）")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="これを超える同時リクエストに429を返す（0で無制限）")
+    args = parser.parse_args(argv)
+
+    server = StubServer(
+        port=args.port, latency=args.latency, token_interval=args.token_interval, max_concurrent=args.max_concurrent
+    )
+    print(f"OPENAI_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+# benchmarks/run_benchmarks.py
+"""
+オフラインのベンチマーク。main_app と各ページを AppTest でヘッドレスに動かし、
+OpenAI はローカルのスタブ（benchmarks/openai_stub.py）に向ける。
+
+    python benchmarks/run_benchmarks.py                   ベースラインと比較して表示
+    python benchmarks/run_benchmarks.py --check           遅くなった項目があれば終了コード1
+    python benchmarks/run_benchmarks.py --update-baseline 今回の結果をベースラインとして保存
+
+指標名の末尾で良し悪しの向きを決める（_ms / _kb は小さいほど良い、_per_sec は大きいほど良い）。
+時間の指標は基準との差が --min-delta-ms 未満なら悪化とみなさず、rerun.* は許容する割合を広げる。
+1回しか測れない cold_ms / first_ms は参考値（比較は表示するが悪化の判定には使わない）。
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+DEFAULT_TOLERANCE = 0.25
+# 時間の指標は、基準との差がこれ未満なら悪化とみなさない（1CPU の環境では数msの揺れが普通にある）
+DEFAULT_MIN_DELTA_MS = 5.0
+# 再実行の時間（rerun.*）は1回あたり10ms前後で揺れが大きいので、許容する割合をこの倍にする
+RERUN_TOLERANCE_FACTOR = 2.0
+# 1回しか測れない指標（初回の読み込みを含む）は揺れが大きいので参考値にする
+SINGLE_SHOT_SUFFIXES = ("cold_ms", "first_ms")
+# スループットを測る回数（一番速い回を使う）
+THROUGHPUT_TRIALS = 3
+DEFAULT_LATENCY = 0.2
+
+if str(BENCH_DIR) not in sys.path:
+    sys.path.insert(0, str(BENCH_DIR))
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from openai_stub import start_stub  # noqa: E402
+
+# main_app のラジオボタンの表示名 → 指標名に使うモジュール名
+PAGES = {
+    "TDEE計算アプリ": "tdee_app",
+    "グラム計算アプリ": "PFC_app",
+    "カロリー予測アプリ": "calorie_app",
+    "AI質問アプリ": "AI_question_app",
+    "食品検索アプリ": "food_query_app",
+}
+MAIN_APP = str(ROOT / "main_app.py")
+APP_TIMEOUT = 60
+
+
+# --------------------------
+# 準備
+# --------------------------
+def prepare_env(base_url: str, workdir: Path):
+    # リポジトリのモジュールを読み込む前に呼ぶ（各モジュールは import 時に環境変数を読む）
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_MAX_RETRIES"] = "0"
+    os.environ["LLM_CACHE_PATH"] = str(workdir / "llm_cache.sqlite3")
+    # 毎回LLMを呼ぶ経路を測るため、キャッシュは常に期限切れにする
+    os.environ["LLM_CACHE_TTL"] = "0"
+    os.environ["DIET_APP_METRICS_LOG"] = str(workdir / "metrics.jsonl")
+    os.environ["MEAL_LOG_PATH"] = str(workdir / "meal_log.sqlite3")
+    os.environ["DIET_APP_READY_FILE"] = str(workdir / "ready.json")
+    os.environ["DIET_APP_SESSION_SPILL_DIR"] = str(workdir / "sessions")
+    os.environ.pop("DIET_APP_PROFILE", None)
+
+
+def _check(at, what: str):
+    if at.exception:
+        raise RuntimeError(f"{what} で例外が発生しました: {at.exception[0].message}")
+    return at
+
+
+def _ms(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def _best_ms(fn, trials: int = THROUGHPUT_TRIALS) -> float:
+    # スループットは一番速かった回で見る（遅い回は他の処理やVMの揺れによるもの）
+    return min(_ms(fn) for _ in range(trials))
+
+
+def _median_ms(fn, repeat: int) -> float:
+    return statistics.median(_ms(fn) for _ in range(repeat))
+
+
+def _page_app(page: str):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(MAIN_APP, default_timeout=APP_TIMEOUT).run()
+    at.radio[0].set_value(page)
+    return _check(at.run(), page)
+
+
+# --------------------------
+# 計測項目
+# --------------------------
+def bench_reruns(results: dict, repeat: int):
+    from streamlit.testing.v1 import AppTest
+
+    # 最初の1回はモジュールの読み込み・キャッシュ構築を含む
+    at = AppTest.from_file(MAIN_APP, default_timeout=APP_TIMEOUT)
+    results["rerun.main_app.cold_ms"] = _ms(lambda: _check(at.run(), "main_app"))
+    pages = list(PAGES)
+    for i, (page, module) in enumerate(PAGES.items()):
+        at.radio[0].set_value(page)
+        results[f"rerun.{module}.first_ms"] = _ms(lambda: _check(at.run(), page))
+        results[f"rerun.{module}.warm_ms"] = _median_ms(lambda: _check(at.run(), page), repeat)
+
+        # 別のページから切り替えたときの表示（first_ms と違って何回も測れる）
+        def switch():
+            other = pages[(i + 1) % len(pages)]
+            at.radio[0].set_value(other)
+            _check(at.run(), other)
+            at.radio[0].set_value(page)
+            return _ms(lambda: _check(at.run(), page))
+
+        results[f"rerun.{module}.switch_ms"] = statistics.median(switch() for _ in range(repeat))
+
+
+def bench_flows(results: dict, repeat: int, server):
+    def flow(name: str, at, click):
+        before = server.requests
+        results[f"flow.{name}_ms"] = _median_ms(lambda: _check(click(at), name), repeat)
+        results[f"info.{name}.llm_requests"] = (server.requests - before) / repeat
+
+    # カロリー予測: 成分表で計算できる料理だけ / AIに聞く料理を含む
+    local_dishes = [
+        {"name": "ご飯", "food_id": None, "info": {"amount_text": "150g"}, "amount_known": "はい、わかる"},
+        {"name": "鶏むね肉", "food_id": None, "info": {"portion": "普通"}, "amount_known": "いいえ、わからない"},
+    ]
+    llm_dishes = local_dishes + [
+        {"name": f"ベンチ用創作料理{i}", "food_id": None, "info": {"portion": "普通"}, "amount_known": "いいえ、わからない"}
+        for i in range(3)
+    ]
+    for name, dishes in (("calorie_local", local_dishes), ("calorie_llm", llm_dishes)):
+        at = _page_app("カロリー予測アプリ")
+        at.session_state.dishes = [dict(d) for d in dishes]
+        flow(name, _check(at.run(), name), lambda at: at.button(key="calc_calorie_button").click().run())
+
+    # グラム計算: ローカル最適化 / AIにフォールバック
+    for name, foods in (("pfc_local", "ご飯, 鶏むね肉, 納豆"), ("pfc_llm", "ご飯, ベンチ用創作料理")):
+        at = _page_app("グラム計算アプリ")
+        at.text_input[0].input(foods)
+        at = _check(at.run(), name)
+        button = next(i for i, b in enumerate(at.button) if b.label == "おすすめグラム数を取得")
+        flow(name, at, lambda at: at.button[button].click().run())
+
+    # AI質問: 長い会話（400往復）のときの再実行
+    at = _page_app("AI質問アプリ")
+    at.session_state.messages = [{"role": "system", "content": "ベンチ用"}] + [
+        {"role": role, "content": f"## {role} {i}\n**太字**を含む発言です。" * 5}
+        for i in range(400)
+        for role in ("user", "assistant")
+    ]
+    results["rerun.AI_question_app.long_chat_ms"] = _median_ms(lambda: _check(at.run(), "long_chat"), repeat)
+
+    # AI質問: 送信してストリーミングで返答を受け取るまで
+    at = _page_app("AI質問アプリ")
+
+    def submit(question):
+        def click(at):
+            at.text_area(key="user_input").input(question)
+            return at.button[0].click().run()
+        return click
+
+    flow("chat_submit", at, submit("減量中のたんぱく質の目安を教えてください"))
+    # personality_data.csv にある質問はLLMを呼ばずに即答する
+    flow("chat_faq_hit", at, submit("自分の長所と短所は何ですか？"))
+
+
+def bench_burst(results: dict, server, callers: int = 48, duplicates: int = 16, max_concurrent: int = 6):
+    # 同時に大量の呼び出しが来たとき（スタブ側は max_concurrent を超えると 429 を返す）
+    from concurrent.futures import ThreadPoolExecutor
+
+    import llm_client
+
+    def call(i: int):
+        # 後ろの duplicates 件は同じ内容（single-flight でまとめられる想定）
+        n = i if i < callers - duplicates else -1
+        task = "chat" if i % 4 == 0 else "batch"
+        messages = [{"role": "user", "content": f"ベンチ用の質問{n}"}]
+        try:
+            if task == "chat":
+                "".join(
+                    c.choices[0].delta.content or ""
+                    for c in llm_client.chat_create(task=task, model="gpt-5-mini", messages=messages, stream=True)
+                    if c.choices
+                )
+            else:
+                llm_client.chat_create(task=task, model="gpt-5-mini", messages=messages)
+            return None
+        except Exception as e:
+            return e
+
+    before_requests, before_throttled = server.requests, server.throttled
+    server.max_concurrent, server.peak = max_concurrent, 0
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=callers) as pool:
+            errors = [e for e in pool.map(call, range(callers)) if e is not None]
+        elapsed = time.perf_counter() - start
+    finally:
+        server.max_concurrent = 0
+    results["burst.total_ms"] = elapsed * 1000
+    results["burst.calls_per_sec"] = callers / elapsed
+    results["info.burst.errors"] = len(errors)
+    results["info.burst.http_requests"] = server.requests - before_requests
+    results["info.burst.throttled"] = server.throttled - before_throttled
+    results["info.burst.peak_concurrency"] = server.peak
+
+
+def bench_memory(results: dict):
+    # 1セッション（全ページを一通り表示）で増える Python オブジェクトのメモリ
+    from streamlit.testing.v1 import AppTest
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    at = AppTest.from_file(MAIN_APP, default_timeout=APP_TIMEOUT).run()
+    for page in PAGES:
+        at.radio[0].set_value(page)
+        _check(at.run(), page)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    grown = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    results["memory.session_kb"] = grown / 1024
+    results["memory.session_peak_kb"] = peak / 1024
+    del at
+
+
+def bench_tdee(results: dict, n: int):
+    import numpy as np
+
+    import tdee_app
+    import tdee_batch
+
+    rng = np.random.default_rng(0)
+    weights = rng.uniform(40, 120, n).tolist()
+    heights = rng.uniform(140, 200, n).tolist()
+    ages = rng.integers(18, 80, n).tolist()
+    fats = rng.uniform(5, 40, n).tolist()
+    sexes = ["男性" if s else "女性" for s in rng.integers(0, 2, n)]
+
+    def scalar_mifflin():
+        for s, w, h, a in zip(sexes, weights, heights, ages):
+            tdee_app.round_int(tdee_app.mifflin_st_jeor_bmr(s, w, h, a) * 1.55)
+
+    def scalar_katch():
+        for w, f in zip(weights, fats):
+            tdee_app.round_int(tdee_app.katch_mcardle_bmr(w, f) * 1.55)
+
+    import pandas as pd
+
+    activity = list(tdee_app.ACTIVITY_FACTORS)
+    df = pd.DataFrame({
+        "sex": sexes,
+        "age": ages,
+        "weight": weights,
+        "height": heights,
+        "body_fat": fats,
+        "activity": [activity[i % len(activity)] for i in range(n)],
+        "unit": "メートル法（kg, cm）",
+        "formula": "Mifflin-St Jeor",
+    })
+    results["throughput.tdee_mifflin_per_sec"] = n / (_best_ms(scalar_mifflin) / 1000)
+    results["throughput.tdee_katch_per_sec"] = n / (_best_ms(scalar_katch) / 1000)
+    results["throughput.tdee_batch_rows_per_sec"] = n / (_best_ms(lambda: tdee_batch.compute_targets(df)) / 1000)
+
+
+def bench_quantity(results: dict, n: int = 100_000):
+    import quantity_parser
+
+    samples = ["150g", "1杯", "大盛り", "2個", "1/2丁", "大さじ2", "200ml", "一切れ", "1杯半", "約80グラム"]
+    groups = [1, 1, 1, 12, 4, 14, 13, 10, 1, 11]
+    texts = [f"{i % 997}g" if i % 2 else samples[i % len(samples)] for i in range(n)]
+    group_ids = [groups[i % len(groups)] for i in range(n)]
+
+    def cold():
+        quantity_parser.parse.cache_clear()
+        quantity_parser.to_grams_many(texts, group_ids)
+
+    results["throughput.quantity_cold_per_sec"] = n / (_best_ms(cold) / 1000)
+    results["throughput.quantity_warm_per_sec"] = n / (_best_ms(lambda: quantity_parser.to_grams_many(texts, group_ids)) / 1000)
+
+
+def bench_composite_dishes(results: dict, workdir: Path, n: int = 100_000):
+    import composite_dishes
+    from nutrient_store import get_store
+
+    store = get_store()
+    path = workdir / "composite_dishes.npz"
+    results["build.composite_full_ms"] = _ms(lambda: composite_dishes.build_table(store, path=path, force=True))
+    # 1品だけ材料を変えたときの再計算
+    recipes = dict(composite_dishes.RECIPES)
+    name = next(iter(recipes))
+    recipes[name] = recipes[name] + [(14006, 1)]
+    results["build.composite_incremental_ms"] = _ms(lambda: composite_dishes.build_table(store, recipes, path))
+    results["build.composite_load_ms"] = _ms(lambda: composite_dishes.build_table(store, recipes, path))
+
+    table = composite_dishes.load_table(store, recipes, path)
+    names = [table.names[i % len(table)] for i in range(n)]
+    portions = ["少なめ", "普通", "大盛り"]
+    results["throughput.composite_lookup_per_sec"] = n / (_best_ms(
+        lambda: [table.lookup(name, portions[i % 3]) for i, name in enumerate(names)]
+    ) / 1000)
+
+
+def bench_substitutes(results: dict):
+    import numpy as np
+
+    import food_substitutes
+    from nutrient_store import get_store
+
+    store = get_store()
+    results["build.substitute_index_ms"] = _ms(lambda: food_substitutes.SubstituteIndex(store))
+    index = food_substitutes.SubstituteIndex(store)
+    rows = np.arange(len(store))
+    single = rows[::10]
+    results["throughput.substitute_single_per_sec"] = len(single) / (_best_ms(lambda: [index.similar(int(r)) for r in single]) / 1000)
+    results["throughput.substitute_batch_per_sec"] = len(rows) / (_best_ms(lambda: index.similar_many(rows)) / 1000)
+
+
+def bench_meal_plans(results: dict, n: int = 300):
+    import meal_planner
+
+    clients = [(i, 1800.0 + (i % 7) * 150.0, 30.0, 20.0, 50.0) for i in range(n)]
+    meal_planner.plan_clients(clients[:1])
+    results["throughput.meal_plans_per_sec"] = n / (_best_ms(lambda: meal_planner.plan_clients(clients)) / 1000)
+
+
+def bench_food_query(results: dict, repeat: int = 200):
+    import food_query
+    from nutrient_store import get_store
+
+    store = get_store()
+    results["build.food_query_index_ms"] = _ms(lambda: food_query.FoodQuery(store))
+    engine = food_query.FoodQuery(store)
+    shapes = {
+        "range": lambda: engine.select([("naclEq", ">=", 0.5), ("naclEq", "<=", 1.0)]),
+        "conjunction": lambda: engine.select(["fat<5", "prot>=15", "kcal>=50"]),
+        "group_topk": lambda: engine.query(["fat<5"], group=11, order_by="prot_per_100kcal", k=20),
+        "full_topk": lambda: engine.query(order_by="fib", k=20),
+        "null_check": lambda: engine.select(["fib not null", "vitC>=10"], group=6),
+    }
+    for name, fn in shapes.items():
+        results[f"throughput.query_{name}_per_sec"] = repeat / (_best_ms(lambda: [fn() for _ in range(repeat)]) / 1000)
+
+
+# --------------------------
+# ベースラインとの比較
+# --------------------------
+def _direction(name: str) -> int:
+    # 1: 大きいほど良い / -1: 小さいほど良い / 0: 参考値
+    if name.endswith(SINGLE_SHOT_SUFFIXES):
+        return 0
+    if name.endswith("_per_sec"):
+        return 1
+    if name.endswith("_ms") or name.endswith("_kb"):
+        return -1
+    return 0
+
+
+def _is_worse(name: str, value: float, ref: float, tolerance: float, min_delta_ms: float) -> bool:
+    direction = _direction(name)
+    if not direction:
+        return False
+    if name.startswith("rerun."):
+        tolerance *= RERUN_TOLERANCE_FACTOR
+    ratio = value / ref
+    if direction > 0:
+        return ratio < 1 - tolerance
+    if name.endswith("_ms") and value - ref < min_delta_ms:
+        return False
+    return ratio > 1 + tolerance
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float = DEFAULT_MIN_DELTA_MS) -> list:
+    regressions = []
+    base = baseline.get("results", {})
+    print(f"{'指標':<44}{'今回':>14}{'基準':>14}{'比':>8}")
+    for name, value in results.items():
+        ref = base.get(name)
+        mark = ""
+        ratio = value / ref if ref else None
+        if ratio is not None and _is_worse(name, value, ref, tolerance, min_delta_ms):
+            mark = "  ← 悪化"
+            regressions.append(name)
+        ref_text = f"{ref:14.1f}" if ref is not None else f"{'-':>14}"
+        ratio_text = f"{ratio:8.2f}" if ratio is not None else f"{'-':>8}"
+        print(f"{name:<44}{value:14.1f}{ref_text}{ratio_text}{mark}")
+    return regressions
+
+
+def run(args) -> dict:
+    server = start_stub(latency=args.latency, token_interval=args.token_interval)
+    with tempfile.TemporaryDirectory(prefix="diet_app_bench_") as workdir:
+        prepare_env(server.base_url, Path(workdir))
+        results = {}
+        try:
+            bench_reruns(results, args.repeat)
+            bench_flows(results, args.repeat, server)
+            bench_burst(results, server)
+            bench_memory(results)
+            bench_tdee(results, args.tdee_rows)
+            bench_quantity(results)
+            bench_composite_dishes(results, Path(workdir))
+            bench_substitutes(results)
+            bench_meal_plans(results)
+            bench_food_query(results)
+        finally:
+            server.shutdown()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AppTest とスタブLLMでアプリの性能を測る")
+    parser.add_argument("--repeat", type=int, default=5, help="再実行・ボタン操作の繰り返し回数（中央値を使う）")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="スタブLLMの応答待ち（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="スタブLLMのストリーミング間隔（秒）")
+    parser.add_argument("--tdee-rows", type=int, default=200_000, help="TDEE関数のスループット計測件数")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="悪化とみなす割合（0.25 = 25%%）")
+    parser.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS,
+                        help="時間の指標で、基準との差がこれ未満なら悪化とみなさない（ms）")
+    parser.add_argument("--update-baseline", action="store_true", help="今回の結果をベースラインに保存")
+    parser.add_argument("--check", action="store_true", help="悪化した項目があれば終了コード1")
+    parser.add_argument("--json", type=Path, help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report = {
+        "settings": {
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "token_interval": args.token_interval,
+            "tdee_rows": args.tdee_rows,
+        },
+        "machine": {"python": platform.python_version(), "platform": platform.platform()},
+        "results": {k: round(v, 3) for k, v in results.items()},
+    }
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("settings") != report["settings"]:
+            print(f"注意: ベースラインと計測条件が違います（基準: {baseline.get('settings')}）")
+    regressions = compare(report["results"], baseline, args.tolerance, args.min_delta_ms)
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"ベースラインを更新しました: {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} 項目が {args.tolerance:.0%} を超えて悪化しました: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
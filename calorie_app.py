@@ -1,19 +1,23 @@
 # calorie_app.py
+import datetime as dt
+
 import streamlit as st
-import openai
-from dotenv import load_dotenv
-import os
+
+import calorie_engine
+import dish_estimator
+import food_search
+import llm_client
+import meal_log
+import structured_output
+
+# 目標カロリーの種類（tdee_app がセッションに保存するキー）
+GOALS = {"維持": "tdee", "減量(-10%)": "cut_10", "増量(+10%)": "bulk_10"}
 
 def main():
     # --------------------------
-    # APIキー読み込み
+    # APIキー読み込み（食品成分表で計算できない料理にだけ使う）
     # --------------------------
-    load_dotenv()
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        st.error("OpenAI API Key が取得できません。")
-        st.stop()
-    openai.api_key = api_key
+    api_key = llm_client.get_api_key()
 
     # --------------------------
     # セッションステート初期化
@@ -27,6 +31,14 @@ def main():
     if "delete_index" not in st.session_state:
         st.session_state.delete_index = None
 
+    # 記録用に、計算結果を料理ごとの値でも持っておく
+    if "calorie_items" not in st.session_state:
+        st.session_state.calorie_items = []
+
+    # 計算結果（料理ごとの値と合計）。MealEstimate を model_dump したもの
+    if "calorie_meal" not in st.session_state:
+        st.session_state.calorie_meal = None
+
     # --------------------------
     # メインUI
     # --------------------------
@@ -42,6 +54,18 @@ def main():
     # --------------------------
     st.subheader("新しい料理を追加")
     dish_name = st.text_input("料理名（例：カレーライス）", key="dish_name_input")
+
+    # 食品成分表の候補（選ぶとAIを使わずに計算できる）
+    food_id = None
+    candidates = food_search.suggest(dish_name)
+    if candidates:
+        names = dict(candidates)
+        food_id = st.selectbox(
+            "食品成分表の候補（任意）",
+            options=[None] + list(names),
+            format_func=lambda x: "指定しない" if x is None else names[x],
+            key="food_candidate_input"
+        )
     amount_known = st.radio(
         "量はわかりますか？",
         options=["はい、わかる", "いいえ、わからない"],
@@ -51,7 +75,7 @@ def main():
     dish_info = {}
     if amount_known == "はい、わかる":
         dish_info["amount_text"] = st.text_input(
-            "量を入力してください（例：150g）",
+            "量を入力してください（例：150g、1杯、大さじ2、半分）",
             key="amount_text_input"
         )
     else:
@@ -67,9 +91,12 @@ def main():
             st.session_state.dishes.append({
                 "name": dish_name,
                 "info": dish_info,
-                "amount_known": amount_known
+                "amount_known": amount_known,
+                "food_id": food_id
             })
             st.session_state.calorie_result = ""  # 結果リセット
+            st.session_state.calorie_items = []
+            st.session_state.calorie_meal = None
 
     # --------------------------
     # 削除処理（描画前に行う）
@@ -78,6 +105,8 @@ def main():
         st.session_state.dishes.pop(st.session_state.delete_index)
         st.session_state.delete_index = None
         st.session_state.calorie_result = ""  # 結果リセット
+        st.session_state.calorie_items = []
+        st.session_state.calorie_meal = None
 
     # --------------------------
     # 登録済み料理リスト（削除ボタン付き）
@@ -97,41 +126,36 @@ def main():
         if len(st.session_state.dishes) == 0:
             st.warning("少なくとも1つの料理を追加してください。")
         else:
-            dish_lines = []
-            for d in st.session_state.dishes:
-                if d["amount_known"] == "はい、わかる":
-                    line = f"{d['name']}: {d['info']['amount_text']}"
-                else:
-                    line = f"{d['name']}: 量不明（{d['info']['portion']}）"
-                dish_lines.append(line)
-            dish_text = "\n".join(dish_lines)
-
-            prompt = f"""
-あなたは料理のカロリー計算の専門家です。
-以下の複数の料理と量から、それぞれの概算カロリー・PFC（たんぱく質・脂質・炭水化物）と
-合計カロリー・合計PFCを計算してください。
-- 量が不明な場合は、標準量または「少なめ」「普通」「大盛り」を想定して計算してください
-
-料理一覧:
-{dish_text}
-
-出力形式は以下のようにしてください:
-料理名: xxx kcal, たんぱく質 xx g, 脂質 xx g, 炭水化物 xx g
-...
-合計: xxx kcal, たんぱく質 xx g, 脂質 xx g, 炭水化物 xx g
-"""
-            with st.spinner("AIが計算しています..."):
-                try:
-                    response = openai.chat.completions.create(
-                        model="gpt-5-mini",
-                        messages=[
-                            {"role": "system", "content": "あなたは料理の栄養専門家です。"},
-                            {"role": "user", "content": prompt}
-                        ],
-                    )
-                    st.session_state.calorie_result = response.choices[0].message.content
-                except Exception as e:
+            # まず食品成分表でローカル計算
+            results, pending = calorie_engine.estimate_dishes(st.session_state.dishes)
+
+            # 成分表で解決できなかった料理だけAIに聞く（キーがなければ成分表の分だけで小計を出す）
+            unestimated = []
+            if pending and not api_key:
+                st.warning("OpenAI API Key が取得できないため、食品成分表で計算できた料理だけを表示します。")
+                unestimated = pending
+            elif pending:
+                # 料理ごとに並行して推定（推定済みの料理はキャッシュから返る）
+                with st.spinner("AIが計算しています..."):
+                    estimated, errors = dish_estimator.estimate_dishes(pending)
+                for e in errors:
                     st.error(f"エラーが発生しました: {e}")
+                by_dish = {id(d): r for d, r in zip(pending, estimated)}
+                results = [
+                    r if r is not None else by_dish.get(id(d))
+                    for r, d in zip(results, st.session_state.dishes)
+                ]
+
+            # 合計はローカルで計算（推定できなかった料理は除く）
+            done = [r for r in results if r is not None]
+            lines = []
+            if done:
+                meal = structured_output.MealEstimate(dishes=done)
+                lines.append(calorie_engine.format_result(meal.items(), "小計" if unestimated else "合計"))
+                st.session_state.calorie_items = meal.items()
+                st.session_state.calorie_meal = {**meal.model_dump(), "total": meal.total()}
+            lines += [f"{d['name']}: AIキーがないため未計算" for d in unestimated]
+            st.session_state.calorie_result = "\n".join(lines)
 
     # --------------------------
     # 計算結果表示
@@ -140,6 +164,47 @@ def main():
         st.subheader("推定結果")
         st.text(st.session_state.calorie_result)
 
+    # --------------------------
+    # 食事記録と目標との比較
+    # --------------------------
+    st.subheader("食事記録")
+    log = meal_log.get_log()
+    col_user, col_date = st.columns(2)
+    user = col_user.text_input("記録する名前", value=meal_log.DEFAULT_USER, key="meal_log_user").strip() or meal_log.DEFAULT_USER
+    day = col_date.date_input("日付", value=dt.date.today(), key="meal_log_date")
+
+    if st.session_state.calorie_items and st.button("推定結果をこの日の記録に追加", key="log_meals_button"):
+        log.add_meals(user, day, st.session_state.calorie_items)
+        st.session_state.calorie_items = []
+        st.success("記録しました。")
+
+    # TDEE計算アプリで計算済みなら、その目標を保存して次回以降も使う
+    if "tdee" in st.session_state:
+        session_targets = {k: st.session_state[k] for k in GOALS.values()}
+        if log.get_targets(user) != session_targets:
+            log.set_targets(user, **session_targets)
+
+    summary = log.today_vs_target(user, day)
+    today = summary["today"]
+    goal = st.radio("目標", list(GOALS), horizontal=True, key="meal_log_goal")
+    target = summary["targets"].get(GOALS[goal])
+    cols = st.columns(4)
+    if target:
+        cols[0].metric("摂取 / 目標", f"{today['kcal']:.0f} / {target} kcal", f"残り {target - today['kcal']:.0f} kcal", delta_color="off")
+    else:
+        cols[0].metric("摂取", f"{today['kcal']:.0f} kcal")
+    cols[1].metric("たんぱく質", f"{today['P']:.1f} g")
+    cols[2].metric("脂質", f"{today['F']:.1f} g")
+    cols[3].metric("炭水化物", f"{today['C']:.1f} g")
+    st.caption(f"今週の平均: {summary['week_avg_kcal']:.0f} kcal/日（{summary['week']['items']}品）")
+    if not target:
+        st.caption("TDEE計算アプリで計算すると、目標との比較が表示されます。")
+
+    for m in log.meals_on(user, day):
+        cols = st.columns([4, 1])
+        cols[0].text(f"{m['name']}: {m['kcal']:.0f} kcal（P {m['P']:.1f} g / F {m['F']:.1f} g / C {m['C']:.1f} g）")
+        cols[1].button("削除", key=f"meal_delete_{m['id']}", on_click=log.delete_meals, args=(user, [m["id"]]))
+
 
 if __name__ == "__main__":
     main()
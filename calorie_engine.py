@@ -0,0 +1,220 @@
+# calorie_engine.py
+import re
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+
+import composite_dishes
+import quantity_parser
+from food_search import get_index, normalize
+from nutrient_store import get_store
+
+# --------------------------
+# よく入力される料理名 → (foodId, 普通盛りのグラム数)
+# --------------------------
+FOOD_ALIASES = {
+    "ご飯": (1088, 150),
+    "ごはん": (1088, 150),
+    "白米": (1088, 150),
+    "白ご飯": (1088, 150),
+    "玄米": (1085, 150),
+    "玄米ご飯": (1085, 150),
+    "食パン": (1026, 60),
+    "うどん": (1039, 250),
+    "そば": (1128, 200),
+    "パスタ": (1064, 250),
+    "スパゲッティ": (1064, 250),
+    "オートミール": (1004, 30),
+    "鶏むね肉": (11220, 120),
+    "鶏胸肉": (11220, 120),
+    "鶏もも肉": (11221, 120),
+    "ささみ": (11227, 60),
+    "からあげ": (11289, 150),
+    "唐揚げ": (11289, 150),
+    "から揚げ": (11289, 150),
+    "豚ロース": (11124, 100),
+    "牛もも肉": (11076, 100),
+    "鮭": (10136, 80),
+    "焼き鮭": (10136, 80),
+    "さば": (10156, 80),
+    "ツナ": (10263, 70),
+    "ハム": (11176, 20),
+    "卵": (12004, 50),
+    "たまご": (12004, 50),
+    "ゆで卵": (12005, 50),
+    "納豆": (4046, 45),
+    "木綿豆腐": (4032, 150),
+    "絹ごし豆腐": (4033, 150),
+    "豆腐": (4032, 150),
+    "牛乳": (13003, 200),
+    "ヨーグルト": (13025, 100),
+    "バナナ": (7107, 100),
+    "ブロッコリー": (6264, 50),
+    "キャベツ": (6061, 50),
+    "レタス": (6312, 30),
+    "トマト": (6182, 100),
+    "じゃがいも": (2017, 100),
+    "カレーライス": (18001, 250),
+    "カレー": (18001, 250),
+    "ハンバーグ": (18050, 150),
+    "餃子": (18002, 120),
+    "ぎょうざ": (18002, 120),
+    "麻婆豆腐": (18049, 200),
+    "肉じゃが": (18036, 200),
+    "豚汁": (18028, 200),
+}
+
+# あいまい検索の1位を採用する最低文字数（正規化後）。短すぎる入力は誤爆しやすい
+MIN_FUZZY_QUERY_LEN = 3
+
+def normalize_name(name: str) -> str:
+    return unicodedata.normalize("NFKC", name).strip()
+
+
+# --------------------------
+# 料理名の解決
+# --------------------------
+@lru_cache(maxsize=4)
+def _exact_name_rows(store) -> dict:
+    return {normalize_name(str(n)): i for i, n in enumerate(store.food_name)}
+
+
+def resolve_food(name: str, store=None, food_id: int | None = None):
+    """
+    料理名を (行番号, 普通盛りのグラム数) に解決する。見つからなければ None。
+    普通盛りは FOOD_ALIASES にあればその値、なければ食品群の1人前（quantity_parser）。
+    """
+    store = store or get_store()
+    if food_id is not None:
+        row = int(store.rows_for_ids(food_id)[0])
+        return row, quantity_parser.serving_grams(store.group_id[row])
+    key = normalize_name(name)
+    if key in FOOD_ALIASES:
+        alias_id, serving = FOOD_ALIASES[key]
+        return int(store.rows_for_ids(alias_id)[0]), float(serving)
+    row = _exact_name_rows(store).get(key)
+    if row is not None:
+        return row, quantity_parser.serving_grams(store.group_id[row])
+    # 入力全体が食品名に含まれる場合だけ、あいまい検索の1位を採用
+    if len(normalize(key)) >= MIN_FUZZY_QUERY_LEN:
+        index = get_index()
+        hits = index.search(key, 1)
+        if hits and index.contains(hits[0][0], key):
+            row = hits[0][0]
+            return row, quantity_parser.serving_grams(store.group_id[row])
+    return None
+
+
+def dish_grams(dish: dict, serving: float, row: int, store) -> float | None:
+    # 「1杯」「大さじ2」のような表記も食品群・食品ごとの単位の重さでグラムにする
+    group_id = int(store.group_id[row])
+    if dish["amount_known"] == "はい、わかる":
+        return quantity_parser.to_grams(
+            dish["info"].get("amount_text", ""), group_id, int(store.food_id[row]), serving
+        )
+    return quantity_parser.portion_grams(dish["info"].get("portion"), serving, group_id)
+
+
+def dish_servings(dish: dict, row: int, table) -> float | None:
+    # 料理表（composite_dishes）の料理が何人前か
+    if dish["amount_known"] == "はい、わかる":
+        return table.servings(row, dish["info"].get("amount_text", ""))
+    return table.servings(row, portion=dish["info"].get("portion"))
+
+
+# --------------------------
+# 計算
+# --------------------------
+def estimate_dishes(dishes: list, store=None, table=None):
+    """
+    登録済み料理を食品成分表から計算する。
+    食品を選んでいない料理は、先にレシピから作った料理表（composite_dishes）を引く。
+    戻り値は (結果リスト, 未解決の料理リスト)。結果リストは dishes と同じ順番で、未解決の位置は None。
+    """
+    store = store or get_store()
+    table = table or composite_dishes.get_table()
+    rows, grams, positions, pending = [], [], [], []
+    dish_rows, servings, dish_positions = [], [], []
+    for i, d in enumerate(dishes):
+        dish_row = table.row(d["name"]) if d.get("food_id") is None else None
+        if dish_row is not None:
+            s = dish_servings(d, dish_row, table)
+            if s is None:
+                pending.append(d)
+                continue
+            dish_rows.append(dish_row)
+            servings.append(s)
+            dish_positions.append(i)
+            continue
+        resolved = resolve_food(d["name"], store, d.get("food_id"))
+        g = dish_grams(d, resolved[1], resolved[0], store) if resolved else None
+        if g is None:
+            pending.append(d)
+            continue
+        rows.append(resolved[0])
+        grams.append(g)
+        positions.append(i)
+
+    results = [None] * len(dishes)
+    if rows:
+        amounts = store.amounts(np.array(rows), np.array(grams))
+        for pos, row, g, (kcal, p, f, c) in zip(positions, rows, grams, amounts):
+            results[pos] = {
+                "name": dishes[pos]["name"],
+                "food_name": str(store.food_name[row]),
+                "grams": g,
+                "kcal": float(kcal),
+                "P": float(p),
+                "F": float(f),
+                "C": float(c),
+            }
+    if dish_rows:
+        amounts = table.amounts(dish_rows, servings)
+        for pos, row, s, (kcal, p, f, c) in zip(dish_positions, dish_rows, servings, amounts):
+            results[pos] = {
+                "name": dishes[pos]["name"],
+                "food_name": f"{table.names[row]}（レシピ）",
+                "grams": float(table.grams[row] * s),
+                "kcal": float(kcal),
+                "P": float(p),
+                "F": float(f),
+                "C": float(c),
+            }
+    return results, pending
+
+
+def format_line(name: str, kcal: float, p: float, f: float, c: float) -> str:
+    return f"{name}: {kcal:.0f} kcal, たんぱく質 {p:.1f} g, 脂質 {f:.1f} g, 炭水化物 {c:.1f} g"
+
+
+_LINE_RE = re.compile(
+    r"^\s*(?P<name>.+?)\s*[:：]\s*(?P<kcal>\d+(?:\.\d+)?)\s*kcal\s*[,，、]\s*"
+    r"たんぱく質\s*(?P<P>\d+(?:\.\d+)?)\s*g\s*[,，、]\s*"
+    r"脂質\s*(?P<F>\d+(?:\.\d+)?)\s*g\s*[,，、]\s*"
+    r"炭水化物\s*(?P<C>\d+(?:\.\d+)?)\s*g"
+)
+
+
+def parse_result_lines(text: str) -> list:
+    # LLMの出力から「料理名: xxx kcal, ...」の行を取り出す（合計行は除く）
+    out = []
+    for line in text.splitlines():
+        m = _LINE_RE.match(line)
+        if not m or m.group("name").strip() == "合計":
+            continue
+        out.append({
+            "name": m.group("name").strip(),
+            "kcal": float(m.group("kcal")),
+            "P": float(m.group("P")),
+            "F": float(m.group("F")),
+            "C": float(m.group("C")),
+        })
+    return out
+
+
+def format_result(results: list, total_label: str = "合計") -> str:
+    lines = [format_line(r["name"], r["kcal"], r["P"], r["F"], r["C"]) for r in results]
+    total = {k: sum(r[k] for r in results) for k in ("kcal", "P", "F", "C")}
+    lines.append(format_line(total_label, total["kcal"], total["P"], total["F"], total["C"]))
+    return "\n".join(lines)
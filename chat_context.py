@@ -0,0 +1,131 @@
+# chat_context.py
+import os
+import unicodedata
+
+# 1リクエストに載せる会話のトークン上限（システムプロンプト・要約を含む）
+DEFAULT_BUDGET_TOKENS = int(os.getenv("CHAT_CONTEXT_BUDGET", "4000"))
+# 上限を超えたら、この割合まで古い発言を要約に畳む（毎ターン要約しないための余裕）
+LOW_WATERMARK = 0.6
+# 要約に使うトークン数の目安
+SUMMARY_MAX_TOKENS = 500
+# 1メッセージあたりの役割などのオーバーヘッド
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "これまでの会話の要約:\n"
+
+
+class _WideTable(dict):
+    # str.translate 用の表。全角（W/F）の文字を消し、それ以外はそのまま残す（判定結果は覚えておく）
+    def __missing__(self, codepoint: int):
+        value = None if unicodedata.east_asian_width(chr(codepoint)) in ("W", "F") else codepoint
+        self[codepoint] = value
+        return value
+
+
+_WIDE_TABLE = _WideTable()
+
+
+def estimate_tokens(text: str) -> int:
+    # 日本語は1文字≒1トークン、英数字は4文字≒1トークンで見積もる
+    if text.isascii():
+        return (len(text) + 3) // 4
+    ascii_count = len(text.encode("ascii", "ignore"))
+    wide = len(text) - len(text.translate(_WIDE_TABLE))
+    other = len(text) - ascii_count - wide
+    return wide + (ascii_count + other * 2 + 3) // 4
+
+
+def message_tokens(msg: dict) -> int:
+    # 数え直さないよう、数えた結果をメッセージ自体に持たせる（API送信時は除く）
+    cached = msg.get("_tokens")
+    if cached is None or cached[0] != len(msg["content"]):
+        cached = (len(msg["content"]), estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS)
+        msg["_tokens"] = cached
+    return cached[1]
+
+
+def _clean(msg: dict) -> dict:
+    return {"role": msg["role"], "content": msg["content"]}
+
+
+def new_state() -> dict:
+    return {
+        "summary": "",
+        "summarized_upto": 0,   # 要約済みの会話ターン数（システムプロンプトを除く）
+        "summarize_calls": 0,
+        "metrics": {},
+    }
+
+
+def _keep_from(counts: list, start: int, budget: int) -> int:
+    # 後ろから budget に収まるところまで残す（最後の1件は必ず残す）
+    used = 0
+    for i in range(len(counts) - 1, start - 1, -1):
+        if used + counts[i] > budget and i < len(counts) - 1:
+            return i + 1
+        used += counts[i]
+    return start
+
+
+def build_messages(messages: list, state: dict, summarize=None, budget: int = DEFAULT_BUDGET_TOKENS) -> list:
+    """
+    APIに送るメッセージを作る。
+    システムプロンプト＋要約＋直近の発言が budget に収まるようにし、
+    はみ出した古い発言は summarize(前回の要約, 新たに畳む発言) で要約に追記する。
+    """
+    system = [m for m in messages[:1] if m["role"] == "system"]
+    turns = messages[len(system):]
+    counts = [message_tokens(m) for m in turns]
+    fixed = sum(message_tokens(m) for m in system)
+    summary_cost = estimate_tokens(state["summary"]) + MESSAGE_OVERHEAD_TOKENS if state["summary"] else 0
+
+    start = state["summarized_upto"]
+    available = budget - fixed - max(summary_cost, SUMMARY_MAX_TOKENS)
+    if sum(counts[start:]) > available:
+        # 上限を超えたので低い水位まで畳む
+        keep = _keep_from(counts, start, int(available * LOW_WATERMARK))
+        folded = turns[start:keep]
+        if folded:
+            if summarize is not None:
+                try:
+                    state["summary"] = summarize(state["summary"], [_clean(m) for m in folded])
+                    state["summarize_calls"] += 1
+                except Exception:
+                    # 要約に失敗しても会話は続ける（古い発言は落とすだけ）
+                    pass
+            state["summarized_upto"] = keep
+            start = keep
+
+    out = [_clean(m) for m in system]
+    if state["summary"]:
+        out.append({"role": "system", "content": SUMMARY_PREFIX + state["summary"]})
+    out.extend(_clean(m) for m in turns[start:])
+
+    sent = sum(message_tokens(m) for m in out)
+    state["metrics"] = {
+        "total_tokens": fixed + sum(counts),
+        "sent_tokens": sent,
+        "trimmed_messages": start,
+        "trimmed_tokens": sum(counts[:start]),
+        "summary_tokens": estimate_tokens(state["summary"]) if state["summary"] else 0,
+        "summarize_calls": state["summarize_calls"],
+    }
+    return out
+
+
+def summary_prompt(previous: str, folded: list) -> list:
+    # 要約用のメッセージ（前回の要約に新しい発言だけを足して更新する）
+    lines = [f"{'ユーザー' if m['role'] == 'user' else 'AI'}: {m['content']}" for m in folded]
+    return [
+        {
+            "role": "system",
+            "content": (
+                "あなたは会話の要約係です。ユーザーの目標・体格・食事や運動の条件、"
+                f"AIが示した具体的な数値や提案を落とさず、{SUMMARY_MAX_TOKENS}文字以内の箇条書きで要約してください。"
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"これまでの要約:\n{previous or '（なし）'}\n\n追加の会話:\n" + "\n".join(lines),
+        },
+    ]
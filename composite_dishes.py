@@ -0,0 +1,474 @@
+# composite_dishes.py
+"""
+カレーライス・からあげのように、複数の食品を組み合わせた料理の栄養価表。
+
+    python composite_dishes.py build            変わったレシピだけ計算し直してキャッシュに保存
+    python composite_dishes.py build --force    全レシピを計算し直す
+    python composite_dishes.py show [料理名...]  1人前（普通）の kcal/PFC を表示
+    python composite_dishes.py lookup カレーライス 大盛り
+
+レシピは1人前（普通）の (foodId, グラム数) のリスト。成分表の100gあたりの値にグラム数を掛けて
+足し合わせ、(料理数, 栄養素列数) の行列にして data/cache/composite_dishes.npz に保存する。
+レシピごとに内容のハッシュを持っておき、変わったレシピ・増えたレシピだけ計算し直す
+（成分表が変わったときは全部作り直す）。引くときは料理名 → 行番号の dict と行の掛け算だけ。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+import streamlit as st
+
+import quantity_parser
+from nutrient_store import CACHE_DIR, CACHE_VERSION, FOOD_JSON_PATH, PFC_COLUMNS, get_store, load_store
+
+TABLE_PATH = CACHE_DIR / "composite_dishes.npz"
+
+# --------------------------
+# レシピ（1人前・普通盛りの材料と可食部のグラム数）
+# --------------------------
+RECIPES = {
+    "カレーライス": [
+        (1088, 200),   # めし
+        (11115, 50),   # ぶた かた
+        (2017, 50),    # じゃがいも
+        (6214, 20),    # にんじん
+        (6153, 50),    # たまねぎ
+        (17051, 20),   # カレールウ
+        (14006, 3),    # 調合油
+    ],
+    "からあげ": [
+        (11221, 130),  # 若どり もも 皮つき
+        (17007, 8),    # こいくちしょうゆ
+        (16001, 5),    # 清酒
+        (6103, 2),     # しょうが
+        (6223, 2),     # にんにく
+        (2034, 10),    # じゃがいもでん粉
+        (14006, 12),   # 調合油（吸油分）
+        (6061, 30),    # キャベツ（付け合わせ）
+    ],
+    "親子丼": [
+        (1088, 250),
+        (11221, 60),
+        (12004, 50),   # 鶏卵
+        (6153, 40),
+        (17021, 50),   # かつお・昆布だし
+        (17007, 12),
+        (16025, 10),   # 本みりん
+        (3003, 3),     # 上白糖
+    ],
+    "牛丼": [
+        (1088, 250),
+        (11046, 70),   # 乳用肥育牛 ばら
+        (6153, 50),
+        (17021, 40),
+        (17007, 12),
+        (16025, 10),
+        (16001, 5),
+        (3003, 4),
+    ],
+    "カツ丼": [
+        (1088, 250),
+        (11276, 100),  # ぶた ロース とんかつ
+        (12004, 50),
+        (6153, 40),
+        (17021, 50),
+        (17007, 12),
+        (16025, 10),
+        (3003, 3),
+    ],
+    "麻婆丼": [
+        (1088, 200),
+        (18049, 150),  # 麻婆豆腐
+    ],
+    "中華丼": [
+        (1088, 250),
+        (18048, 200),  # 八宝菜
+    ],
+    "豚の生姜焼き": [
+        (11123, 100),  # ぶた ロース
+        (6153, 30),
+        (6103, 5),
+        (17007, 10),
+        (16025, 8),
+        (14006, 4),
+        (6061, 40),
+    ],
+    "とんかつ": [
+        (11276, 120),
+        (6061, 50),
+        (17002, 15),   # 中濃ソース
+    ],
+    "しょうゆラーメン": [
+        (1047, 120),   # 中華めん 生
+        (17024, 350),  # 鶏がらだし
+        (17007, 25),
+        (17093, 3),    # 顆粒中華だし
+        (14002, 3),    # ごま油
+        (11195, 30),   # 焼き豚
+        (6152, 20),    # めんま
+        (12005, 25),   # ゆで卵
+        (6226, 10),    # 根深ねぎ
+    ],
+    "焼きそば": [
+        (1049, 150),   # 蒸し中華めん
+        (11129, 40),   # ぶた ばら
+        (6061, 60),
+        (6289, 30),    # もやし
+        (6214, 10),
+        (14006, 6),
+        (17002, 20),
+    ],
+    "チャーハン": [
+        (1088, 200),
+        (12004, 50),
+        (11176, 20),   # ロースハム
+        (6226, 10),
+        (14006, 10),
+        (17093, 2),
+        (17012, 1),    # 食塩
+    ],
+    "オムライス": [
+        (1088, 200),
+        (12004, 100),
+        (11221, 30),
+        (6153, 30),
+        (17036, 30),   # トマトケチャップ
+        (14006, 8),
+        (14017, 5),    # 有塩バター
+    ],
+    "ナポリタン": [
+        (1064, 250),   # スパゲッティ ゆで
+        (11186, 30),   # ウインナーソーセージ
+        (6153, 40),
+        (6245, 20),    # 青ピーマン
+        (17036, 40),
+        (14006, 8),
+    ],
+    "ミートソーススパゲッティ": [
+        (1064, 250),
+        (17033, 150),  # ミートソース
+        (13038, 5),    # パルメザン
+    ],
+    "野菜炒め": [
+        (6061, 100),
+        (6289, 50),
+        (6214, 20),
+        (6153, 30),
+        (11129, 40),
+        (14006, 8),
+        (17093, 2),
+        (17012, 1),
+    ],
+    "卵焼き": [
+        (12004, 100),
+        (17021, 15),
+        (3003, 6),
+        (17007, 3),
+        (14006, 4),
+    ],
+    "味噌汁": [
+        (17021, 150),
+        (17045, 12),   # 淡色辛みそ
+        (4032, 30),    # 木綿豆腐
+        (9041, 10),    # わかめ 水戻し
+        (6226, 5),
+    ],
+    "野菜サラダ": [
+        (6312, 30),    # レタス
+        (6061, 30),
+        (6182, 50),    # トマト
+        (6065, 30),    # きゅうり
+        (17116, 15),   # 和風ドレッシング
+    ],
+    "おにぎり": [
+        (1088, 100),
+        (9004, 1),     # 焼きのり
+        (17012, 0.5),
+    ],
+}
+
+# 別名 → RECIPES の料理名
+DISH_ALIASES = {
+    "カレー": "カレーライス",
+    "ポークカレー": "カレーライス",
+    "唐揚げ": "からあげ",
+    "から揚げ": "からあげ",
+    "鶏の唐揚げ": "からあげ",
+    "牛めし": "牛丼",
+    "かつ丼": "カツ丼",
+    "麻婆豆腐丼": "麻婆丼",
+    "生姜焼き": "豚の生姜焼き",
+    "しょうが焼き": "豚の生姜焼き",
+    "豚カツ": "とんかつ",
+    "トンカツ": "とんかつ",
+    "ラーメン": "しょうゆラーメン",
+    "醤油ラーメン": "しょうゆラーメン",
+    "ソース焼きそば": "焼きそば",
+    "炒飯": "チャーハン",
+    "焼き飯": "チャーハン",
+    "焼飯": "チャーハン",
+    "スパゲッティナポリタン": "ナポリタン",
+    "ミートソース": "ミートソーススパゲッティ",
+    "ミートスパゲッティ": "ミートソーススパゲッティ",
+    "肉野菜炒め": "野菜炒め",
+    "玉子焼き": "卵焼き",
+    "みそ汁": "味噌汁",
+    "みそしる": "味噌汁",
+    "サラダ": "野菜サラダ",
+    "グリーンサラダ": "野菜サラダ",
+    "おむすび": "おにぎり",
+}
+
+# 料理 → {単位: 1単位が何人前か}（表にない個数の単位は1人前として扱う）
+DISH_UNITS = {
+    "からあげ": {"個": 0.2},
+    "とんかつ": {"切れ": 0.2},
+    "卵焼き": {"切れ": 0.25},
+}
+
+
+def normalize_name(name: str) -> str:
+    return unicodedata.normalize("NFKC", name).strip()
+
+
+def recipe_hash(ingredients) -> str:
+    # 材料の順番を入れ替えただけなら計算し直さない
+    items = sorted((int(f), float(g)) for f, g in ingredients)
+    return hashlib.sha1(json.dumps(items).encode("utf-8")).hexdigest()[:16]
+
+
+def _store_signature() -> str:
+    stat = FOOD_JSON_PATH.stat()
+    return json.dumps([CACHE_VERSION, stat.st_size, stat.st_mtime_ns])
+
+
+# --------------------------
+# 料理の栄養価表
+# --------------------------
+class DishTable:
+    """料理ごとの1人前（普通）の栄養価。values は (料理数, 列数)、欠損は0扱い。"""
+
+    def __init__(self, names, hashes, grams, values, columns, aliases=DISH_ALIASES, units=DISH_UNITS):
+        self.names = list(names)
+        self.hashes = list(hashes)
+        self.grams = np.asarray(grams, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.columns = tuple(columns)
+        # kcal/PFC だけは連続したメモリにしておく（引くたびに列を選ばない）
+        self.pfc = np.ascontiguousarray(self.values[:, [self.columns.index(c) for c in PFC_COLUMNS]])
+        self._pfc_rows = self.pfc.tolist()
+        self._grams = self.grams.tolist()
+        self._rows = {normalize_name(n): i for i, n in enumerate(self.names)}
+        for alias, name in aliases.items():
+            if normalize_name(name) in self._rows:
+                self._rows.setdefault(normalize_name(alias), self._rows[normalize_name(name)])
+        self._units = [units.get(n, {}) for n in self.names]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def row(self, name: str) -> int | None:
+        return self._rows.get(normalize_name(name))
+
+    def servings(self, row: int, text: str | None = None, portion: str | None = None) -> float | None:
+        """
+        量の表記（「1皿」「300g」「からあげ3個」「大盛り」）または目安量を「何人前か」にする。
+        text が読み取れなければ None。
+        """
+        if text is None:
+            return quantity_parser.portion_factor(portion)
+        parsed = quantity_parser.parse(text)
+        if parsed is None:
+            return None
+        amount, unit, portion = parsed
+        per_unit = 1.0
+        if unit in quantity_parser.WEIGHT_G:
+            per_unit = quantity_parser.WEIGHT_G[unit] / self._grams[row]
+        elif unit in quantity_parser.VOLUME_ML:
+            per_unit = quantity_parser.VOLUME_ML[unit] / self._grams[row]
+        elif unit is not None:
+            per_unit = self._units[row].get(unit, 1.0)
+        return amount * per_unit * quantity_parser.portion_factor(portion)
+
+    def amounts(self, rows, servings, columns=PFC_COLUMNS) -> np.ndarray:
+        # (件数, 列数)。まとめて計算するとき用
+        servings = np.asarray(servings, dtype=np.float64)
+        if tuple(columns) == PFC_COLUMNS:
+            base = self.pfc[np.asarray(rows)]
+        else:
+            base = self.values[np.asarray(rows)][:, [self.columns.index(c) for c in columns]]
+        return base * servings[:, None]
+
+    def lookup(self, name: str, portion: str | None = None) -> dict | None:
+        """料理名と目安量（少なめ/普通/大盛り）から kcal/PFC を引く。表になければ None。"""
+        row = self._rows.get(normalize_name(name))
+        if row is None:
+            return None
+        factor = quantity_parser.portion_factor(portion)
+        kcal, p, f, c = self._pfc_rows[row]
+        return {
+            "name": self.names[row],
+            "grams": self._grams[row] * factor,
+            "kcal": kcal * factor,
+            "P": p * factor,
+            "F": f * factor,
+            "C": c * factor,
+        }
+
+
+# --------------------------
+# レシピの計算・キャッシュ
+# --------------------------
+def compile_recipes(recipes: dict, store, columns) -> tuple:
+    """
+    レシピをまとめて計算する。戻り値は (1人前のグラム数, (料理数, 列数) の栄養価)。
+    料理 × 食品 の重み行列を作り、成分表の行列との積1回で全料理を求める。
+    """
+    names = list(recipes)
+    food_ids = sorted({int(f) for n in names for f, _ in recipes[n]})
+    if not names:
+        return np.zeros(0), np.zeros((0, len(columns)))
+    try:
+        rows = store.rows_for_ids(food_ids)
+    except KeyError as e:
+        known = set(np.asarray(store.food_id).tolist())
+        bad = [n for n in names if any(int(f) not in known for f, _ in recipes[n])]
+        raise KeyError(f"レシピ {bad} に成分表にない食品があります: {e}") from None
+    col = {f: i for i, f in enumerate(food_ids)}
+    weights = np.zeros((len(names), len(food_ids)))
+    for i, n in enumerate(names):
+        for f, g in recipes[n]:
+            weights[i, col[int(f)]] += float(g)
+    values = weights @ store.matrix(columns, rows) / 100.0
+    return weights.sum(axis=1), values
+
+
+def _read_table(path: Path, signature: str) -> dict:
+    # 成分表が同じときだけ前回の結果を使う（料理名 → (ハッシュ, グラム数, 栄養価の行)）
+    try:
+        with np.load(path) as data:
+            if str(data["signature"]) != signature:
+                return {}
+            columns = tuple(data["columns"].tolist())
+            return {
+                "columns": columns,
+                "rows": {
+                    n: (h, g, v)
+                    for n, h, g, v in zip(data["names"].tolist(), data["hashes"].tolist(), data["grams"], data["values"])
+                },
+            }
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _write_table(path: Path, table: DishTable, signature: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(
+        tmp,
+        names=np.array(table.names, dtype=np.str_),
+        hashes=np.array(table.hashes, dtype=np.str_),
+        grams=table.grams,
+        values=table.values,
+        columns=np.array(table.columns, dtype=np.str_),
+        signature=np.array(signature),
+    )
+    os.replace(tmp, path)
+
+
+def build_table(store=None, recipes: dict = RECIPES, path: Path = TABLE_PATH, force: bool = False) -> tuple:
+    """
+    キャッシュと比べて、変わった・増えたレシピだけ計算し直す。消えたレシピは表から外す。
+    戻り値は (DishTable, 計算し直した料理名のリスト)。何も変わっていなければ書き込まない。
+    """
+    store = store or get_store()
+    path = Path(path)
+    signature = _store_signature()
+    cached = {} if force else _read_table(path, signature)
+    columns = store.columns
+    old = cached.get("rows", {}) if cached.get("columns") == columns else {}
+
+    hashes = {n: recipe_hash(ing) for n, ing in recipes.items()}
+    changed = [n for n in recipes if n not in old or old[n][0] != hashes[n]]
+    grams, values = compile_recipes({n: recipes[n] for n in changed}, store, columns)
+    fresh = {n: (hashes[n], g, v) for n, g, v in zip(changed, grams, values)}
+
+    names = list(recipes)
+    rows = [fresh.get(n) or old[n] for n in names]
+    table = DishTable(
+        names,
+        [r[0] for r in rows],
+        np.array([r[1] for r in rows], dtype=np.float64),
+        np.array([r[2] for r in rows], dtype=np.float64).reshape(len(rows), len(columns)),
+        columns,
+    )
+    if changed or set(old) != set(names):
+        _write_table(path, table, signature)
+    return table, changed
+
+
+def load_table(store=None, recipes: dict = RECIPES, path: Path = TABLE_PATH) -> DishTable:
+    return build_table(store, recipes, path)[0]
+
+
+@st.cache_resource(show_spinner=False)
+def get_table() -> DishTable:
+    # サーバープロセスごとに1つだけ共有する
+    return load_table()
+
+
+# --------------------------
+# CLI
+# --------------------------
+def _print_row(name: str, grams: float, kcal: float, p: float, f: float, c: float):
+    print(f"{name}\t{grams:.0f} g\t{kcal:.0f} kcal\tP {p:.1f} g\tF {f:.1f} g\tC {c:.1f} g")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="レシピから料理の栄養価表を作る・引く")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="変わったレシピだけ計算し直してキャッシュに保存")
+    build.add_argument("--force", action="store_true", help="全レシピを計算し直す")
+    show = sub.add_parser("show", help="1人前（普通）の値を表示")
+    show.add_argument("names", nargs="*", help="料理名（省略すると全料理）")
+    lookup = sub.add_parser("lookup", help="料理名と量から値を引く")
+    lookup.add_argument("name")
+    lookup.add_argument("amount", nargs="?", help="量（例: 大盛り、1皿、300g、3個）")
+    args = parser.parse_args(argv)
+
+    store = load_store()
+    t0 = time.perf_counter()
+    table, changed = build_table(store, force=getattr(args, "force", False))
+    t1 = time.perf_counter()
+    if args.command == "build":
+        print(f"{len(table)} 品中 {len(changed)} 品を計算: {(t1 - t0) * 1000:.1f} ms", file=sys.stderr)
+        for name in changed:
+            print(name)
+    elif args.command == "show":
+        for name in args.names or table.names:
+            row = table.row(name)
+            if row is None:
+                print(f"{name}: 表にありません", file=sys.stderr)
+                continue
+            _print_row(table.names[row], table.grams[row], *table.pfc[row])
+    else:
+        row = table.row(args.name)
+        if row is None:
+            parser.error(f"表にない料理です: {args.name}")
+        t2 = time.perf_counter()
+        servings = table.servings(row, args.amount)
+        t3 = time.perf_counter()
+        if servings is None:
+            parser.error(f"量を読み取れません: {args.amount}")
+        _print_row(table.names[row], table.grams[row] * servings, *(table.pfc[row] * servings))
+        print(f"{servings:.2f} 人前, 検索 {(t3 - t2) * 1e6:.1f} µs", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+# dataset_builder.py
+"""
+personality_data.csv（input,output）から、ファインチューニング用のチャット形式JSONLを作る。
+CSVはチャンクごとに読み、並列に整形・検証して、件数ごとに分割したファイルへ書き出す。
+
+    python dataset_builder.py build personality_data.csv --out data/datasets/persona
+    python dataset_builder.py update temp_uploaded.csv --out data/datasets/persona
+
+build は出力先を作り直す。update はマニフェスト（manifest.sqlite3）と比べて、
+新しい質問と回答が変わった質問だけを追記する（CSVから消えた行はそのまま残す）。
+同じ質問（正規化後の input）が同じCSV内に複数あれば最初の行を使う。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from chat_context import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+# temp_data.jsonl と同じシステムプロンプト
+SYSTEM_PROMPT = "あなたはpersonality_dataの口調・性格でトレーニングと栄養の専門家として質問に回答するアシスタントAIです。"
+
+INPUT_COLUMN = "input"
+OUTPUT_COLUMN = "output"
+DEFAULT_CHUNK_ROWS = 10_000
+DEFAULT_SHARD_RECORDS = 100_000
+# 1件あたりのトークン上限（超えたものは rejected に回す）
+DEFAULT_MAX_TOKENS = 16_384
+
+MANIFEST_NAME = "manifest.sqlite3"
+REJECTED_NAME = "rejected.jsonl"
+SHARD_PREFIX = "shard"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    key TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    shard TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    run INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_shard ON records (shard);
+CREATE TABLE IF NOT EXISTS runs (
+    run INTEGER PRIMARY KEY,
+    mode TEXT NOT NULL,
+    source TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    stats TEXT
+);
+"""
+
+
+# --------------------------
+# 1行の整形（ワーカープロセスで実行）
+# --------------------------
+def _normalize(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def _digest(*parts: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def make_record(question: str, answer: str) -> dict:
+    return {
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer},
+        ]
+    }
+
+
+_SYSTEM_TOKENS = estimate_tokens(SYSTEM_PROMPT) + MESSAGE_OVERHEAD_TOKENS
+
+
+def record_tokens(question: str, answer: str) -> int:
+    # システムプロンプトは全件共通なので数えるのは1回だけ
+    return _SYSTEM_TOKENS + estimate_tokens(question) + estimate_tokens(answer) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def validate_pair(question: str, answer: str) -> str | None:
+    # 問題があれば理由を返す
+    if not question:
+        return "input が空です"
+    if not answer:
+        return "output が空です"
+    if "\x00" in question or "\x00" in answer:
+        return "NUL文字が含まれています"
+    return None
+
+
+def prepare_chunk(rows: list, start_line: int, max_tokens: int) -> list:
+    """
+    (input, output) のリストを整形する。戻り値は行ごとに
+    ("ok", key, content_hash, jsonl行, tokens) または ("error", 行番号, 理由, input)。
+    """
+    out = []
+    for i, (question, answer) in enumerate(rows):
+        question = str(question).strip()
+        answer = str(answer).strip()
+        line_no = start_line + i
+        reason = validate_pair(question, answer)
+        if reason is None:
+            tokens = record_tokens(question, answer)
+            if tokens > max_tokens:
+                reason = f"トークン数が上限を超えています（{tokens} > {max_tokens}）"
+        if reason is not None:
+            out.append(("error", line_no, reason, question[:200]))
+            continue
+        key = _digest(_normalize(question))
+        content_hash = _digest(_normalize(question), _normalize(answer))
+        out.append(("ok", key, content_hash, json.dumps(make_record(question, answer), ensure_ascii=False), tokens))
+    return out
+
+
+# --------------------------
+# CSVの読み込み
+# --------------------------
+def iter_chunks(path: Path, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    # (CSV上の行番号, [(input, output), ...]) を返す。BOM付きUTF-8にも対応
+    reader = pd.read_csv(
+        path,
+        encoding="utf-8-sig",
+        dtype=str,
+        keep_default_na=False,
+        usecols=lambda c: c.strip() in (INPUT_COLUMN, OUTPUT_COLUMN),
+        chunksize=chunk_rows,
+    )
+    line = 2  # 1行目はヘッダー
+    for df in reader:
+        df.columns = [c.strip() for c in df.columns]
+        missing = {INPUT_COLUMN, OUTPUT_COLUMN} - set(df.columns)
+        if missing:
+            raise ValueError(f"{path} に列 {', '.join(sorted(missing))} がありません")
+        rows = list(zip(df[INPUT_COLUMN].tolist(), df[OUTPUT_COLUMN].tolist()))
+        yield line, rows
+        line += len(rows)
+
+
+def _prepared_chunks(path: Path, chunk_rows: int, max_tokens: int, workers: int):
+    # 並列に整形しつつ、CSVの順番どおりに返す（先読みはワーカー数の2倍まで）
+    chunks = iter_chunks(path, chunk_rows)
+    if workers <= 1:
+        for line, rows in chunks:
+            yield prepare_chunk(rows, line, max_tokens)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for line, rows in chunks:
+            pending.append(executor.submit(prepare_chunk, rows, line, max_tokens))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# --------------------------
+# 出力（分割ファイルとマニフェスト）
+# --------------------------
+def shard_name(index: int) -> str:
+    return f"{SHARD_PREFIX}-{index:05d}.jsonl"
+
+
+class ShardWriter:
+    """shard_records 件ごとにファイルを分けて追記する。"""
+
+    def __init__(self, out_dir: Path, shard_records: int, index: int = 0, count: int = 0):
+        self.out_dir = out_dir
+        self.shard_records = shard_records
+        self.index = index
+        self.count = count
+        self._file = None
+
+    @property
+    def current(self) -> str:
+        return shard_name(self.index)
+
+    def reserve(self) -> str:
+        # 次の1件を書くシャード名を返す
+        if self.shard_records and self.count >= self.shard_records:
+            self.close()
+            self.index += 1
+            self.count = 0
+        return self.current
+
+    def write(self, line: str):
+        if self._file is None:
+            self._file = open(self.out_dir / self.current, "a", encoding="utf-8")
+        self._file.write(line + "\n")
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def open_manifest(out_dir: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(out_dir / MANIFEST_NAME)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _reset_output(out_dir: Path):
+    for p in out_dir.glob(f"{SHARD_PREFIX}-*.jsonl"):
+        p.unlink()
+    for name in (MANIFEST_NAME, MANIFEST_NAME + "-wal", MANIFEST_NAME + "-shm", REJECTED_NAME):
+        (out_dir / name).unlink(missing_ok=True)
+
+
+def _resume_writer(conn, out_dir: Path, shard_records: int) -> ShardWriter:
+    # 既存の最後のシャードが埋まっていなければそこに追記する
+    row = conn.execute(
+        "SELECT shard, COUNT(*) FROM records GROUP BY shard ORDER BY shard DESC LIMIT 1"
+    ).fetchone()
+    if row is None:
+        return ShardWriter(out_dir, shard_records)
+    index = int(row[0][len(SHARD_PREFIX) + 1:-len(".jsonl")])
+    return ShardWriter(out_dir, shard_records, index=index, count=row[1])
+
+
+def _lookup(conn, keys: list) -> dict:
+    found = {}
+    # SQLite の変数の上限に収まるように分けて引く
+    for i in range(0, len(keys), 900):
+        part = keys[i:i + 900]
+        found.update(
+            (k, (h, s, r))
+            for k, h, s, r in conn.execute(
+                f"SELECT key, content_hash, shard, run FROM records WHERE key IN ({','.join('?' * len(part))})",
+                part,
+            )
+        )
+    return found
+
+
+def _rewrite_shard(conn, out_dir: Path, shard: str) -> int:
+    # 置き換えられた古い行を取り除く（マニフェスト上この shard にある最新の行だけ残す）
+    path = out_dir / shard
+    if not path.exists():
+        return 0
+    current = dict(conn.execute("SELECT key, content_hash FROM records WHERE shard = ?", (shard,)))
+    tmp = path.with_suffix(".jsonl.tmp")
+    dropped = 0
+    with open(path, encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+        for line in src:
+            msgs = json.loads(line)["messages"]
+            question, answer = msgs[1]["content"], msgs[2]["content"]
+            key = _digest(_normalize(question))
+            if current.get(key) == _digest(_normalize(question), _normalize(answer)):
+                dst.write(line)
+            else:
+                dropped += 1
+    os.replace(tmp, path)
+    return dropped
+
+
+def build_dataset(
+    source: Path,
+    out_dir: Path,
+    incremental: bool = False,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    shard_records: int = DEFAULT_SHARD_RECORDS,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    workers: int | None = None,
+) -> dict:
+    """CSVをJSONLに変換して統計を返す。incremental=True なら新規・変更分だけ追記する。"""
+    start = time.perf_counter()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if not incremental:
+        _reset_output(out_dir)
+    workers = workers or os.cpu_count() or 1
+
+    conn = open_manifest(out_dir)
+    with conn:
+        run = conn.execute(
+            "INSERT INTO runs (mode, source, started_at) VALUES (?, ?, ?)",
+            ("update" if incremental else "build", str(source), time.time()),
+        ).lastrowid
+    writer = _resume_writer(conn, out_dir, shard_records)
+    stats = {
+        "rows": 0, "written": 0, "new": 0, "changed": 0, "unchanged": 0,
+        "duplicates": 0, "rejected": 0, "tokens": 0,
+    }
+    stale_shards = set()
+
+    try:
+        with open(out_dir / REJECTED_NAME, "a", encoding="utf-8") as rejected:
+            for prepared in _prepared_chunks(source, chunk_rows, max_tokens, workers):
+                stats["rows"] += len(prepared)
+                existing = _lookup(conn, [p[1] for p in prepared if p[0] == "ok"])
+                upserts = []
+                for item in prepared:
+                    if item[0] == "error":
+                        _, line_no, reason, question = item
+                        rejected.write(json.dumps(
+                            {"run": run, "line": line_no, "reason": reason, "input": question}, ensure_ascii=False
+                        ) + "\n")
+                        stats["rejected"] += 1
+                        continue
+                    _, key, content_hash, line, tokens = item
+                    old = existing.get(key)
+                    if old is not None and old[2] == run:
+                        stats["duplicates"] += 1
+                        continue
+                    if old is not None and old[0] == content_hash:
+                        stats["unchanged"] += 1
+                        upserts.append((key, content_hash, old[1], tokens, run))
+                        existing[key] = (content_hash, old[1], run)
+                        continue
+                    if old is not None:
+                        stats["changed"] += 1
+                        stale_shards.add(old[1])
+                    else:
+                        stats["new"] += 1
+                    shard = writer.reserve()
+                    writer.write(line)
+                    stats["written"] += 1
+                    stats["tokens"] += tokens
+                    upserts.append((key, content_hash, shard, tokens, run))
+                    existing[key] = (content_hash, shard, run)
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO records (key, content_hash, shard, tokens, run) VALUES (?, ?, ?, ?, ?)",
+                        upserts,
+                    )
+    finally:
+        writer.close()
+
+    stats["superseded"] = sum(_rewrite_shard(conn, out_dir, s) for s in sorted(stale_shards))
+    stats["records"], stats["total_tokens"] = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM records"
+    ).fetchone()
+    stats["shards"] = sorted(p.name for p in out_dir.glob(f"{SHARD_PREFIX}-*.jsonl"))
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    stats["rows_per_sec"] = round(stats["rows"] / stats["seconds"]) if stats["seconds"] else 0
+    with conn:
+        conn.execute("UPDATE runs SET stats = ? WHERE run = ?", (json.dumps(stats, ensure_ascii=False), run))
+    conn.close()
+    return stats
+
+
+# --------------------------
+# CLI
+# --------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="input,output のCSVをファインチューニング用JSONLに変換する")
+    parser.add_argument("mode", choices=["build", "update"], help="build: 作り直す / update: 新規・変更分だけ追記")
+    parser.add_argument("csv", type=Path)
+    parser.add_argument("--out", type=Path, default=Path("data/datasets/persona"), help="出力ディレクトリ")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--shard-records", type=int, default=DEFAULT_SHARD_RECORDS, help="1ファイルの件数（0で分割しない）")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--workers", type=int, default=None, help="整形に使うプロセス数（既定はCPU数）")
+    args = parser.parse_args(argv)
+
+    if args.mode == "update" and not (args.out / MANIFEST_NAME).exists():
+        print(f"{args.out} にマニフェストがないため build として実行します", file=sys.stderr)
+    stats = build_dataset(
+        args.csv,
+        args.out,
+        incremental=args.mode == "update",
+        chunk_rows=args.chunk_rows,
+        shard_records=args.shard_records,
+        max_tokens=args.max_tokens,
+        workers=args.workers,
+    )
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
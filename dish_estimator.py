@@ -0,0 +1,121 @@
+# dish_estimator.py
+import asyncio
+import functools
+import os
+import time
+
+import calorie_engine
+import instrumentation
+import llm_cache
+import llm_client
+import llm_dispatch
+import structured_output
+
+MODEL = "gpt-5-mini"
+# 同時に投げるリクエスト数の上限
+MAX_CONCURRENCY = int(os.getenv("DISH_ESTIMATE_CONCURRENCY", "4"))
+
+SYSTEM_PROMPT = "あなたは料理の栄養専門家です。"
+
+# response_format でスキーマを送るとき / 送らないとき（LLM_STRUCTURED_OUTPUT=0）の出力指示
+OUTPUT_FORMAT = "出力はJSONのみ: kcal にカロリー、P・F・C にたんぱく質・脂質・炭水化物のグラム数"
+LINE_FORMAT = """出力は次の1行だけにしてください:
+{name}: xxx kcal, たんぱく質 xx g, 脂質 xx g, 炭水化物 xx g"""
+
+
+def dish_key(d: dict) -> list:
+    # 料理名と量（分かる場合はテキスト、分からない場合は目安量）で1件を識別する
+    if d["amount_known"] == "はい、わかる":
+        amount = llm_cache.normalize_text(d["info"].get("amount_text", ""))
+    else:
+        amount = f"量不明（{d['info'].get('portion', '普通')}）"
+    return [llm_cache.normalize_text(d["name"]), amount]
+
+
+def dish_messages(d: dict) -> list:
+    name, amount = dish_key(d)
+    prompt = f"""
+あなたは料理のカロリー計算の専門家です。
+以下の料理と量から、概算カロリー・PFC（たんぱく質・脂質・炭水化物）を計算してください。
+- 量が不明な場合は、標準量または「少なめ」「普通」「大盛り」を想定して計算してください
+
+料理: {name}: {amount}
+
+{OUTPUT_FORMAT if structured_output.ENABLED else LINE_FORMAT.format(name=name)}
+"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _parse_one(text: str) -> structured_output.DishNutrition | None:
+    text = text or ""
+    if "{" in text:
+        try:
+            return structured_output.parse(text, structured_output.DishNutrition, task="dish")
+        except structured_output.StructuredOutputError:
+            pass
+    # 1行形式（LLM_STRUCTURED_OUTPUT=0 のときや、以前のキャッシュ）
+    parsed = calorie_engine.parse_result_lines(text)
+    if not parsed:
+        return None
+    return structured_output.DishNutrition(**{k: parsed[0][k] for k in ("kcal", "P", "F", "C")})
+
+
+async def _create(client, **kwargs):
+    # 1回の試行ごとにレイテンシ・トークン数を記録する
+    start = time.perf_counter()
+    try:
+        response = await client.chat.completions.create(**kwargs)
+    except Exception as e:
+        instrumentation.record_llm_call(time.perf_counter() - start, error=type(e).__name__, task="dish")
+        raise
+    instrumentation.record_llm_call(time.perf_counter() - start, *instrumentation.usage_tokens(response), task="dish")
+    return response
+
+
+async def _estimate_one(client, semaphore, d: dict, cache) -> dict:
+    key = llm_cache.make_key(MODEL, task="dish", dish=dish_key(d))
+    text = cache.get(key)
+    result = _parse_one(text) if text is not None else None
+    if result is None:
+        kwargs = {}
+        if structured_output.ENABLED:
+            kwargs["response_format"] = structured_output.response_format(structured_output.DishNutrition)
+        # 同じ料理を同時に聞いている別のセッションがあれば、その結果を待って使う
+        async with semaphore:
+            response = await llm_dispatch.get_dispatcher().acomplete(
+                functools.partial(_create, client), task="dish", key=key, model=MODEL, messages=dish_messages(d), **kwargs
+            )
+        text = response.choices[0].message.content
+        result = _parse_one(text)
+        if result is None:
+            raise ValueError(f"{d['name']} の計算結果を読み取れませんでした: {text!r}")
+        # 検証済みの値だけを JSON で保存する
+        cache.set(key, result.model_dump_json(), MODEL)
+    return structured_output.DishEstimate(**result.model_dump(), name=d["name"]).model_dump()
+
+
+async def _estimate_all(dishes: list, cache):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    async with llm_client.get_async_client() as client:
+        return await asyncio.gather(
+            *(_estimate_one(client, semaphore, d, cache) for d in dishes),
+            return_exceptions=True,
+        )
+
+
+def estimate_dishes(dishes: list, cache=None) -> tuple:
+    """
+    料理ごとに並行してAIに推定させる。結果はキャッシュ（料理名＋量ごと）に残るので、
+    料理を1つ追加・削除しても新たに聞くのはその料理だけになる。
+    戻り値は (dishes と同じ順の結果リスト（失敗はNone）, エラーのリスト)。
+    """
+    if not dishes:
+        return [], []
+    cache = cache or llm_cache.get_cache()
+    outcomes = asyncio.run(_estimate_all(dishes, cache))
+    results = [None if isinstance(o, BaseException) else o for o in outcomes]
+    errors = [o for o in outcomes if isinstance(o, BaseException)]
+    return results, errors
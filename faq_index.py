@@ -0,0 +1,145 @@
+# faq_index.py
+"""
+personality_data.csv の質問（input）に対するBM25検索。
+ほぼ同じ質問なら保存済みの回答（output）をそのまま返し、
+そうでなければ近いQ&Aを few-shot としてプロンプトに足すために使う。
+"""
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import streamlit as st
+
+import instrumentation
+from food_search import ngrams, normalize
+
+FAQ_CSV_PATH = Path(__file__).resolve().parent / "personality_data.csv"
+
+# BM25 のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 正規化スコアがこれ以上なら保存済みの回答で即答する
+HIT_THRESHOLD = float(os.getenv("FAQ_HIT_THRESHOLD", "0.8"))
+# few-shot に使う最低スコアと件数
+FEWSHOT_MIN_SCORE = float(os.getenv("FAQ_FEWSHOT_MIN_SCORE", "0.2"))
+FEWSHOT_K = 3
+
+
+def _tokens(text: str) -> list:
+    # 大量の質問を一度に処理するので、food_search の lru_cache は使わない
+    return ngrams(normalize.__wrapped__(str(text)))
+
+
+class FAQIndex:
+    """質問×bigram の BM25 重みを CSR 行列で持つ。"""
+
+    def __init__(self, questions: list, answers: list):
+        self.questions = questions
+        self.answers = answers
+        vocab = {}
+        indptr = [0]
+        indices = []
+        for q in questions:
+            for g in _tokens(q):
+                indices.append(vocab.setdefault(g, len(vocab)))
+            indptr.append(len(indices))
+        n_docs = len(questions)
+        # 同じ bigram の重複は sum_duplicates で tf にまとめる
+        tf = sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+            shape=(n_docs, len(vocab)),
+        )
+        tf.sum_duplicates()
+        doc_len = np.diff(np.asarray(indptr)).astype(np.float32)
+        self.avgdl = float(doc_len.mean()) if n_docs else 1.0
+        df = np.bincount(tf.indices, minlength=len(vocab)).astype(np.float32)
+        self.idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # 未知の bigram（df=0）の idf
+        self.unknown_idf = float(np.log(1 + (n_docs + 0.5) / 0.5))
+
+        # 文書ごとの BM25 重み（クエリ側は出現の有無だけを見る）
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / self.avgdl)
+        rows = np.repeat(np.arange(n_docs), np.diff(tf.indptr))
+        data = tf.data * (BM25_K1 + 1) / (tf.data + norm[rows])
+        self.weights = sp.csr_matrix((data * self.idf[tf.indices], tf.indices, tf.indptr), shape=tf.shape)
+        self.weights_t = self.weights.T.tocsr()
+        # 自分自身との一致スコア（正規化に使う）
+        self.self_score = np.asarray(self.weights.sum(axis=1)).ravel()
+        self.vocab = vocab
+
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def _query_self_score(self, grams: list) -> float:
+        # クエリを1つの文書とみなしたときの自分自身とのスコア
+        tf = Counter(grams)
+        idf = np.array([self.idf[self.vocab[g]] if g in self.vocab else self.unknown_idf for g in tf])
+        counts = np.array(list(tf.values()), dtype=np.float64)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(grams) / self.avgdl)
+        return float(np.sum(idf * counts * (BM25_K1 + 1) / (counts + norm)))
+
+    def search(self, query: str, k: int = FEWSHOT_K) -> list:
+        """(行番号, 正規化スコア) を上位k件返す。スコアは 1.0 で完全一致。"""
+        grams = _tokens(query)
+        cols = sorted({self.vocab[g] for g in grams if g in self.vocab})
+        if not cols:
+            return []
+        scores = np.asarray(self.weights_t[cols].sum(axis=0)).ravel()
+        hit = np.flatnonzero(scores)
+        # 短い質問が長い質問に含まれるだけで満点にならないよう、大きいほうの自己スコアで割る
+        normalized = scores[hit] / np.maximum(self.self_score[hit], self._query_self_score(grams))
+        top = np.argsort(-normalized, kind="stable")[:k]
+        return [(int(hit[i]), float(normalized[i])) for i in top]
+
+    def lookup(self, query: str, threshold: float = HIT_THRESHOLD, k: int = FEWSHOT_K) -> dict:
+        """
+        即答できれば {"answer": 回答, "question": 一致した質問, "score": スコア, "examples": []}、
+        できなければ {"answer": None, "question": None, "score": 最高スコア, "examples": [(質問, 回答), ...]} を返す。
+        """
+        ranked = self.search(query, k)
+        best = ranked[0][1] if ranked else 0.0
+        hit = best >= threshold
+        with self._lock:
+            self.lookups += 1
+            self.hits += hit
+        instrumentation.record_faq(hit, best)
+        if hit:
+            row = ranked[0][0]
+            return {"answer": self.answers[row], "score": best, "question": self.questions[row], "examples": []}
+        examples = [(self.questions[r], self.answers[r]) for r, s in ranked if s >= FEWSHOT_MIN_SCORE]
+        return {"answer": None, "score": best, "question": None, "examples": examples}
+
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+def load_faq(path: Path = FAQ_CSV_PATH) -> FAQIndex:
+    df = pd.read_csv(path, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+    df = df[(df["input"].str.strip() != "") & (df["output"].str.strip() != "")]
+    return FAQIndex(df["input"].str.strip().tolist(), df["output"].str.strip().tolist())
+
+
+@st.cache_resource(show_spinner=False)
+def get_index() -> FAQIndex:
+    # プロセスで1回だけ作る
+    return load_faq()
+
+
+def with_fewshot(messages: list, examples: list) -> list:
+    # 近いQ&Aを会話の例としてシステムプロンプト（と要約）の直後に挟む（口調と答え方を揃えるため）
+    n = 0
+    while n < len(messages) and messages[n]["role"] == "system":
+        n += 1
+    shots = []
+    for question, answer in examples:
+        shots.append({"role": "user", "content": question})
+        shots.append({"role": "assistant", "content": answer})
+    return messages[:n] + shots + messages[n:]
@@ -0,0 +1,264 @@
+# food_query.py
+"""
+食品成分表の条件検索・ランキング。
+
+    python food_query.py "fat<5" --group 11 --order-by prot_per_100kcal --top 20
+    python food_query.py "0.5<=naclEq<=1.0" "fib not null" --order-by fib
+
+列ごとに値の昇順に並べた行番号（ソート済みインデックス）と、各行がその中の何番目か（順位）を
+持っておく。範囲条件は二分探索で順位の区間にし、複数条件は一番狭い区間の行から
+残りの条件の順位区間・食品群のビットマップで絞り込む（行の走査はしない）。
+欠損値（元データの null や "-"）はインデックスに入れず、欠損マスクで別に持つ。
+"""
+import argparse
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from nutrient_store import CARB, FAT, GROUP_NAMES, KCAL, PROTEIN, get_store, load_store
+
+# 成分表の列から作る派生列
+DERIVED_COLUMNS = ("p_share", "f_share", "c_share", "prot_per_100kcal", "kcal_per_prot")
+
+# 入力しやすい別名
+COLUMN_ALIASES = {"kcal": KCAL, "P": PROTEIN, "F": FAT, "C": CARB, "食塩": "naclEq", "sodium": "na"}
+
+# 画面・CLIで使う表示名
+COLUMN_LABELS = {
+    KCAL: "エネルギー(kcal)",
+    PROTEIN: "たんぱく質(g)",
+    FAT: "脂質(g)",
+    CARB: "炭水化物(g)",
+    "fib": "食物繊維(g)",
+    "naclEq": "食塩相当量(g)",
+    "na": "ナトリウム(mg)",
+    "k": "カリウム(mg)",
+    "ca": "カルシウム(mg)",
+    "fe": "鉄(mg)",
+    "vitC": "ビタミンC(mg)",
+    "p_share": "P比率(%)",
+    "f_share": "F比率(%)",
+    "c_share": "C比率(%)",
+    "prot_per_100kcal": "100kcalあたりたんぱく質(g)",
+    "kcal_per_prot": "たんぱく質1gあたりkcal",
+}
+
+_CONDITION_RE = re.compile(
+    r"^\s*(?:(?P<lo>-?\d+(?:\.\d+)?)\s*(?P<lo_op><=|<)\s*)?"
+    r"(?P<col>[^\s<>=!]+)\s*"
+    r"(?:(?P<op><=|>=|<|>|==|=)\s*(?P<value>-?\d+(?:\.\d+)?)|(?P<null>is\s+null|not\s+null))?\s*$"
+)
+
+
+def parse_condition(text: str) -> list:
+    """
+    "fat<5" "0.5<=naclEq<=1" "fib not null" のような条件を (列, 演算子, 値) のリストにする。
+    演算子は < <= > >= = と null / notnull。
+    """
+    m = _CONDITION_RE.match(text)
+    if m is None or (m.group("op") is None and m.group("null") is None):
+        raise ValueError(f"条件を読み取れません: {text}")
+    col = COLUMN_ALIASES.get(m.group("col"), m.group("col"))
+    out = []
+    if m.group("lo") is not None:
+        # "a <= col" は "col >= a"
+        out.append((col, ">=" if m.group("lo_op") == "<=" else ">", float(m.group("lo"))))
+    if m.group("null"):
+        out.append((col, "null" if m.group("null").startswith("is") else "notnull", None))
+    else:
+        out.append((col, "=" if m.group("op") == "==" else m.group("op"), float(m.group("value"))))
+    return out
+
+
+def derived_columns(store) -> dict:
+    # P/F/C のエネルギー比（%）と、たんぱく質あたりのカロリー
+    kcal = store.column(KCAL)
+    p, f, c = store.column(PROTEIN), store.column(FAT), store.column(CARB)
+    energy = 4.0 * p + 9.0 * f + 4.0 * c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        energy = np.where(energy > 0, energy, np.nan)
+        return {
+            "p_share": 400.0 * p / energy,
+            "f_share": 900.0 * f / energy,
+            "c_share": 400.0 * c / energy,
+            "prot_per_100kcal": np.where(kcal > 0, p * 100.0 / kcal, np.nan),
+            "kcal_per_prot": np.where(p > 0, kcal / p, np.nan),
+        }
+
+
+class FoodQuery:
+    """列ごとのソート済みインデックス・順位・欠損マスクと、食品群ごとのビットマップ。"""
+
+    def __init__(self, store):
+        self.store = store
+        n = len(store)
+        self.values = {c: np.asarray(store.column(c), dtype=np.float64) for c in store.columns}
+        self.values.update(derived_columns(store))
+        self.null = {}
+        self.order = {}
+        self.sorted_values = {}
+        self.rank = {}
+        for col, values in self.values.items():
+            null = np.isnan(values)
+            present = np.flatnonzero(~null)
+            order = present[np.argsort(values[present], kind="stable")]
+            rank = np.full(n, n, dtype=np.int32)  # 欠損は順位 n（どの区間にも入らない）
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            self.null[col] = null
+            self.order[col] = order
+            self.sorted_values[col] = values[order]
+            self.rank[col] = rank
+        groups = np.asarray(store.group_id)
+        self.group_bits = {int(g): groups == g for g in np.unique(groups)}
+        self.group_rows = {g: np.flatnonzero(bits) for g, bits in self.group_bits.items()}
+        self.all_rows = np.arange(n)
+
+    @property
+    def columns(self) -> tuple:
+        return tuple(self.values)
+
+    def _column(self, name: str) -> str:
+        name = COLUMN_ALIASES.get(name, name)
+        if name not in self.values:
+            raise KeyError(f"未知の列です: {name}")
+        return name
+
+    def rank_range(self, column: str, op: str, value: float) -> tuple:
+        """条件を満たす順位の区間 [start, stop) を返す。"""
+        column = self._column(column)
+        sv = self.sorted_values[column]
+        if op == ">=":
+            return int(np.searchsorted(sv, value, "left")), len(sv)
+        if op == ">":
+            return int(np.searchsorted(sv, value, "right")), len(sv)
+        if op == "<=":
+            return 0, int(np.searchsorted(sv, value, "right"))
+        if op == "<":
+            return 0, int(np.searchsorted(sv, value, "left"))
+        if op == "=":
+            return int(np.searchsorted(sv, value, "left")), int(np.searchsorted(sv, value, "right"))
+        raise ValueError(f"未知の演算子です: {op}")
+
+    def _normalize(self, conditions) -> list:
+        out = []
+        for cond in conditions:
+            out.extend(parse_condition(cond) if isinstance(cond, str) else [cond])
+        return out
+
+    def select(self, conditions=(), group: int | None = None) -> np.ndarray:
+        """条件をすべて満たす行番号（昇順）。group で食品群を絞る。"""
+        ranges = {}
+        null_checks = []
+        for col, op, value in self._normalize(conditions):
+            col = self._column(col)
+            if op in ("null", "notnull"):
+                null_checks.append((col, op == "null"))
+                continue
+            start, stop = self.rank_range(col, op, value)
+            # 同じ列の条件は区間の共通部分にまとめる
+            prev = ranges.get(col, (0, len(self.sorted_values[col])))
+            ranges[col] = (max(prev[0], start), min(prev[1], stop))
+
+        # 一番狭い候補（範囲条件の区間か食品群）から始める
+        sizes = [(stop - start, col) for col, (start, stop) in ranges.items()]
+        if group is not None:
+            sizes.append((len(self.group_rows.get(group, ())), None))
+        if not sizes:
+            rows = self.all_rows
+        else:
+            _, first = min(sizes, key=lambda s: s[0])
+            if first is None:
+                rows = self.group_rows.get(group, np.empty(0, dtype=np.int64))
+            else:
+                start, stop = ranges.pop(first)
+                rows = np.sort(self.order[first][start:max(start, stop)])
+            if group is not None and first is not None:
+                bits = self.group_bits.get(group)
+                rows = rows[bits[rows]] if bits is not None else rows[:0]
+        for col, (start, stop) in ranges.items():
+            r = self.rank[col][rows]
+            rows = rows[(r >= start) & (r < stop)]
+        for col, want_null in null_checks:
+            rows = rows[self.null[col][rows] == want_null]
+        return rows
+
+    def top(self, rows: np.ndarray, order_by: str, k: int | None = None, descending: bool = True) -> np.ndarray:
+        """rows を order_by の順に並べて上位 k 件を返す（order_by が欠損の行は除く）。"""
+        order_by = self._column(order_by)
+        r = self.rank[order_by][rows]
+        keep = r < len(self.store)
+        rows, r = rows[keep], r[keep]
+        key = -r if descending else r
+        if k is not None and k < len(rows):
+            part = np.argpartition(key, k - 1)[:k]
+            rows, key = rows[part], key[part]
+        return rows[np.argsort(key, kind="stable")]
+
+    def query(self, conditions=(), group: int | None = None, order_by: str | None = None,
+              k: int | None = None, descending: bool = True) -> np.ndarray:
+        rows = self.select(conditions, group)
+        if order_by is not None:
+            return self.top(rows, order_by, k, descending)
+        return rows if k is None else rows[:k]
+
+    def frame(self, rows, columns=()) -> pd.DataFrame:
+        rows = np.asarray(rows, dtype=np.int64)
+        data = {
+            "foodId": self.store.food_id[rows],
+            "食品群": [GROUP_NAMES.get(int(g), str(g)) for g in self.store.group_id[rows]],
+            "食品名": self.store.food_name[rows],
+        }
+        for col in columns:
+            col = self._column(col)
+            data[COLUMN_LABELS.get(col, col)] = np.round(self.values[col][rows], 2)
+        return pd.DataFrame(data)
+
+
+@st.cache_resource(show_spinner=False)
+def get_engine() -> FoodQuery:
+    return FoodQuery(get_store())
+
+
+# --------------------------
+# CLI
+# --------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="食品成分表を条件・ランキングで検索する")
+    parser.add_argument("conditions", nargs="*", help='条件（例: "fat<5" "0.5<=naclEq<=1" "fib not null"）')
+    parser.add_argument("--group", type=int, help="食品群（groupId）")
+    parser.add_argument("--order-by", help="並べ替える列（例: prot_per_100kcal）")
+    parser.add_argument("--asc", action="store_true", help="小さい順に並べる")
+    parser.add_argument("--top", type=int, default=20, help="表示件数")
+    parser.add_argument("--columns", nargs="*", help="表示する列（既定は条件と並べ替えの列）")
+    parser.add_argument("--list-columns", action="store_true", help="使える列の一覧を表示")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    engine = FoodQuery(load_store())
+    t1 = time.perf_counter()
+    if args.list_columns:
+        for col in engine.columns:
+            print(f"{col}\t{COLUMN_LABELS.get(col, '')}")
+        return
+    try:
+        rows = engine.query(args.conditions, args.group, args.order_by, args.top, not args.asc)
+    except (KeyError, ValueError) as e:
+        parser.error(str(e))
+    t2 = time.perf_counter()
+    columns = args.columns
+    if columns is None:
+        columns = list(dict.fromkeys(
+            [c for cond in args.conditions for c, _, _ in parse_condition(cond)]
+            + ([COLUMN_ALIASES.get(args.order_by, args.order_by)] if args.order_by else [])
+        ))
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(engine.frame(rows, columns).to_string(index=False))
+    print(f"索引作成 {(t1 - t0) * 1000:.1f} ms, 検索 {(t2 - t1) * 1000:.3f} ms, {len(rows)} 件", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# food_query_app.py
+import streamlit as st
+
+import food_query
+from nutrient_store import GROUP_NAMES
+
+# 並べ替えに使う列（表示名つき）
+SORT_COLUMNS = list(food_query.COLUMN_LABELS)
+
+
+def main():
+    st.title("🔎 食品検索アプリ")
+    st.caption("食品成分表（100gあたり）を条件で絞り込み、栄養素の多い順・少ない順に並べます。")
+
+    engine = food_query.get_engine()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        group = st.selectbox(
+            "食品群",
+            options=[None] + list(GROUP_NAMES),
+            format_func=lambda g: "すべて" if g is None else GROUP_NAMES[g],
+            key="fq_group",
+        )
+        order_by = st.selectbox(
+            "並べ替え",
+            options=SORT_COLUMNS,
+            index=SORT_COLUMNS.index("prot_per_100kcal"),
+            format_func=lambda c: food_query.COLUMN_LABELS[c],
+            key="fq_order_by",
+        )
+        descending = st.radio("順番", ["多い順", "少ない順"], horizontal=True, key="fq_order") == "多い順"
+        top_k = st.number_input("表示件数", min_value=1, max_value=200, value=20, step=1, key="fq_top")
+    with col2:
+        conditions_text = st.text_area(
+            "条件（1行に1つ。例: fat<5、0.5<=naclEq<=1、fib not null）",
+            value="fat<5",
+            key="fq_conditions",
+        )
+        with st.expander("使える列"):
+            st.caption(" / ".join(f"{c}: {label}" for c, label in food_query.COLUMN_LABELS.items()))
+            st.caption("別名: " + " / ".join(f"{a} = {c}" for a, c in food_query.COLUMN_ALIASES.items()))
+
+    conditions = [line.strip() for line in conditions_text.splitlines() if line.strip()]
+    try:
+        matched = engine.select(conditions, group)
+    except (KeyError, ValueError) as e:
+        st.error(str(e))
+        return
+
+    columns = list(dict.fromkeys(
+        [c for cond in conditions for c, _, _ in food_query.parse_condition(cond)] + [order_by]
+    ))
+    rows = engine.top(matched, order_by, int(top_k), descending)
+    st.write(f"{len(matched)} 件中 上位 {len(rows)} 件")
+    st.dataframe(engine.frame(rows, columns), use_container_width=True, hide_index=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# food_search.py
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import streamlit as st
+
+from nutrient_store import CACHE_DIR, CACHE_VERSION, FOOD_JSON_PATH, get_store
+
+INDEX_PATH = CACHE_DIR / "food_search_index.npz"
+
+# --------------------------
+# 表記ゆれの正規化
+# --------------------------
+# 成分表はかな表記（にわとり、ぶた…）が多いので、よく使う漢字を読みに寄せる
+KANJI_READINGS = {
+    "鶏": "にわとり",
+    "豚": "ぶた",
+    "牛": "うし",
+    "胸": "むね",
+    "腿": "もも",
+    "鮭": "さけ",
+    "鯖": "さば",
+    "鰯": "いわし",
+    "鮪": "まぐろ",
+    "卵": "たまご",
+    "玉子": "たまご",
+    "揚げ": "あげ",
+    "揚": "あげ",
+    "焼き": "やき",
+    "焼": "やき",
+    "茹で": "ゆで",
+    "ご飯": "めし",
+    "御飯": "めし",
+    "飯": "めし",
+    "米": "こめ",
+    "麦": "むぎ",
+    "蕎麦": "そば",
+    "饂飩": "うどん",
+    "大根": "だいこん",
+    "人参": "にんじん",
+    "玉葱": "たまねぎ",
+    "葱": "ねぎ",
+    "南瓜": "かぼちゃ",
+    "胡瓜": "きゅうり",
+    "茄子": "なす",
+    "納豆": "なっとう",
+    "豆腐": "とうふ",
+    "大豆": "だいず",
+    "牛乳": "ぎゅうにゅう",
+}
+
+_READING_RE = re.compile("|".join(sorted(map(re.escape, KANJI_READINGS), key=len, reverse=True)))
+_KATA_TO_HIRA = {c: c - 0x60 for c in range(ord("ァ"), ord("ヶ") + 1)}
+_STRIP_RE = re.compile(r"[\s<>\[\]()（）［］〔〕【】・、。,/:%]+")
+
+
+@lru_cache(maxsize=4096)
+def normalize(text: str) -> str:
+    # NFKC（全角/半角の統一）→ 漢字の読み → カタカナをひらがなへ → 記号除去
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _READING_RE.sub(lambda m: KANJI_READINGS[m.group()], text)
+    text = text.translate(_KATA_TO_HIRA)
+    return _STRIP_RE.sub("", text)
+
+
+def ngrams(text: str) -> list:
+    # 2文字以上はbigram、1文字はunigram
+    if len(text) < 2:
+        return [text] if text else []
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+# --------------------------
+# n-gram 転置インデックス
+# --------------------------
+class FoodSearchIndex:
+    def __init__(self, names, vocab, offsets, postings, doc_len):
+        self.names = names            # 正規化済みの食品名
+        self.doc_len = doc_len
+        self._n = len(names)
+        self._postings = {
+            g: postings[offsets[i]:offsets[i + 1]] for i, g in enumerate(vocab.tolist())
+        }
+        self._idf = {
+            g: math.log(1 + self._n / len(p)) for g, p in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return self._n
+
+    def search(self, query: str, k: int = 10) -> list:
+        """(行番号, スコア) を上位k件返す。スコアはクエリn-gramの一致率（0〜1+α）。"""
+        q = normalize(query)
+        grams = set(ngrams(q))
+        if not grams:
+            return []
+        total = sum(self._idf.get(g, math.log(1 + self._n)) for g in grams)
+        scores = np.zeros(self._n, dtype=np.float64)
+        for g in grams:
+            post = self._postings.get(g)
+            if post is not None:
+                scores[post] += self._idf[g]
+        hit = np.flatnonzero(scores)
+        if hit.size == 0:
+            return []
+        # 一致率を基本に、短い名前をわずかに優先し、クエリ全体を含む名前を上げる
+        base = scores[hit] / total - 0.002 * self.doc_len[hit]
+        top = np.argsort(-base, kind="stable")[: k * 4]
+        ranked = [
+            (int(hit[i]), float(base[i]) + (0.5 if q in self.names[hit[i]] else 0.0))
+            for i in top
+        ]
+        ranked.sort(key=lambda x: -x[1])
+        return ranked[:k]
+
+    def contains(self, row: int, query: str) -> bool:
+        # クエリ全体が食品名に含まれるか（確度の高い一致の判定用）
+        q = normalize(query)
+        return bool(q) and q in self.names[row]
+
+
+def build_index(store=None, path: Path = INDEX_PATH) -> Path:
+    store = store or get_store()
+    names = [normalize(str(n)) for n in store.food_name]
+    postings = defaultdict(list)
+    for row, name in enumerate(names):
+        for g in set(ngrams(name)) | set(name):
+            postings[g].append(row)
+    vocab = sorted(postings)
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[g]) for g in vocab])
+    flat = np.concatenate([np.asarray(postings[g], dtype=np.int32) for g in vocab])
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    stat = FOOD_JSON_PATH.stat()
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(
+        tmp,
+        names=np.array(names, dtype=np.str_),
+        vocab=np.array(vocab, dtype=np.str_),
+        offsets=offsets,
+        postings=flat,
+        doc_len=np.array([len(n) for n in names], dtype=np.int32),
+        signature=np.array(json.dumps([CACHE_VERSION, stat.st_size, stat.st_mtime_ns])),
+    )
+    os.replace(tmp, path)
+    return path
+
+
+def load_index(path: Path = INDEX_PATH, store=None) -> FoodSearchIndex:
+    store = store or get_store()
+    stat = FOOD_JSON_PATH.stat()
+    signature = json.dumps([CACHE_VERSION, stat.st_size, stat.st_mtime_ns])
+    try:
+        data = np.load(path)
+        fresh = str(data["signature"]) == signature
+    except (OSError, KeyError, ValueError):
+        fresh = False
+    if not fresh:
+        build_index(store, path)
+        data = np.load(path)
+    return FoodSearchIndex(
+        names=data["names"].tolist(),
+        vocab=data["vocab"],
+        offsets=data["offsets"],
+        postings=data["postings"],
+        doc_len=data["doc_len"],
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_index() -> FoodSearchIndex:
+    return load_index()
+
+
+def suggest(query: str, k: int = 8) -> list:
+    """入力途中の文字列から (foodId, foodName) の候補を返す。"""
+    if not query or not query.strip():
+        return []
+    index, store = get_index(), get_store()
+    return [(int(store.food_id[row]), str(store.food_name[row])) for row, _ in index.search(query, k)]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    idx = load_index()
+    for q in sys.argv[1:] or ["鶏むね肉", "からあげ", "ご飯", "ブロッコリー"]:
+        t0 = time.perf_counter()
+        hits = idx.search(q, 5)
+        dt = (time.perf_counter() - t0) * 1e6
+        print(f"{q} ({dt:.0f} µs)")
+        store = get_store()
+        for row, score in hits:
+            print(f"  {score:.3f} {store.food_name[row]}")
@@ -0,0 +1,135 @@
+# food_substitutes.py
+"""
+PFCバランスが近い食品（置き換え候補）の検索。
+全食品を「100kcalあたりの栄養素」に直して標準化したベクトルにし、
+cKDTree（全体用と食品群ごと）で近傍を引く。
+"""
+import numpy as np
+import streamlit as st
+from scipy.spatial import cKDTree
+
+from nutrient_store import CARB, FAT, KCAL, PROTEIN, get_store
+
+# (列名, 重み)。P/F/C はエネルギー比、それ以外は100kcalあたりの量（対数）
+MACRO_FEATURES = ((PROTEIN, 4.0), (FAT, 9.0), (CARB, 4.0))
+MICRO_FEATURES = ("fib", "naclEq", "k", "ca", "fe")
+MACRO_WEIGHT = 3.0
+MICRO_WEIGHT = 0.5
+
+# これ未満の食品（お茶・水・香辛料少量など）は100kcalあたりの値が発散するので対象外
+MIN_KCAL = 10.0
+
+DEFAULT_K = 5
+
+
+def feature_matrix(store, rows=None) -> np.ndarray:
+    """(食品数, 特徴量数) の標準化前の特徴量。kcal が MIN_KCAL 未満の行は NaN。"""
+    kcal = store.matrix((KCAL,), rows)[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_100kcal = np.where(kcal >= MIN_KCAL, 100.0 / kcal, np.nan)
+    macros = store.matrix(tuple(c for c, _ in MACRO_FEATURES), rows)
+    energy = macros * np.array([f for _, f in MACRO_FEATURES]) / 100.0 * per_100kcal[:, None]
+    micros = np.log1p(store.matrix(MICRO_FEATURES, rows) * per_100kcal[:, None])
+    return np.hstack([energy, micros])
+
+
+class SubstituteIndex:
+    """食品全体と食品群ごとの cKDTree。"""
+
+    def __init__(self, store):
+        self.store = store
+        raw = feature_matrix(store)
+        valid = ~np.isnan(raw).any(axis=1)
+        # 標準化（P/F/C は比率なのでそのまま重みだけ掛ける）
+        n_macro = len(MACRO_FEATURES)
+        scale = np.ones(raw.shape[1])
+        scale[:n_macro] = MACRO_WEIGHT
+        std = raw[valid, n_macro:].std(axis=0)
+        scale[n_macro:] = MICRO_WEIGHT / np.where(std > 0, std, 1.0)
+        self.scale = scale
+        self.points = np.where(valid[:, None], raw * scale, np.nan)
+        self.valid = valid
+
+        rows = np.flatnonzero(valid)
+        self._trees = {None: (cKDTree(self.points[rows]), rows)}
+        groups = np.asarray(store.group_id)
+        for g in np.unique(groups[rows]):
+            g_rows = rows[groups[rows] == g]
+            self._trees[int(g)] = (cKDTree(self.points[g_rows]), g_rows)
+
+    def __len__(self) -> int:
+        return int(self.valid.sum())
+
+    def similar_many(self, rows, k: int = DEFAULT_K, group: int | None = None,
+                     same_group: bool = True, max_distance: float = np.inf) -> list:
+        """
+        各行について近い食品を (行番号, 距離) のリストで返す（自分自身は除く）。
+        group を指定するとその食品群だけ、same_group=True なら各食品と同じ群から探す。
+        対象外の食品（kcal が小さすぎる）は空リスト。
+        """
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        out = [[] for _ in rows]
+        if group is None and same_group:
+            keys = np.asarray(self.store.group_id)[rows].astype(np.int64)
+        else:
+            keys = np.full(len(rows), -1 if group is None else group)
+        for key in np.unique(keys):
+            tree, tree_rows = self._trees.get(None if key == -1 else int(key), (None, None))
+            if tree is None:
+                continue
+            pos = np.flatnonzero((keys == key) & self.valid[rows])
+            if not len(pos):
+                continue
+            kk = min(k + 1, len(tree_rows))
+            dist, idx = tree.query(self.points[rows[pos]], k=kk, distance_upper_bound=max_distance)
+            dist, idx = dist.reshape(len(pos), kk), idx.reshape(len(pos), kk)
+            for p, d_row, i_row in zip(pos, dist, idx):
+                hits = [
+                    (int(tree_rows[i]), float(d))
+                    for d, i in zip(d_row, i_row)
+                    if i < len(tree_rows) and tree_rows[i] != rows[p]
+                ]
+                out[p] = hits[:k]
+        return out
+
+    def similar(self, row: int, k: int = DEFAULT_K, group: int | None = None,
+                same_group: bool = True, max_distance: float = np.inf) -> list:
+        return self.similar_many([row], k, group, same_group, max_distance)[0]
+
+
+def same_kcal_grams(store, row: int, grams: float, substitute_rows) -> np.ndarray:
+    # row を grams 食べたのと同じカロリーになる置き換え先のグラム数
+    kcal = store.column(KCAL, fill=0.0)
+    target = kcal[row] * grams
+    sub = kcal[np.asarray(substitute_rows, dtype=np.int64)]
+    return target / np.where(sub > 0, sub, np.nan)
+
+
+@st.cache_resource(show_spinner=False)
+def get_index() -> SubstituteIndex:
+    return SubstituteIndex(get_store())
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from calorie_engine import resolve_food
+
+    t0 = time.perf_counter()
+    index = SubstituteIndex(get_store())
+    t1 = time.perf_counter()
+    print(f"build: {(t1 - t0) * 1000:.1f} ms, foods: {len(index)}")
+    for name in sys.argv[1:] or ["鶏むね肉", "ご飯"]:
+        resolved = resolve_food(name)
+        if not resolved:
+            print(f"{name}: 見つかりません")
+            continue
+        row, serving = resolved
+        t0 = time.perf_counter()
+        hits = index.similar(row)
+        elapsed = (time.perf_counter() - t0) * 1000
+        grams = same_kcal_grams(index.store, row, serving, [r for r, _ in hits])
+        print(f"{name}（{index.store.food_name[row]} {serving:.0f}g） {elapsed:.3f} ms")
+        for (r, d), g in zip(hits, grams):
+            print(f"  {index.store.food_name[r]}  {g:.0f}g  距離 {d:.3f}")
@@ -0,0 +1,415 @@
+# instrumentation.py
+"""
+ページ描画とLLM呼び出しの計測。
+
+    DIET_APP_METRICS_LOG=logs/metrics.jsonl   計測イベントの出力先（ローテーションあり）
+    DIET_APP_PROFILE=cprofile|pyinstrument    次の1回の再実行だけプロファイルを取る
+
+    python instrumentation.py logs/metrics.jsonl            ページ・LLMごとの p50/p95 を表示
+    python instrumentation.py logs/metrics.jsonl --prometheus
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+import numpy as np
+
+LOG_PATH = Path(os.getenv("DIET_APP_METRICS_LOG", str(Path(__file__).resolve().parent / "logs" / "metrics.jsonl")))
+LOG_MAX_BYTES = int(os.getenv("DIET_APP_METRICS_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("DIET_APP_METRICS_LOG_BACKUPS", "5"))
+PROFILE_MODE = os.getenv("DIET_APP_PROFILE", "").strip().lower()
+
+# パーセンタイル計算用に保持する直近のサンプル数
+SAMPLE_WINDOW = 2048
+
+# st.stop() や再実行は正常な制御フローとして扱う
+_CONTROL_FLOW_EXCEPTIONS = ("StopException", "RerunException")
+
+_current_page = contextvars.ContextVar("current_page", default="-")
+
+
+# --------------------------
+# JSONL 出力
+# --------------------------
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _get_logger() -> logging.Logger:
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            logger = logging.getLogger("diet_app.metrics")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            try:
+                LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+                handler = RotatingFileHandler(
+                    LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+            except OSError:
+                # 書き込めない環境では集計だけ行う
+                logger.addHandler(logging.NullHandler())
+            _logger = logger
+    return _logger
+
+
+def emit(event: dict):
+    event = {"ts": round(time.time(), 3), **event}
+    _get_logger().info(json.dumps(event, ensure_ascii=False))
+
+
+# --------------------------
+# プロセス内の集計
+# --------------------------
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+        self.counters = defaultdict(float)
+
+    def observe(self, name: str, labels: tuple, value: float):
+        with self._lock:
+            self.samples[(name, labels)].append(value)
+            self.counters[(name + "_count", labels)] += 1
+            self.counters[(name + "_sum", labels)] += value
+
+    def inc(self, name: str, labels: tuple, value: float = 1):
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def set(self, name: str, labels: tuple, value: float):
+        # ゲージ（最後の値だけ持つ）
+        with self._lock:
+            self.counters[(name, labels)] = value
+
+    def quantiles(self, name: str, qs=(50, 95)) -> dict:
+        with self._lock:
+            items = [(labels, np.array(v)) for (n, labels), v in self.samples.items() if n == name and v]
+        return {labels: {q: float(np.percentile(v, q)) for q in qs} for labels, v in items}
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            samples = {k: np.array(v) for k, v in self.samples.items() if v}
+            counters = dict(self.counters)
+        for (name, labels), values in sorted(samples.items()):
+            for q in (0.5, 0.95):
+                lines.append(f"{name}{_labels(labels + (('quantile', q),))} {np.quantile(values, q):.6f}")
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.counters.clear()
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+METRICS = Metrics()
+
+
+def prometheus_text() -> str:
+    return METRICS.prometheus_text()
+
+
+# --------------------------
+# 記録用API
+# --------------------------
+def current_page() -> str:
+    return _current_page.get()
+
+
+def record_llm_call(duration: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                    error: str | None = None, first_token: float | None = None, task: str = "chat"):
+    labels = (("page", current_page()), ("task", task))
+    METRICS.observe("diet_app_llm_latency_seconds", labels, duration)
+    METRICS.inc("diet_app_llm_requests_total", labels)
+    METRICS.inc("diet_app_llm_prompt_tokens_total", labels, prompt_tokens)
+    METRICS.inc("diet_app_llm_completion_tokens_total", labels, completion_tokens)
+    if first_token is not None:
+        METRICS.observe("diet_app_llm_first_token_seconds", labels, first_token)
+    if error:
+        METRICS.inc("diet_app_llm_errors_total", labels)
+    emit({
+        "type": "llm",
+        "page": current_page(),
+        "task": task,
+        "duration_ms": round(duration * 1000, 2),
+        "first_token_ms": None if first_token is None else round(first_token * 1000, 2),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "error": error,
+    })
+
+
+def record_cache(hit: bool):
+    labels = (("page", current_page()),)
+    METRICS.inc("diet_app_llm_cache_hits_total" if hit else "diet_app_llm_cache_misses_total", labels)
+    emit({"type": "cache", "page": current_page(), "hit": hit})
+
+
+def record_faq(hit: bool, score: float):
+    labels = (("page", current_page()),)
+    METRICS.inc("diet_app_faq_hits_total" if hit else "diet_app_faq_misses_total", labels)
+    METRICS.observe("diet_app_faq_score", labels, score)
+    emit({"type": "faq", "page": current_page(), "hit": hit, "score": round(score, 4)})
+
+
+def record_dispatch(kind: str, task: str, wait: float | None = None, limit: float | None = None):
+    # llm_dispatch の待ち時間・まとめた件数・再試行・429 を記録する
+    labels = (("task", task),)
+    if kind == "queue_wait":
+        METRICS.observe("diet_app_llm_queue_wait_seconds", labels, wait or 0.0)
+        return
+    METRICS.inc(f"diet_app_llm_{kind}_total", labels)
+    emit({"type": "dispatch", "page": current_page(), "kind": kind, "task": task, "limit": limit})
+
+
+def record_warmup(step: str, duration: float, error: str | None = None):
+    labels = (("step", step),)
+    METRICS.observe("diet_app_warmup_seconds", labels, duration)
+    if error:
+        METRICS.inc("diet_app_warmup_errors_total", labels)
+    emit({"type": "warmup", "step": step, "duration_ms": round(duration * 1000, 2), "error": error})
+
+
+def record_structured(task: str, outcome: str):
+    # outcome: ok / repaired（途中切れを補って読めた）/ rejected（読めなかった）
+    labels = (("page", current_page()), ("task", task), ("outcome", outcome))
+    METRICS.inc("diet_app_llm_structured_total", labels)
+    emit({"type": "structured", "page": current_page(), "task": task, "outcome": outcome})
+
+
+def record_session_state(page: str, nbytes: int):
+    METRICS.observe("diet_app_session_state_bytes", (("page", page),), nbytes)
+
+
+def record_session_compaction(kind: str, n: int = 1):
+    # kind: chat_spill（退避した発言数）/ result_cap / evict / restore
+    METRICS.inc("diet_app_session_compactions_total", (("kind", kind),), n)
+
+
+def record_sessions(sessions: int, state_bytes: int, rss: int, evicted_total: int = 0):
+    METRICS.set("diet_app_sessions", (), sessions)
+    METRICS.set("diet_app_sessions_state_bytes", (), state_bytes)
+    METRICS.set("diet_app_rss_bytes", (), rss)
+    emit({"type": "sessions", "sessions": sessions, "state_bytes": state_bytes, "rss_bytes": rss,
+          "evicted_total": evicted_total})
+
+
+def usage_tokens(obj) -> tuple:
+    usage = getattr(obj, "usage", None)
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+def timed_completion(create, task: str = "chat", **kwargs):
+    """chat.completions.create を計測しながら呼ぶ。stream=True なら計測付きのイテレータを返す。"""
+    start = time.perf_counter()
+    try:
+        result = create(**kwargs)
+    except Exception as e:
+        record_llm_call(time.perf_counter() - start, error=type(e).__name__, task=task)
+        raise
+    if not kwargs.get("stream"):
+        record_llm_call(time.perf_counter() - start, *usage_tokens(result), task=task)
+        return result
+    return _timed_stream(result, start, task)
+
+
+def _timed_stream(stream, start: float, task: str):
+    first = None
+    tokens = (0, 0)
+    error = None
+    try:
+        for chunk in stream:
+            if first is None:
+                first = time.perf_counter() - start
+            if getattr(chunk, "usage", None) is not None:
+                tokens = usage_tokens(chunk)
+            yield chunk
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record_llm_call(time.perf_counter() - start, *tokens, error=error, first_token=first, task=task)
+
+
+# --------------------------
+# ページ計測とプロファイル
+# --------------------------
+_profile_armed = bool(PROFILE_MODE)
+_profile_lock = threading.Lock()
+
+
+def arm_profiler():
+    # 次の1回の再実行をプロファイルする
+    global _profile_armed
+    _profile_armed = True
+
+
+def _take_profile_slot() -> bool:
+    global _profile_armed
+    with _profile_lock:
+        if not _profile_armed or not PROFILE_MODE:
+            return False
+        _profile_armed = False
+        return True
+
+
+@contextlib.contextmanager
+def _profiler(page: str):
+    out_dir = LOG_PATH.parent
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    safe = "".join(c if c.isalnum() else "_" for c in page)
+    if PROFILE_MODE == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logging.getLogger(__name__).warning("pyinstrument がインストールされていないためプロファイルを取りません")
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            out_dir.mkdir(parents=True, exist_ok=True)
+            (out_dir / f"profile-{safe}-{stamp}.html").write_text(profiler.output_html(), encoding="utf-8")
+    else:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            out_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(out_dir / f"profile-{safe}-{stamp}.prof")
+
+
+@contextlib.contextmanager
+def page_timer(page: str):
+    """ページの描画（1回の再実行）を計測する。中で行われたLLM呼び出しはこのページに紐づく。"""
+    token = _current_page.set(page)
+    profile = _profiler(page) if _take_profile_slot() else contextlib.nullcontext()
+    start = time.perf_counter()
+    error = None
+    try:
+        with profile:
+            yield
+    except Exception as e:
+        if type(e).__name__ not in _CONTROL_FLOW_EXCEPTIONS:
+            error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        labels = (("page", page),)
+        METRICS.observe("diet_app_page_render_seconds", labels, duration)
+        if error:
+            METRICS.inc("diet_app_page_errors_total", labels)
+        emit({"type": "page", "page": page, "duration_ms": round(duration * 1000, 2), "error": error})
+        _current_page.reset(token)
+
+
+# --------------------------
+# ログからの集計（複数プロセス分をまとめて見る）
+# --------------------------
+def load_events(paths) -> Metrics:
+    metrics = Metrics()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue
+                if ev.get("type") == "page":
+                    labels = (("page", ev["page"]),)
+                    metrics.observe("diet_app_page_render_seconds", labels, ev["duration_ms"] / 1000)
+                    if ev.get("error"):
+                        metrics.inc("diet_app_page_errors_total", labels)
+                elif ev.get("type") == "llm":
+                    labels = (("page", ev["page"]), ("task", ev.get("task", "chat")))
+                    metrics.observe("diet_app_llm_latency_seconds", labels, ev["duration_ms"] / 1000)
+                    metrics.inc("diet_app_llm_requests_total", labels)
+                    metrics.inc("diet_app_llm_prompt_tokens_total", labels, ev.get("prompt_tokens") or 0)
+                    metrics.inc("diet_app_llm_completion_tokens_total", labels, ev.get("completion_tokens") or 0)
+                    if ev.get("first_token_ms") is not None:
+                        metrics.observe("diet_app_llm_first_token_seconds", labels, ev["first_token_ms"] / 1000)
+                    if ev.get("error"):
+                        metrics.inc("diet_app_llm_errors_total", labels)
+                elif ev.get("type") == "cache":
+                    name = "diet_app_llm_cache_hits_total" if ev.get("hit") else "diet_app_llm_cache_misses_total"
+                    metrics.inc(name, (("page", ev["page"]),))
+                elif ev.get("type") == "structured":
+                    labels = (("page", ev["page"]), ("task", ev.get("task", "")), ("outcome", ev["outcome"]))
+                    metrics.inc("diet_app_llm_structured_total", labels)
+                elif ev.get("type") == "faq":
+                    labels = (("page", ev["page"]),)
+                    name = "diet_app_faq_hits_total" if ev.get("hit") else "diet_app_faq_misses_total"
+                    metrics.inc(name, labels)
+                    metrics.observe("diet_app_faq_score", labels, ev.get("score") or 0.0)
+    return metrics
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="計測ログ（JSONL）を集計する")
+    parser.add_argument("logs", nargs="*", type=Path, default=[LOG_PATH])
+    parser.add_argument("--prometheus", action="store_true", help="Prometheus テキスト形式で出力")
+    args = parser.parse_args(argv)
+
+    metrics = load_events(args.logs)
+    if args.prometheus:
+        print(metrics.prometheus_text(), end="")
+        return
+    for name, title in (
+        ("diet_app_page_render_seconds", "ページ描画"),
+        ("diet_app_llm_latency_seconds", "LLM呼び出し"),
+        ("diet_app_llm_first_token_seconds", "LLM最初のトークン"),
+    ):
+        rows = metrics.quantiles(name)
+        if not rows:
+            continue
+        print(f"[{title}]")
+        for labels, q in sorted(rows.items()):
+            label = " ".join(str(v) for _, v in labels)
+            count = int(metrics.counters[(name + "_count", labels)])
+            print(f"  {label}: n={count} p50={q[50] * 1000:.1f}ms p95={q[95] * 1000:.1f}ms")
+
+    # FAQ即答のヒット率
+    faq = defaultdict(lambda: [0, 0])
+    for (name, labels), value in metrics.counters.items():
+        if name in ("diet_app_faq_hits_total", "diet_app_faq_misses_total"):
+            faq[labels][name == "diet_app_faq_misses_total"] += value
+    if faq:
+        print("[FAQ即答]")
+        for labels, (hits, misses) in sorted(faq.items()):
+            label = " ".join(str(v) for _, v in labels)
+            print(f"  {label}: {int(hits)}/{int(hits + misses)} ヒット率={hits / (hits + misses):.1%}")
+
+
+if __name__ == "__main__":
+    main()
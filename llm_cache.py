@@ -0,0 +1,192 @@
+# llm_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import streamlit as st
+
+import instrumentation
+from nutrient_store import CACHE_DIR
+
+# 再デプロイ後も残したい場合は永続ボリューム上のパスを指定する
+CACHE_PATH = Path(os.getenv("LLM_CACHE_PATH", str(CACHE_DIR / "llm_cache.sqlite3")))
+DEFAULT_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0), ('evictions', 0);
+"""
+
+
+# --------------------------
+# キーの正規化
+# --------------------------
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", str(text)).split())
+
+
+def normalize_names(names, keep_order: bool = False) -> list:
+    # 前後の空白・全角半角を揃え、順番に意味がなければ並べ替える
+    cleaned = [normalize_text(n) for n in names if str(n).strip()]
+    return cleaned if keep_order else sorted(cleaned)
+
+
+def round_target(value: float, step: float = 1.0) -> float:
+    return round(float(value) / step) * step
+
+
+def make_key(model: str, **parts) -> str:
+    payload = json.dumps({"model": model, **parts}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def messages_key_part(messages: list) -> list:
+    return [[m["role"], normalize_text(m["content"])] for m in messages]
+
+
+# --------------------------
+# SQLite キャッシュ本体
+# --------------------------
+class LLMCache:
+    """複数プロセスから共有できるLLM応答キャッシュ（TTL＋件数上限のLRU）。"""
+
+    def __init__(self, path: Path = CACHE_PATH, ttl: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Streamlitはセッションごとにスレッドが違うので、接続はスレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, conn, name: str, n: int = 1):
+        conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (n, name))
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._count(conn, "misses")
+                hit = None
+            else:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self._count(conn, "hits")
+                hit = row[0]
+        instrumentation.record_cache(hit is not None)
+        return hit
+
+    def set(self, key: str, value: str, model: str = ""):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, value, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now: float):
+        expired = conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)).rowcount
+        (count,) = conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        over = count - self.max_entries
+        if over > 0:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                (over,),
+            )
+        if expired or over > 0:
+            self._count(conn, "evictions", expired + max(over, 0))
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        (entries,) = conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "entries": entries,
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM responses")
+            conn.execute("UPDATE counters SET value = 0")
+
+
+@st.cache_resource(show_spinner=False)
+def get_cache() -> LLMCache:
+    return LLMCache()
+
+
+def cached_completion(create, model: str, messages: list, key_parts: dict | None = None, validate=None, cache: LLMCache | None = None) -> str:
+    """
+    chat.completions.create を呼ぶ前にキャッシュを引く。
+    key_parts を渡すとメッセージ全文の代わりにそれ（正規化済みの入力）でキーを作る。
+    validate を渡すと、それが真を返した応答だけを保存する。
+    """
+    cache = cache or get_cache()
+    key = make_key(model, **(key_parts if key_parts is not None else {"messages": messages_key_part(messages)}))
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    response = create(model=model, messages=messages)
+    content = response.choices[0].message.content
+    if validate is None or validate(content):
+        cache.set(key, content, model)
+    return content
+
+
+def cached_stream(create, model: str, messages: list, key_parts: dict | None = None, cache: LLMCache | None = None):
+    """
+    cached_completion のストリーミング版。届いた文字列の断片を順に返す。
+    キャッシュにあれば全文を1回で返し、なければ stream=True で受け取りながら最後に保存する。
+    """
+    cache = cache or get_cache()
+    key = make_key(model, **(key_parts if key_parts is not None else {"messages": messages_key_part(messages)}))
+    hit = cache.get(key)
+    if hit is not None:
+        yield hit
+        return
+    parts = []
+    for chunk in create(model=model, messages=messages, stream=True):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+    cache.set(key, "".join(parts), model)
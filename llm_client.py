@@ -0,0 +1,69 @@
+# llm_client.py
+import os
+from functools import lru_cache, partial
+
+import httpx
+import streamlit as st
+
+import instrumentation
+import llm_dispatch
+
+# タイムアウト・リトライ・コネクションプールの設定
+# （再試行は llm_dispatch がバックオフ付きで行うので、SDK側では既定で再試行しない）
+TIMEOUT = httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "60")), connect=5.0)
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120)
+
+
+@lru_cache(maxsize=1)
+def load_env() -> bool:
+    # .env はプロセスで1回だけ読む
+    from dotenv import load_dotenv
+
+    return load_dotenv()
+
+
+def get_api_key() -> str | None:
+    load_env()
+    return os.getenv("OPENAI_API_KEY")
+
+
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """プロセスで共有する OpenAI クライアント（keep-alive の接続を使い回す）。"""
+    import openai
+
+    return openai.OpenAI(
+        api_key=get_api_key(),
+        timeout=TIMEOUT,
+        max_retries=MAX_RETRIES,
+        http_client=httpx.Client(limits=POOL_LIMITS, timeout=TIMEOUT),
+    )
+
+
+def get_async_client():
+    """
+    非同期クライアント。イベントループごとに作り直す必要があるので共有はしない
+    （async with で使い、終わったら閉じる）。
+    """
+    import openai
+
+    return openai.AsyncOpenAI(
+        api_key=get_api_key(),
+        timeout=TIMEOUT,
+        max_retries=MAX_RETRIES,
+        http_client=httpx.AsyncClient(limits=POOL_LIMITS, timeout=TIMEOUT),
+    )
+
+
+def chat_create(task: str = "chat", **kwargs):
+    """
+    各ページから chat.completions.create の代わりに渡す。
+    llm_dispatch を通して優先度・同時実行数・再試行を揃え、レイテンシ・トークン数を記録する。
+    """
+    dispatcher = llm_dispatch.get_dispatcher()
+    create = partial(instrumentation.timed_completion, get_client().chat.completions.create, task=task)
+    if kwargs.get("stream"):
+        kwargs.setdefault("stream_options", {"include_usage": True})
+        return dispatcher.stream(create, task=task, **kwargs)
+    return dispatcher.complete(create, task=task, **kwargs)
@@ -0,0 +1,323 @@
+# llm_dispatch.py
+"""
+プロセス全体で共有するLLM呼び出しの窓口。
+
+- 同じ内容のリクエストが同時に来たら1回だけ投げて結果を分け合う（single-flight）
+- 同時実行数を超えた分は優先度順に待たせる（チャット → ページ内の計算 → バッチ）
+- 同時実行数は 429 や応答の遅さを見て増減させる（AIMD）
+- 失敗は tenacity でジッター付きの指数バックオフで再試行する
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+
+import streamlit as st
+from tenacity import (
+    AsyncRetrying,
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+import instrumentation
+
+# 同時実行数（初期値・下限・上限）
+INITIAL_CONCURRENCY = float(os.getenv("LLM_CONCURRENCY", "4"))
+MIN_CONCURRENCY = 1.0
+MAX_CONCURRENCY = float(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# これより遅い応答が返ってきたら同時実行数を少し下げる
+LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "20"))
+# 再試行（1回目を含む試行回数とバックオフ）
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+BACKOFF_MULTIPLIER = 0.5
+BACKOFF_MAX = 20.0
+# 待ち時間がこの秒数のびるごとに優先度を1段上げる（バッチが待たされ続けないように）
+AGING_SECONDS = 30.0
+
+# task ごとの優先度（小さいほど先）
+PRIORITIES = {
+    "chat": 0,
+    "summary": 1,
+    "pfc": 1,
+    "dish": 1,
+    "batch": 3,
+}
+DEFAULT_PRIORITY = 2
+
+
+def priority_for(task: str) -> int:
+    return PRIORITIES.get(task, DEFAULT_PRIORITY)
+
+
+def request_key(kwargs: dict) -> str:
+    payload = json.dumps(kwargs, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --------------------------
+# エラーの分類
+# --------------------------
+def _status(exc: BaseException) -> int | None:
+    return getattr(exc, "status_code", None)
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    return _status(exc) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+def is_retryable(exc: BaseException) -> bool:
+    # 429・5xx・タイムアウト・接続エラーだけ再試行する（400 などはそのまま返す）
+    status = _status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(exc).__name__ in ("APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError")
+
+
+def retry_after(exc: BaseException) -> float | None:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+_jitter = wait_random_exponential(multiplier=BACKOFF_MULTIPLIER, max=BACKOFF_MAX)
+
+
+def _wait(retry_state) -> float:
+    # Retry-After があればそれ以上待つ
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    hinted = retry_after(exc) if exc is not None else None
+    return max(_jitter(retry_state), hinted or 0.0)
+
+
+# --------------------------
+# 同時実行数の調整と優先度付きの待ち行列
+# --------------------------
+class _Ticket:
+    __slots__ = ("priority", "seq", "enqueued")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.monotonic()
+
+    def rank(self, now: float) -> tuple:
+        return (self.priority - (now - self.enqueued) / AGING_SECONDS, self.seq)
+
+
+class _Flight:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Dispatcher:
+    def __init__(self, initial: float = INITIAL_CONCURRENCY, minimum: float = MIN_CONCURRENCY,
+                 maximum: float = MAX_CONCURRENCY, latency_target: float = LATENCY_TARGET,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.max_attempts = max_attempts
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    # --------------------------
+    # 枠の確保と返却
+    # --------------------------
+    def acquire(self, priority: int) -> float:
+        """実行枠が空くまで待つ。待った秒数を返す。"""
+        ticket = _Ticket(priority, next(self._seq))
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    head = min(self._queue, key=lambda t: t.rank(now))
+                    if head is ticket and self.in_flight < max(int(self.limit), 1) and now >= self.paused_until:
+                        break
+                    self._cond.wait(self.paused_until - now if now < self.paused_until else None)
+            finally:
+                self._queue.remove(ticket)
+            self.in_flight += 1
+            # 次の先頭も入れるかもしれないので起こす
+            self._cond.notify_all()
+        return time.monotonic() - ticket.enqueued
+
+    def release(self, latency: float | None = None, throttled: bool = False, pause: float | None = None):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                # 429: 半分に減らし、指定があればしばらく新しい呼び出しを止める
+                self.limit = max(self.minimum, self.limit / 2)
+                if pause:
+                    self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            elif latency is not None:
+                if latency > self.latency_target:
+                    self.limit = max(self.minimum, self.limit * 0.9)
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _release_acquired(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.release()
+
+    def _attempt(self, create, task: str, kwargs: dict):
+        wait = self.acquire(priority_for(task))
+        instrumentation.record_dispatch("queue_wait", task, wait=wait)
+        start = time.monotonic()
+        try:
+            result = create(**kwargs)
+        except Exception as e:
+            throttled = is_rate_limited(e)
+            if throttled:
+                instrumentation.record_dispatch("throttled", task, limit=self.limit)
+            self.release(throttled=throttled, pause=retry_after(e))
+            raise
+        self.release(latency=time.monotonic() - start)
+        return result
+
+    async def _attempt_async(self, create, task: str, kwargs: dict):
+        # 待ち行列はスレッド間で共有しているので、待つのは別スレッドで行う
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.acquire, priority_for(task)))
+        try:
+            wait = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # 別スレッドの acquire は止められないので、枠が取れたらすぐ返す
+            acquiring.add_done_callback(self._release_acquired)
+            raise
+        instrumentation.record_dispatch("queue_wait", task, wait=wait)
+        start = time.monotonic()
+        try:
+            result = await create(**kwargs)
+        except BaseException as e:
+            throttled = is_rate_limited(e)
+            if throttled:
+                instrumentation.record_dispatch("throttled", task, limit=self.limit)
+            self.release(throttled=throttled, pause=retry_after(e))
+            raise
+        self.release(latency=time.monotonic() - start)
+        return result
+
+    # --------------------------
+    # 再試行
+    # --------------------------
+    def _retry_kwargs(self, task: str) -> dict:
+        return {
+            "retry": retry_if_exception(is_retryable),
+            "wait": _wait,
+            "stop": stop_after_attempt(self.max_attempts),
+            "before_sleep": lambda state: instrumentation.record_dispatch("retry", task),
+            "reraise": True,
+        }
+
+    # --------------------------
+    # 同じリクエストをまとめる
+    # --------------------------
+    def _join(self, key: str):
+        # (リーダーかどうか, flight) を返す
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return False, flight
+            flight = self._flights[key] = _Flight()
+            return True, flight
+
+    def _land(self, key: str, flight: _Flight, result=None, error=None):
+        flight.result = result
+        flight.error = error
+        with self._flights_lock:
+            self._flights.pop(key, None)
+        flight.event.set()
+
+    def _follow(self, flight: _Flight, task: str):
+        instrumentation.record_dispatch("coalesced", task)
+        flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    # --------------------------
+    # 公開API
+    # --------------------------
+    def complete(self, create, task: str = "chat", key: str | None = None, **kwargs):
+        """create(**kwargs) を実行枠・再試行・single-flight 付きで呼ぶ。"""
+        key = key or request_key(kwargs)
+        leader, flight = self._join(key)
+        if not leader:
+            return self._follow(flight, task)
+        try:
+            result = Retrying(**self._retry_kwargs(task))(self._attempt, create, task, kwargs)
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result=result)
+        return result
+
+    async def acomplete(self, create, task: str = "chat", key: str | None = None, **kwargs):
+        """complete の async 版（create はコルーチン関数）。"""
+        key = key or request_key(kwargs)
+        leader, flight = self._join(key)
+        if not leader:
+            return await asyncio.to_thread(self._follow, flight, task)
+        try:
+            async for attempt in AsyncRetrying(**self._retry_kwargs(task)):
+                with attempt:
+                    result = await self._attempt_async(create, task, kwargs)
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result=result)
+        return result
+
+    def stream(self, create, task: str = "chat", **kwargs):
+        """
+        stream=True の呼び出し。受信し終わるまで実行枠を持つ。
+        再試行するのは接続を開くまで（途中まで返した内容はやり直せないため）。
+        """
+        priority = priority_for(task)
+        for attempt in Retrying(**self._retry_kwargs(task)):
+            with attempt:
+                wait = self.acquire(priority)
+                instrumentation.record_dispatch("queue_wait", task, wait=wait)
+                start = time.monotonic()
+                try:
+                    chunks = create(**kwargs)
+                except Exception as e:
+                    throttled = is_rate_limited(e)
+                    if throttled:
+                        instrumentation.record_dispatch("throttled", task, limit=self.limit)
+                    self.release(throttled=throttled, pause=retry_after(e))
+                    raise
+        latency = time.monotonic() - start
+        try:
+            yield from chunks
+        finally:
+            self.release(latency=latency)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"limit": self.limit, "in_flight": self.in_flight, "queued": len(self._queue)}
+
+
+@st.cache_resource(show_spinner=False)
+def get_dispatcher() -> Dispatcher:
+    return Dispatcher()
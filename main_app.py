@@ -1,5 +1,12 @@
+import importlib
+import os
+
 import streamlit as st
 
+import instrumentation
+import session_memory
+import warmup
+
 # --------------------------
 # ページ設定
 # --------------------------
@@ -30,27 +37,43 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --------------------------
-# サブアプリのインポート
+# 起動直後の準備（プロセスで1回。終わるまでは待つ）
 # --------------------------
-from tdee_app import main as tdee_main
-from PFC_app import main as pfc_main
-from AI_question_app import main as ai_question_main
-from calorie_app import main as calorie_main
+warmup.wait_until_ready()
+
+# --------------------------
+# サブアプリ一覧（選ばれたときに初めてインポートする）
+# --------------------------
+PAGES = {
+    "TDEE計算アプリ": "tdee_app",
+    "グラム計算アプリ": "PFC_app",
+    "カロリー予測アプリ": "calorie_app",
+    "AI質問アプリ": "AI_question_app",
+    "食品検索アプリ": "food_query_app",
+}
 
 # --------------------------
 # ボタンでアプリ切替
 # --------------------------
 app_choice = st.radio(
     "使用するアプリを選んでください",
-    ("TDEE計算アプリ", "グラム計算アプリ", "カロリー予測アプリ", "AI質問アプリ"),
+    tuple(PAGES),
     horizontal=True
 )
 
-if app_choice == "TDEE計算アプリ":
-    tdee_main()
-elif app_choice == "グラム計算アプリ":
-    pfc_main()
-elif app_choice == "カロリー予測アプリ":
-    calorie_main()
-elif app_choice == "AI質問アプリ":
-    ai_question_main()
+# セッション状態の大きさを数え、古い会話・大きな結果を片づける（退避されていれば戻す）
+session_memory.track(app_choice)
+
+try:
+    with instrumentation.page_timer(app_choice):
+        importlib.import_module(PAGES[app_choice]).main()
+finally:
+    # 退避を頼まれていれば（操作のないセッションはそのために再実行される）、表示し終えたこのセッションの
+    # 状態をここで書き出す（次の再実行のはじめに戻す）
+    session_memory.finish()
+
+# 計測値（Prometheus テキスト形式）を確認したいときだけ表示
+if os.getenv("DIET_APP_SHOW_METRICS"):
+    with st.sidebar.expander("メトリクス"):
+        st.code(instrumentation.prometheus_text(), language="text")
+        st.json(session_memory.get_registry().stats())
@@ -0,0 +1,249 @@
+# meal_log.py
+"""
+食事記録（SQLite）。料理1件ごとの行と、日別・週別の合計（kcal/PFC）を持つ。
+日別・週別の合計はトリガーで追加・削除のたびに差分だけ更新するので、
+何年分の記録があっても「今日の合計」は主キー1件を引くだけで済む。
+"""
+import datetime as dt
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import streamlit as st
+
+from nutrient_store import DATA_DIR
+
+MEAL_LOG_PATH = Path(os.getenv("MEAL_LOG_PATH", str(DATA_DIR / "meal_log.sqlite3")))
+DEFAULT_USER = "default"
+
+# 集計する栄養素（calorie_engine の結果のキー → 列名）
+NUTRIENT_COLUMNS = {"kcal": "kcal", "P": "protein", "F": "fat", "C": "carb"}
+
+_SUM_COLUMNS = ", ".join(NUTRIENT_COLUMNS.values())
+
+
+def _rollup_triggers(table: str, key: str, expr: str) -> str:
+    # meals への追加・削除で table の (user, key) 行を差分更新するトリガー
+    add = ", ".join(f"{c} = {c} + excluded.{c}" for c in NUTRIENT_COLUMNS.values())
+    new_values = ", ".join(f"NEW.{c}" for c in NUTRIENT_COLUMNS.values())
+    sub = ", ".join(f"{c} = {c} - OLD.{c}" for c in NUTRIENT_COLUMNS.values())
+    return f"""
+CREATE TRIGGER IF NOT EXISTS meals_{table}_insert AFTER INSERT ON meals BEGIN
+    INSERT INTO {table} (user, {key}, {_SUM_COLUMNS}, items)
+    VALUES (NEW.user, {expr.format(row="NEW")}, {new_values}, 1)
+    ON CONFLICT (user, {key}) DO UPDATE SET {add}, items = items + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS meals_{table}_delete AFTER DELETE ON meals BEGIN
+    UPDATE {table} SET {sub}, items = items - 1
+    WHERE user = OLD.user AND {key} = {expr.format(row="OLD")};
+    DELETE FROM {table} WHERE user = OLD.user AND {key} = {expr.format(row="OLD")} AND items <= 0;
+END;
+"""
+
+
+# 週は月曜始まり（その日以前で直近の月曜日の日付）
+_WEEK_EXPR = "date({row}.date, '-6 days', 'weekday 1')"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS meals (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    date TEXT NOT NULL,
+    logged_at REAL NOT NULL,
+    name TEXT NOT NULL,
+    food_name TEXT,
+    grams REAL,
+    kcal REAL NOT NULL,
+    protein REAL NOT NULL,
+    fat REAL NOT NULL,
+    carb REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS meals_user_date ON meals (user, date);
+CREATE TABLE IF NOT EXISTS daily (
+    user TEXT NOT NULL,
+    date TEXT NOT NULL,
+    kcal REAL NOT NULL,
+    protein REAL NOT NULL,
+    fat REAL NOT NULL,
+    carb REAL NOT NULL,
+    items INTEGER NOT NULL,
+    PRIMARY KEY (user, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS weekly (
+    user TEXT NOT NULL,
+    week TEXT NOT NULL,
+    kcal REAL NOT NULL,
+    protein REAL NOT NULL,
+    fat REAL NOT NULL,
+    carb REAL NOT NULL,
+    items INTEGER NOT NULL,
+    PRIMARY KEY (user, week)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS targets (
+    user TEXT PRIMARY KEY,
+    tdee INTEGER,
+    cut_10 INTEGER,
+    bulk_10 INTEGER,
+    updated_at REAL NOT NULL
+);
+{_rollup_triggers("daily", "date", "{row}.date")}
+{_rollup_triggers("weekly", "week", _WEEK_EXPR)}
+"""
+
+
+def week_start(day: dt.date) -> dt.date:
+    return day - dt.timedelta(days=day.weekday())
+
+
+def _rollup_dict(row) -> dict | None:
+    if row is None:
+        return None
+    kcal, p, f, c, items = row
+    return {"kcal": kcal, "P": p, "F": f, "C": c, "items": items}
+
+
+class MealLog:
+    """ユーザー・日付ごとの食事記録。Streamlit のセッション（スレッド）をまたいで共有する。"""
+
+    def __init__(self, path: Path = MEAL_LOG_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # 接続はスレッドごとに持つ（llm_cache と同じ）
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --------------------------
+    # 書き込み
+    # --------------------------
+    def add_meals(self, user: str, day: dt.date, items: list) -> int:
+        """
+        calorie_engine の結果（name, food_name, grams, kcal, P, F, C）をまとめて記録する。
+        1トランザクションで書き、日別・週別の合計はトリガーで更新される。
+        """
+        now = time.time()
+        rows = [
+            (
+                user, day.isoformat(), now, it["name"], it.get("food_name"), it.get("grams"),
+                *(float(it.get(k) or 0.0) for k in NUTRIENT_COLUMNS),
+            )
+            for it in items
+        ]
+        with self._conn() as conn:
+            conn.executemany(
+                f"INSERT INTO meals (user, date, logged_at, name, food_name, grams, {_SUM_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def delete_meals(self, user: str, ids: list) -> int:
+        with self._conn() as conn:
+            return conn.executemany(
+                "DELETE FROM meals WHERE user = ? AND id = ?", [(user, i) for i in ids]
+            ).rowcount
+
+    def set_targets(self, user: str, tdee: int, cut_10: int, bulk_10: int):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO targets (user, tdee, cut_10, bulk_10, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (user, tdee, cut_10, bulk_10, time.time()),
+            )
+
+    def rebuild_rollups(self, user: str | None = None):
+        # 日別・週別の合計を記録から作り直す（トリガー導入前のデータや不整合の修復用）
+        where, params = ("WHERE user = ?", (user,)) if user is not None else ("", ())
+        sums = ", ".join(f"SUM({c})" for c in NUTRIENT_COLUMNS.values())
+        with self._conn() as conn:
+            conn.execute(f"DELETE FROM daily {where}", params)
+            conn.execute(f"DELETE FROM weekly {where}", params)
+            conn.execute(
+                f"INSERT INTO daily (user, date, {_SUM_COLUMNS}, items) "
+                f"SELECT user, date, {sums}, COUNT(*) FROM meals {where} GROUP BY user, date",
+                params,
+            )
+            conn.execute(
+                f"INSERT INTO weekly (user, week, {_SUM_COLUMNS}, items) "
+                f"SELECT user, {_WEEK_EXPR.format(row='meals')} AS week, {sums}, COUNT(*) "
+                f"FROM meals {where} GROUP BY user, week",
+                params,
+            )
+
+    # --------------------------
+    # 読み出し
+    # --------------------------
+    def meals_on(self, user: str, day: dt.date) -> list:
+        cur = self._conn().execute(
+            f"SELECT id, name, food_name, grams, {_SUM_COLUMNS} FROM meals "
+            "WHERE user = ? AND date = ? ORDER BY id",
+            (user, day.isoformat()),
+        )
+        return [
+            {"id": i, "name": n, "food_name": fn, "grams": g, "kcal": k, "P": p, "F": f, "C": c}
+            for i, n, fn, g, k, p, f, c in cur
+        ]
+
+    def day_total(self, user: str, day: dt.date) -> dict | None:
+        return _rollup_dict(self._conn().execute(
+            f"SELECT {_SUM_COLUMNS}, items FROM daily WHERE user = ? AND date = ?", (user, day.isoformat())
+        ).fetchone())
+
+    def week_total(self, user: str, day: dt.date) -> dict | None:
+        return _rollup_dict(self._conn().execute(
+            f"SELECT {_SUM_COLUMNS}, items FROM weekly WHERE user = ? AND week = ?",
+            (user, week_start(day).isoformat()),
+        ).fetchone())
+
+    def daily_range(self, user: str, start: dt.date, end: dt.date) -> list:
+        # start〜end（両端含む）の記録がある日の合計
+        cur = self._conn().execute(
+            f"SELECT date, {_SUM_COLUMNS}, items FROM daily WHERE user = ? AND date BETWEEN ? AND ? ORDER BY date",
+            (user, start.isoformat(), end.isoformat()),
+        )
+        return [{"date": d, **_rollup_dict(rest)} for d, *rest in cur]
+
+    def weekly_range(self, user: str, start: dt.date, end: dt.date) -> list:
+        cur = self._conn().execute(
+            f"SELECT week, {_SUM_COLUMNS}, items FROM weekly WHERE user = ? AND week BETWEEN ? AND ? ORDER BY week",
+            (user, week_start(start).isoformat(), week_start(end).isoformat()),
+        )
+        return [{"week": w, **_rollup_dict(rest)} for w, *rest in cur]
+
+    def get_targets(self, user: str) -> dict | None:
+        row = self._conn().execute(
+            "SELECT tdee, cut_10, bulk_10 FROM targets WHERE user = ?", (user,)
+        ).fetchone()
+        return None if row is None else {"tdee": row[0], "cut_10": row[1], "bulk_10": row[2]}
+
+    def today_vs_target(self, user: str, day: dt.date, targets: dict | None = None) -> dict:
+        """
+        その日と週の合計、目標（維持・減量・増量）との差をまとめて返す。
+        targets を省略すると保存済みの目標を使う。
+        """
+        targets = targets or self.get_targets(user) or {}
+        today = self.day_total(user, day) or {"kcal": 0.0, "P": 0.0, "F": 0.0, "C": 0.0, "items": 0}
+        week = self.week_total(user, day) or {"kcal": 0.0, "P": 0.0, "F": 0.0, "C": 0.0, "items": 0}
+        days_in_week = (day - week_start(day)).days + 1
+        return {
+            "today": today,
+            "week": week,
+            "week_avg_kcal": week["kcal"] / days_in_week,
+            "targets": targets,
+            "remaining": {k: v - today["kcal"] for k, v in targets.items() if v is not None},
+        }
+
+
+@st.cache_resource(show_spinner=False)
+def get_log() -> MealLog:
+    return MealLog()
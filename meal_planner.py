@@ -0,0 +1,269 @@
+# meal_planner.py
+"""
+顧客ごとの1週間分（朝・昼・夕）の献立を作る。
+tdee_batch の出力（tdee, cut_10, bulk_10）を目標に、食事ごとに主食/主菜/副菜を1品ずつ選び、
+グラム数は pfc_solver.solve_batch でまとめて解く。
+
+    python meal_planner.py targets.csv -o plans.csv
+    python meal_planner.py targets.csv -o plans.parquet --days 7 --workers 8
+
+入力列: tdee（または cut_10 / bulk_10）, [client_id], [goal], [p_ratio, f_ratio, c_ratio]
+  - goal: 維持/減量/増量（tdee/cut_10/bulk_10 も可）。省略時は維持
+  - error 列に値がある行（TDEEを計算できなかった顧客）は飛ばす
+出力列: client_id, day, meal, slot, food_id, food_name, grams, kcal, P, F, C
+
+顧客はチャンクに分けて ProcessPoolExecutor で並列に処理する。
+食品成分表は各ワーカーが .npy を mmap で開くだけなので、プロセスごとにコピーは持たない。
+"""
+import argparse
+import os
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import pfc_solver
+from nutrient_store import CACHE_DIR, FOOD_JSON_PATH, load_store
+
+# --------------------------
+# 献立の材料と制約
+# --------------------------
+# 枠ごとの候補（foodId）
+SLOT_FOODS = {
+    "主食": (1088, 1085, 1026, 1039, 1128, 1064, 1004),
+    "主菜": (11220, 11221, 11227, 11124, 11076, 10136, 10156, 10263, 12004, 4032, 4046),
+    "副菜": (6264, 6061, 6312, 6182, 6267, 6086, 6153, 8001, 2017, 13025, 7107, 7148),
+}
+SLOTS = tuple(SLOT_FOODS)
+
+# 1日のカロリーの配分
+MEAL_SHARES = {"朝食": 0.3, "昼食": 0.35, "夕食": 0.35}
+
+# 目標の列
+GOAL_COLUMNS = {"維持": "tdee", "減量": "cut_10", "増量": "bulk_10"}
+
+DEFAULT_DAYS = 7
+DEFAULT_PFC = (30.0, 20.0, 50.0)
+# 枠ごとの1食あたりのグラム数の下限・上限
+SLOT_GRAM_BOUNDS = {"主食": (50.0, 400.0), "主菜": (30.0, 300.0), "副菜": (30.0, 200.0)}
+# 同じ食品を1週間（days 日）で使ってよい回数 = 均等に割った回数 + この余裕
+REPEAT_SLACK = 1
+# 同じ日に2回使わない枠（主食は毎食ご飯でもよい）
+NO_REPEAT_IN_DAY = ("主菜", "副菜")
+
+DEFAULT_CHUNK_CLIENTS = 256
+
+
+# --------------------------
+# 食品の選択
+# --------------------------
+def repeat_caps(days: int) -> dict:
+    meals = days * len(MEAL_SHARES)
+    return {slot: -(-meals // len(ids)) + REPEAT_SLACK for slot, ids in SLOT_FOODS.items()}
+
+
+def choose_foods(rng: np.random.Generator, days: int, caps: dict | None = None) -> np.ndarray:
+    """
+    (日数×食事数, 枠数) の候補番号を返す。
+    - 同じ食品は週に caps 回まで
+    - 主菜・副菜は同じ日に同じものを使わない
+    - 直前の食事と同じ主菜は避ける
+    """
+    caps = caps or repeat_caps(days)
+    n_meals = len(MEAL_SHARES)
+    out = np.empty((days * n_meals, len(SLOTS)), dtype=np.int64)
+    for s, slot in enumerate(SLOTS):
+        n = len(SLOT_FOODS[slot])
+        counts = np.zeros(n, dtype=np.int64)
+        prev = -1
+        for day in range(days):
+            today = np.zeros(n, dtype=bool)
+            for m in range(n_meals):
+                allowed = counts < caps[slot]
+                if slot in NO_REPEAT_IN_DAY:
+                    allowed &= ~today
+                if prev >= 0 and slot == "主菜":
+                    allowed[prev] = False
+                candidates = np.flatnonzero(allowed)
+                if not len(candidates):
+                    # 制約を満たせない場合は使用回数の少ないものから選ぶ
+                    candidates = np.flatnonzero(counts == counts.min())
+                pick = int(rng.choice(candidates))
+                counts[pick] += 1
+                today[pick] = True
+                prev = pick
+                out[day * n_meals + m, s] = pick
+    return out
+
+
+# --------------------------
+# 顧客チャンクの処理（ワーカー側）
+# --------------------------
+_STORE = None
+_SLOT_ROWS = None
+
+
+def _init_worker(json_path: str = str(FOOD_JSON_PATH), cache_dir: str = str(CACHE_DIR)):
+    # 各ワーカーで1回だけ成分表を開く（mmap なので実体はOSのページキャッシュを共有する）
+    global _STORE, _SLOT_ROWS
+    _STORE = load_store(Path(json_path), Path(cache_dir))
+    _SLOT_ROWS = [_STORE.rows_for_ids(SLOT_FOODS[slot]) for slot in SLOTS]
+
+
+def plan_clients(clients: list, days: int = DEFAULT_DAYS, seed: int = 0) -> pd.DataFrame:
+    """
+    clients: [(client_id, 1日のkcal, P%, F%, C%), ...]
+    顧客ごとの乱数は (seed, client_id) から作るので、チャンクの分け方によらず同じ献立になる。
+    """
+    if _STORE is None:
+        _init_worker()
+    store = _STORE
+    caps = repeat_caps(days)
+    meal_names = list(MEAL_SHARES)
+    shares = np.array(list(MEAL_SHARES.values()))
+    n_meals = days * len(meal_names)
+
+    picks = []
+    for client_id, *_ in clients:
+        rng = np.random.default_rng([seed, zlib.crc32(str(client_id).encode("utf-8"))])
+        picks.append(choose_foods(rng, days, caps))
+    picks = np.stack(picks) if picks else np.empty((0, n_meals, len(SLOTS)), dtype=np.int64)
+    rows = np.stack([_SLOT_ROWS[s][picks[:, :, s]] for s in range(len(SLOTS))], axis=2)
+
+    targets = np.array([c[1:] for c in clients], dtype=np.float64).reshape(-1, 4)
+    meal_kcal = (targets[:, None, 0] * np.tile(shares, days)[None, :]).ravel()
+    pfc = np.repeat(targets[:, 1:], n_meals, axis=0)
+    flat_rows = rows.reshape(-1, len(SLOTS))
+    lo, hi = (np.tile([SLOT_GRAM_BOUNDS[slot][k] for slot in SLOTS], (len(flat_rows), 1)) for k in (0, 1))
+    grams = np.stack(pfc_solver.solve_batch(
+        list(flat_rows), meal_kcal, True, pfc[:, 0], pfc[:, 1], pfc[:, 2],
+        min_gram=lo, max_gram=hi, store=store,
+    )) if len(flat_rows) else np.empty((0, len(SLOTS)))
+
+    amounts = store.amounts(flat_rows.ravel(), grams.ravel())
+    n = len(clients)
+    meal_index = np.tile(np.repeat(np.arange(n_meals), len(SLOTS)), n)
+    return pd.DataFrame({
+        "client_id": np.repeat([c[0] for c in clients], n_meals * len(SLOTS)),
+        "day": meal_index // len(meal_names) + 1,
+        "meal": np.array(meal_names)[meal_index % len(meal_names)],
+        "slot": np.tile(np.array(SLOTS), n * n_meals),
+        "food_id": store.food_id[flat_rows.ravel()],
+        "food_name": store.food_name[flat_rows.ravel()],
+        "grams": np.round(grams.ravel(), 1),
+        "kcal": np.round(amounts[:, 0], 1),
+        "P": np.round(amounts[:, 1], 1),
+        "F": np.round(amounts[:, 2], 1),
+        "C": np.round(amounts[:, 3], 1),
+    })
+
+
+# --------------------------
+# 入力の整形と並列実行
+# --------------------------
+def client_targets(df: pd.DataFrame) -> list:
+    """tdee_batch の出力から [(client_id, kcal, P%, F%, C%), ...] を作る。"""
+    if "error" in df.columns:
+        df = df[df["error"].fillna("").astype(str) == ""]
+    ids = df["client_id"] if "client_id" in df.columns else pd.Series(df.index, index=df.index)
+    goal = df["goal"].astype(str) if "goal" in df.columns else pd.Series("維持", index=df.index)
+    columns = goal.map(lambda g: GOAL_COLUMNS.get(g, g if g in GOAL_COLUMNS.values() else "tdee"))
+    kcal = np.full(len(df), np.nan)
+    for column in columns.unique():
+        mask = (columns == column).to_numpy()
+        kcal[mask] = pd.to_numeric(df.loc[mask, column], errors="coerce")
+    ratios = [
+        pd.to_numeric(df[c], errors="coerce").fillna(d).to_numpy() if c in df.columns else np.full(len(df), d)
+        for c, d in zip(("p_ratio", "f_ratio", "c_ratio"), DEFAULT_PFC)
+    ]
+    ok = np.isfinite(kcal) & (kcal > 0)
+    return [
+        (cid, float(k), float(p), float(f), float(c))
+        for cid, k, p, f, c, good in zip(ids.tolist(), kcal, *ratios, ok)
+        if good
+    ]
+
+
+def iter_plans(clients: list, days: int = DEFAULT_DAYS, seed: int = 0, workers: int | None = None,
+               chunk_clients: int = DEFAULT_CHUNK_CLIENTS):
+    # 顧客チャンクごとの DataFrame を入力順に返す（先読みはワーカー数の2倍まで）
+    workers = workers or os.cpu_count() or 1
+    chunks = [clients[i:i + chunk_clients] for i in range(0, len(clients), chunk_clients)]
+    if workers <= 1:
+        for chunk in chunks:
+            yield plan_clients(chunk, days, seed)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(plan_clients, chunk, days, seed))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_plans(clients: list, dst: Path, **kwargs) -> dict:
+    dst = Path(dst)
+    writer = None
+    t0 = time.perf_counter()
+    rows = 0
+    try:
+        for i, plans in enumerate(iter_plans(clients, **kwargs)):
+            if dst.suffix.lower() == ".parquet":
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(plans, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(dst, table.schema)
+                writer.write_table(table)
+            else:
+                plans.to_csv(dst, mode="w" if i == 0 else "a", header=i == 0, index=False)
+            rows += len(plans)
+    finally:
+        if writer is not None:
+            writer.close()
+    elapsed = time.perf_counter() - t0
+    days = kwargs.get("days", DEFAULT_DAYS)
+    return {
+        "clients": len(clients),
+        "meals": len(clients) * days * len(MEAL_SHARES),
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "plans_per_sec": round(len(clients) / max(elapsed, 1e-9), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TDEEの目標から顧客ごとの献立（主食/主菜/副菜とグラム数）を作る")
+    parser.add_argument("input", type=Path, help="tdee_batch の出力 CSV / Parquet")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="出力 CSV / Parquet")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（既定はCPU数）")
+    parser.add_argument("--chunk-clients", type=int, default=DEFAULT_CHUNK_CLIENTS, help="1タスクで処理する顧客数")
+    args = parser.parse_args(argv)
+
+    if args.input.suffix.lower() == ".parquet":
+        df = pd.read_parquet(args.input)
+    else:
+        df = pd.read_csv(args.input, encoding="utf-8-sig")
+    clients = client_targets(df)
+    stats = write_plans(
+        clients, args.output, days=args.days, seed=args.seed, workers=args.workers, chunk_clients=args.chunk_clients,
+    )
+    print(
+        f"{stats['clients']} 人分（{stats['meals']} 食）を {stats['seconds']:.2f} 秒で作成しました"
+        f"（{stats['plans_per_sec']:,.1f} 人/秒）",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# nutrient_store.py
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import streamlit as st
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+FOOD_JSON_PATH = DATA_DIR / "japanese_food_std_2020.json"
+CACHE_DIR = DATA_DIR / "cache"
+
+# キャッシュ形式を変えたら上げる
+CACHE_VERSION = 1
+
+# 数値以外のキー列
+KEY_COLUMNS = ("groupId", "foodId", "indexId", "foodName")
+
+# よく使う栄養素列（100gあたり）
+KCAL = "enercKcal"
+PROTEIN = "prot"
+FAT = "fat"
+CARB = "chocdf"
+PFC_COLUMNS = (KCAL, PROTEIN, FAT, CARB)
+
+# groupId → 食品群名
+GROUP_NAMES = {
+    1: "穀類",
+    2: "いも及びでん粉類",
+    3: "砂糖及び甘味類",
+    4: "豆類",
+    5: "種実類",
+    6: "野菜類",
+    7: "果実類",
+    8: "きのこ類",
+    9: "藻類",
+    10: "魚介類",
+    11: "肉類",
+    12: "卵類",
+    13: "乳類",
+    14: "油脂類",
+    15: "菓子類",
+    16: "し好飲料類",
+    17: "調味料及び香辛料類",
+    18: "調理済み流通食品類",
+}
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _to_float(value) -> float:
+    # 元データには "(0)" "20.3†" "''64" "*" などの表記揺れがあるので数値部分だけ拾う
+    if value is None:
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _NUMBER_RE.search(str(value))
+    return float(m.group()) if m else np.nan
+
+
+class NutrientStore:
+    """食品成分表の列指向ビュー。値は100gあたり、欠損はNaN。"""
+
+    def __init__(self, food_id, group_id, index_id, food_name, values, columns):
+        self.food_id = food_id
+        self.group_id = group_id
+        self.index_id = index_id
+        self.food_name = food_name
+        # values は (列数, 食品数)。1列が連続したメモリになる
+        self.values = values
+        self.columns = tuple(columns)
+        self._col_index = {c: i for i, c in enumerate(self.columns)}
+        self._id_order = np.argsort(food_id, kind="stable")
+        self._sorted_ids = food_id[self._id_order]
+
+    def __len__(self) -> int:
+        return int(self.food_id.shape[0])
+
+    def column_index(self, name: str) -> int:
+        try:
+            return self._col_index[name]
+        except KeyError:
+            raise KeyError(f"未知の栄養素列です: {name}") from None
+
+    def column(self, name: str, fill: float | None = None) -> np.ndarray:
+        col = self.values[self.column_index(name)]
+        if fill is None:
+            return col
+        return np.where(np.isnan(col), fill, col)
+
+    def matrix(self, columns=PFC_COLUMNS, rows=None, fill: float | None = 0.0) -> np.ndarray:
+        # (行数, 列数) の float64 行列を返す
+        idx = [self.column_index(c) for c in columns]
+        sub = self.values[idx] if rows is None else self.values[idx][:, np.asarray(rows)]
+        out = np.asarray(sub, dtype=np.float64).T
+        if fill is not None:
+            out = np.where(np.isnan(out), fill, out)
+        return out
+
+    def rows_for_ids(self, food_ids) -> np.ndarray:
+        ids = np.atleast_1d(np.asarray(food_ids, dtype=self._sorted_ids.dtype))
+        pos = np.searchsorted(self._sorted_ids, ids)
+        pos = np.clip(pos, 0, len(self._sorted_ids) - 1)
+        missing = self._sorted_ids[pos] != ids
+        if missing.any():
+            raise KeyError(f"foodId が見つかりません: {ids[missing].tolist()}")
+        return self._id_order[pos]
+
+    def group_mask(self, group_id: int) -> np.ndarray:
+        return self.group_id == group_id
+
+    def amounts(self, rows, grams, columns=PFC_COLUMNS) -> np.ndarray:
+        # グラム数から実量を計算（欠損は0扱い）
+        grams = np.asarray(grams, dtype=np.float64)
+        return self.matrix(columns, rows) * grams[:, None] / 100.0
+
+
+# --------------------------
+# キャッシュ生成・読み込み
+# --------------------------
+def _source_signature(json_path: Path) -> dict:
+    stat = json_path.stat()
+    return {"version": CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _save_npy(path: Path, array: np.ndarray):
+    # 複数ワーカーが同時に生成しても壊れないよう一時ファイル経由で置き換える
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def build_cache(json_path: Path = FOOD_JSON_PATH, cache_dir: Path = CACHE_DIR) -> Path:
+    json_path, cache_dir = Path(json_path), Path(cache_dir)
+    with open(json_path, encoding="utf-8") as f:
+        records = json.load(f)
+
+    columns = [k for k in records[0] if k not in KEY_COLUMNS]
+    values = np.array(
+        [[_to_float(r.get(c)) for r in records] for c in columns],
+        dtype=np.float64,
+    )
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    _save_npy(cache_dir / "food_id.npy", np.array([r["foodId"] for r in records], dtype=np.int32))
+    _save_npy(cache_dir / "group_id.npy", np.array([r["groupId"] for r in records], dtype=np.int16))
+    _save_npy(cache_dir / "index_id.npy", np.array([r["indexId"] for r in records], dtype=np.int32))
+    _save_npy(cache_dir / "food_name.npy", np.array([r["foodName"] for r in records], dtype=np.str_))
+    _save_npy(cache_dir / "values.npy", values)
+
+    meta = {**_source_signature(json_path), "columns": columns}
+    tmp = cache_dir / f"meta.json.{os.getpid()}.tmp"
+    tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, cache_dir / "meta.json")
+    return cache_dir
+
+
+def _read_meta(json_path: Path, cache_dir: Path) -> dict | None:
+    try:
+        meta = json.loads((cache_dir / "meta.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    sig = _source_signature(json_path)
+    if any(meta.get(k) != v for k, v in sig.items()):
+        return None
+    return meta
+
+
+def load_store(json_path: Path = FOOD_JSON_PATH, cache_dir: Path = CACHE_DIR) -> NutrientStore:
+    json_path, cache_dir = Path(json_path), Path(cache_dir)
+    meta = _read_meta(json_path, cache_dir)
+    if meta is None:
+        build_cache(json_path, cache_dir)
+        meta = _read_meta(json_path, cache_dir)
+
+    def _load(name):
+        return np.load(cache_dir / f"{name}.npy", mmap_mode="r")
+
+    return NutrientStore(
+        food_id=_load("food_id"),
+        group_id=_load("group_id"),
+        index_id=_load("index_id"),
+        food_name=_load("food_name"),
+        values=_load("values"),
+        columns=meta["columns"],
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_store() -> NutrientStore:
+    # サーバープロセスごとに1つだけ共有する
+    return load_store()
+
+
+if __name__ == "__main__":
+    import time
+
+    t0 = time.perf_counter()
+    build_cache()
+    t1 = time.perf_counter()
+    store = load_store()
+    t2 = time.perf_counter()
+    print(f"build: {(t1 - t0) * 1000:.1f} ms, load: {(t2 - t1) * 1000:.2f} ms, foods: {len(store)}, columns: {len(store.columns)}")
@@ -0,0 +1,214 @@
+# pfc_solver.py
+import numpy as np
+from scipy.optimize import lsq_linear
+
+from nutrient_store import CARB, FAT, KCAL, PROTEIN, get_store
+
+# 目標カロリーの一致を最優先し、次にPFC比率、最後に主食/主菜/副菜の配分を効かせる
+KCAL_WEIGHT = 3.0
+PFC_WEIGHT = 1.0
+PRIORITY_WEIGHT = 0.1
+
+DEFAULT_MAX_GRAM = 500.0
+
+
+def priority_labels(n: int) -> list:
+    # 入力順に 主食, 主菜, 副菜...（PFC_app の入力ルールと同じ）
+    return ["主食", "主菜"][:n] + ["副菜"] * max(n - 2, 0)
+
+
+def priority_shares(n: int) -> np.ndarray:
+    # 役割ごとのカロリー配分の目安
+    if n == 1:
+        return np.array([1.0])
+    if n == 2:
+        return np.array([0.5, 0.5])
+    return np.array([0.4, 0.35] + [0.25 / (n - 2)] * (n - 2))
+
+
+def _per_gram(store, rows) -> np.ndarray:
+    # (食品数, 4) の1gあたり kcal, P, F, C
+    return store.matrix((KCAL, PROTEIN, FAT, CARB), rows) / 100.0
+
+
+def _build_system(row_lists, total_kcal, use_pfc, p_ratio, f_ratio, c_ratio, store):
+    """
+    問題ごとの最小二乗系 A x ≈ b を (問題数, 式数, 最大食材数) の配列で作る。
+    食材数が足りない問題の余り列は0（グラム0に固定する）。
+    """
+    n_problems = len(row_lists)
+    sizes = np.array([len(r) for r in row_lists], dtype=np.int64)
+    if (sizes == 0).any():
+        raise ValueError("食材が空の問題があります。")
+    target = np.broadcast_to(np.asarray(total_kcal, dtype=np.float64), (n_problems,))
+    if (target <= 0).any():
+        raise ValueError("目標カロリーは正の数にしてください。")
+    ratios = np.stack([
+        np.broadcast_to(np.asarray(r, dtype=np.float64), (n_problems,)) / 100.0
+        for r in (p_ratio, f_ratio, c_ratio)
+    ], axis=1)
+
+    n_max = int(sizes.max())
+    mask = np.arange(n_max)[None, :] < sizes[:, None]
+    rows = np.zeros((n_problems, n_max), dtype=np.int64)
+    rows[mask] = np.concatenate([np.asarray(r, dtype=np.int64) for r in row_lists])
+    nut = _per_gram(store, rows.ravel()).reshape(n_problems, n_max, 4)
+    nut[~mask] = 0.0
+    nut /= target[:, None, None]
+
+    # kcal行 (+ P, F, C のエネルギー比率行)
+    eq = [KCAL_WEIGHT * nut[:, :, 0]]
+    rhs = [np.full(n_problems, KCAL_WEIGHT)]
+    if use_pfc:
+        for k, factor in enumerate((4.0, 9.0, 4.0)):
+            eq.append(PFC_WEIGHT * factor * nut[:, :, k + 1])
+            rhs.append(PFC_WEIGHT * ratios[:, k])
+
+    # 食材ごとの配分行（主食/主菜/副菜の優先度）
+    shares = np.zeros((n_problems, n_max))
+    for n in np.unique(sizes):
+        shares[sizes == n, :n] = priority_shares(int(n))
+    prio = PRIORITY_WEIGHT * nut[:, :, 0, None] * np.eye(n_max)[None, :, :]
+
+    A = np.concatenate([np.stack(eq, axis=1), prio.transpose(0, 2, 1)], axis=1)
+    b = np.concatenate([np.stack(rhs, axis=1), PRIORITY_WEIGHT * shares], axis=1)
+    return A, b, sizes, mask
+
+
+def _box_lsq_batch(A, b, lo, hi, max_iter: int = 30, tol: float = 1e-9):
+    """
+    小さな有界最小二乗を正規方程式＋アクティブセット法でまとめて解く。
+    KKT条件を満たさなかった問題の番号も返す。
+    """
+    H = A.transpose(0, 2, 1) @ A
+    g = np.einsum("bmn,bm->bn", A, b)
+    n = H.shape[1]
+    eye = np.eye(n)[None, :, :]
+    # 特異にならないよう僅かに正則化
+    H = H + 1e-12 * eye
+
+    x = np.clip(np.linalg.solve(H, g[..., None])[..., 0], lo, hi)
+    for _ in range(max_iter):
+        grad = np.einsum("bij,bj->bi", H, x) - g
+        scale = tol * (1.0 + np.abs(g))
+        fixed_lo = (x <= lo + 1e-9) & (grad >= -scale)
+        fixed_hi = (x >= hi - 1e-9) & (grad <= scale)
+        fixed = fixed_lo | fixed_hi
+        x_fixed = np.where(fixed_lo, lo, np.where(fixed_hi, hi, 0.0))
+
+        # 固定変数を除いた連立方程式（固定変数の行は単位行列にする）
+        Hf = np.where(fixed[:, :, None] | fixed[:, None, :], 0.0, H) + eye * fixed[:, :, None]
+        rhs = np.where(fixed, x_fixed, g - np.einsum("bij,bj->bi", H, x_fixed))
+        x_new = np.clip(np.linalg.solve(Hf, rhs[..., None])[..., 0], lo, hi)
+        if np.allclose(x_new, x, rtol=0, atol=1e-7):
+            x = x_new
+            break
+        x = x_new
+
+    grad = np.einsum("bij,bj->bi", H, x) - g
+    scale = 1e-6 * (1.0 + np.abs(g))
+    free = (x > lo + 1e-7) & (x < hi - 1e-7)
+    bad = (
+        (free & (np.abs(grad) > scale))
+        | ((x <= lo + 1e-7) & (grad < -scale))
+        | ((x >= hi - 1e-7) & (grad > scale))
+    ).any(axis=1)
+    return x, np.flatnonzero(bad)
+
+
+def solve_batch(
+    row_lists: list,
+    total_kcal,
+    use_pfc: bool = True,
+    p_ratio=30.0,
+    f_ratio=20.0,
+    c_ratio=50.0,
+    min_gram: float = 50.0,
+    max_gram: float = DEFAULT_MAX_GRAM,
+    store=None,
+) -> list:
+    """
+    複数の (食品行リスト, 目標) をまとめて解く。
+    total_kcal, p_ratio, f_ratio, c_ratio はスカラーか問題数と同じ長さの配列。
+    min_gram, max_gram はスカラーか (問題数, 最大食材数) の配列（食材ごとの上下限）。
+    戻り値は問題ごとのグラム数配列のリスト。
+    """
+    store = store or get_store()
+    if len(row_lists) == 0:
+        return []
+    A, b, sizes, mask = _build_system(row_lists, total_kcal, use_pfc, p_ratio, f_ratio, c_ratio, store)
+    lo = np.where(mask, np.asarray(min_gram, dtype=np.float64), 0.0)
+    hi = np.where(mask, np.asarray(max_gram, dtype=np.float64), 0.0)
+
+    if len(row_lists) == 1:
+        bad = np.array([0])
+        x = np.zeros(lo.shape)
+    else:
+        x, bad = _box_lsq_batch(A, b, lo, hi)
+
+    # まとめて解けなかった問題（と単発の問題）は scipy で厳密に解く
+    for i in bad:
+        n = sizes[i]
+        res = lsq_linear(A[i][:, :n], b[i], bounds=(lo[i, :n], hi[i, :n]), method="bvls")
+        x[i, :n] = res.x
+    return [x[i, :n] for i, n in enumerate(sizes)]
+
+
+def summarize(rows, grams, store=None) -> dict:
+    """グラム数から食材ごと・合計の kcal/PFC を成分表で計算する。"""
+    store = store or get_store()
+    amounts = store.amounts(np.asarray(rows), np.asarray(grams))
+    total = amounts.sum(axis=0)
+    energy = np.array([4.0, 9.0, 4.0]) * total[1:]
+    share = energy / energy.sum() * 100 if energy.sum() > 0 else np.zeros(3)
+    return {"amounts": amounts, "total": total, "pfc_share": share}
+
+
+def solve_grams(
+    rows,
+    total_kcal: float,
+    use_pfc: bool = True,
+    p_ratio: float = 30.0,
+    f_ratio: float = 20.0,
+    c_ratio: float = 50.0,
+    min_gram: float = 50.0,
+    max_gram: float = DEFAULT_MAX_GRAM,
+    store=None,
+) -> dict:
+    store = store or get_store()
+    grams = solve_batch(
+        [rows], total_kcal, use_pfc, p_ratio, f_ratio, c_ratio, min_gram, max_gram, store
+    )[0]
+    return {"grams": grams, **summarize(rows, grams, store)}
+
+
+def to_pfc_result(names: list, solution: dict) -> dict:
+    # PFC_app の結果表示と同じ形（GPTの返すJSONと同じキー）に変換する
+    grams = [round(float(g)) for g in solution["grams"]]
+    kcal, p, f, c = solution["total"]
+    share = solution["pfc_share"]
+    return {
+        "食材グラム": dict(zip(names, grams)),
+        "合計カロリー": round(float(kcal)),
+        "合計PFC": {"P": round(float(share[0])), "F": round(float(share[1])), "C": round(float(share[2]))},
+        "食材栄養": {
+            name: {"kcal": round(float(a[0]), 1), "P": round(float(a[1]), 1), "F": round(float(a[2]), 1), "C": round(float(a[3]), 1)}
+            for name, a in zip(names, solution["amounts"])
+        },
+    }
+
+
+def food_nutrients(grams: dict, rows: dict, store=None) -> dict:
+    """
+    食材名 → グラム数 と 食材名 → 成分表の行番号（見つからなければ None）から、食材ごとの kcal/PFC を計算する。
+    成分表にない食材は None（GPTの結果を表示するとき、食材ごとの値を割り振って作らないため）。
+    """
+    store = store or get_store()
+    found = [name for name in grams if rows.get(name) is not None]
+    out = {name: None for name in grams}
+    if found:
+        amounts = store.amounts([rows[n] for n in found], [grams[n] for n in found])
+        for name, a in zip(found, amounts):
+            out[name] = {"kcal": round(float(a[0]), 1), "P": round(float(a[1]), 1), "F": round(float(a[2]), 1), "C": round(float(a[3]), 1)}
+    return out
+
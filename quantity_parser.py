@@ -0,0 +1,254 @@
+# quantity_parser.py
+"""
+「150g」「1杯」「大さじ2」「1/2個」「大盛り」のような量の表記をグラムに換算する。
+単位の重さ・1人前の量・盛りの倍率は食品群（groupId）ごとの表と、
+よく食べる食品（foodId）ごとの表から引く。
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+
+# --------------------------
+# 食品群ごとの表
+# --------------------------
+# groupId → 1人前（普通）のグラム数
+GROUP_SERVING_GRAMS = {
+    1: 150,   # 穀類
+    2: 100,   # いも及びでん粉類
+    3: 5,     # 砂糖及び甘味類
+    4: 50,    # 豆類
+    5: 10,    # 種実類
+    6: 80,    # 野菜類
+    7: 100,   # 果実類
+    8: 50,    # きのこ類
+    9: 5,     # 藻類
+    10: 80,   # 魚介類
+    11: 100,  # 肉類
+    12: 50,   # 卵類
+    13: 200,  # 乳類
+    14: 10,   # 油脂類
+    15: 50,   # 菓子類
+    16: 200,  # し好飲料類
+    17: 15,   # 調味料及び香辛料類
+    18: 200,  # 調理済み流通食品類
+}
+DEFAULT_SERVING_GRAMS = 100.0
+
+# groupId → {単位: 1単位のグラム数}（表にない単位は1人前として扱う）
+GROUP_UNIT_GRAMS = {
+    1: {"杯": 150, "膳": 150, "枚": 60, "玉": 200, "個": 100, "本": 100},
+    2: {"個": 150, "本": 200},
+    4: {"パック": 45, "丁": 300, "枚": 30},
+    5: {"粒": 1},
+    6: {"個": 150, "本": 100, "枚": 50, "株": 30},
+    7: {"個": 150, "本": 100},
+    8: {"パック": 100, "本": 10, "個": 10},
+    9: {"枚": 3},
+    10: {"切れ": 80, "尾": 100, "匹": 100, "枚": 80, "缶": 70},
+    11: {"枚": 100, "切れ": 30, "本": 50, "個": 30},
+    12: {"個": 50},
+    13: {"杯": 206, "本": 206, "個": 100, "枚": 18},
+    15: {"個": 50, "枚": 10, "本": 40},
+    16: {"杯": 200, "本": 350, "缶": 350},
+    18: {"皿": 250, "人前": 250, "個": 50, "杯": 200},
+}
+
+# groupId → 1mlあたりのグラム数（表にない群は1.0）
+GROUP_DENSITY = {13: 1.03, 14: 0.92, 17: 1.1}
+
+# 盛りの倍率（穀類はご飯の 少なめ100g / 普通150g / 大盛り250g に合わせる）
+PORTION_FACTORS = {"少なめ": 0.7, "小盛り": 0.7, "普通": 1.0, "並盛り": 1.0, "大盛り": 1.5, "特盛り": 2.0}
+GROUP_PORTION_FACTORS = {
+    1: {"少なめ": 0.67, "小盛り": 0.67, "普通": 1.0, "並盛り": 1.0, "大盛り": 1.67, "特盛り": 2.0},
+}
+
+# よく食べる食品の単位の重さ（食品群の表より優先）
+FOOD_UNIT_GRAMS = {
+    1088: {"杯": 150, "膳": 150},      # めし
+    1026: {"枚": 60},                  # 食パン
+    1039: {"玉": 250},                 # うどん
+    1128: {"玉": 200},                 # そば
+    4032: {"丁": 300},                 # 木綿豆腐
+    4033: {"丁": 300},                 # 絹ごし豆腐
+    4046: {"パック": 45},              # 納豆
+    7107: {"本": 100},                 # バナナ
+    10136: {"切れ": 80},               # 焼き鮭
+    11227: {"本": 50},                 # ささみ
+    11289: {"個": 30},                 # から揚げ
+    12004: {"個": 50},                 # 卵
+    12005: {"個": 50},                 # ゆで卵
+    13003: {"杯": 206, "本": 206},     # 牛乳（200ml）
+    13025: {"個": 100},                # ヨーグルト
+    18002: {"個": 25},                 # 餃子
+}
+
+# 体積の単位 → ml
+VOLUME_ML = {"ml": 1.0, "cc": 1.0, "l": 1000.0, "大さじ": 15.0, "小さじ": 5.0, "カップ": 200.0}
+# 重さの単位 → g
+WEIGHT_G = {"g": 1.0, "kg": 1000.0, "mg": 0.001}
+
+# --------------------------
+# 表記の読み取り（パターンは読み込み時に1回だけコンパイル）
+# --------------------------
+_UNIT_ALIASES = {
+    "グラム": "g", "キロ": "kg", "キログラム": "kg", "ミリグラム": "mg",
+    "ミリリットル": "ml", "リットル": "l", "cc": "cc",
+    "切": "切れ", "杯分": "杯", "皿分": "皿", "人分": "人前",
+    "大盛": "大盛り", "特盛": "特盛り", "小盛": "小盛り", "並盛": "並盛り", "並": "並盛り",
+    "少なめ": "少なめ", "少量": "少なめ", "多め": "大盛り",
+}
+_COUNT_UNITS = ("切れ", "人前", "パック", "杯", "膳", "個", "枚", "本", "皿", "缶", "玉", "丁", "尾", "匹", "粒", "株")
+_PORTIONS = ("特盛り", "特盛", "大盛り", "大盛", "小盛り", "小盛", "並盛り", "並盛", "少なめ", "少量", "多め", "普通")
+
+_KANJI_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+_NUMBER = r"(?:\d+と\d+/\d+|\d+(?:\.\d+)?(?:/\d+)?|[一二三四五六七八九十]+|半)"
+_UNIT = (
+    r"(?:キログラム|ミリグラム|ミリリットル|リットル|グラム|キロ|kg|mg|ml|cc|g|l|"
+    + "|".join(sorted(_COUNT_UNITS + ("切", "杯分", "皿分", "人分"), key=len, reverse=True))
+    + ")"
+)
+# 「150g」「1/2杯」のように数の後に単位 / 「大さじ2」「カップ1/2」のように単位の後に数
+_AMOUNT_RE = re.compile(rf"(?P<num>{_NUMBER})(?P<unit>{_UNIT})?|(?P<pre>大さじ|小さじ|カップ)(?P<num2>{_NUMBER})?")
+_PORTION_RE = re.compile("|".join(_PORTIONS))
+_NOISE_RE = re.compile(r"\s+|約|およそ|だいたい|程度|くらい|ぐらい|前後$")
+# 「1 1/2杯」の空白は帯分数の区切りなので、空白を消す前に「1と1/2杯」にする
+_MIXED_RE = re.compile(r"(\d+)\s+(\d+/\d+)")
+# 「1,000g」の桁区切り
+_THOUSANDS_RE = re.compile(r"(?<=\d),(?=\d{3}(?!\d))")
+# 単位なしの数がこれ未満なら、グラムではなく1人前の何倍かとみなす（「2」「1.5」「二」→2人前・1.5人前・2人前）
+MAX_UNITLESS_SERVINGS = 10.0
+
+
+def _to_number(text: str) -> float:
+    if text == "半":
+        return 0.5
+    if "と" in text:
+        whole, frac = text.split("と")
+        return float(whole) + _to_number(frac)
+    if "/" in text:
+        num, den = text.split("/")
+        if not float(den):
+            raise ValueError("分母が0です")
+        return float(num) / float(den)
+    if text[0] in _KANJI_DIGITS:
+        # 十までの漢数字（「二十」などは 十の位×10＋一の位）
+        if "十" in text:
+            tens, _, ones = text.partition("十")
+            return float(_KANJI_DIGITS.get(tens, 1) * 10 + _KANJI_DIGITS.get(ones, 0))
+        return float(_KANJI_DIGITS[text])
+    return float(text)
+
+
+@lru_cache(maxsize=4096)
+def parse(text: str):
+    """
+    量の表記を (数量, 単位, 盛り) に分解する。食品に依存しない部分だけなので結果をキャッシュする。
+    単位 None は「1人前の何倍か」を表す。読み取れなければ None。
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower().replace("⁄", "/")
+    text = _THOUSANDS_RE.sub("", text)
+    text = _NOISE_RE.sub("", _MIXED_RE.sub(r"\1と\2", text))
+    if not text:
+        return None
+    portion = None
+    m = _PORTION_RE.search(text)
+    if m:
+        portion = _UNIT_ALIASES.get(m.group(), m.group())
+        text = text[:m.start()] + text[m.end():]
+    if text in ("半分", "半"):
+        return 0.5, None, portion
+    m = _AMOUNT_RE.search(text)
+    if m is None:
+        return (1.0, None, portion) if portion else None
+    try:
+        if m.group("pre"):
+            return (_to_number(m.group("num2")) if m.group("num2") else 1.0), m.group("pre"), portion
+        amount = _to_number(m.group("num"))
+    except ValueError:
+        # 「1/0」のような読めない数
+        return None
+    unit = m.group("unit")
+    if unit is None:
+        # 単位なしの小さい数・分数は1人前の何倍か（「2」「1/2」「1.5」）、大きい数はグラム（「150」）
+        if "/" in m.group("num") or amount < MAX_UNITLESS_SERVINGS:
+            return amount, None, portion
+        return amount, "g", portion
+    if text.startswith("半", m.end()):
+        # 「1杯半」
+        amount += 0.5
+    return amount, _UNIT_ALIASES.get(unit, unit), portion
+
+
+# --------------------------
+# グラムへの換算
+# --------------------------
+def serving_grams(group_id: int | None) -> float:
+    # 食品群の1人前（群が分からなければ100g）
+    if group_id is None:
+        return DEFAULT_SERVING_GRAMS
+    return float(GROUP_SERVING_GRAMS.get(int(group_id), DEFAULT_SERVING_GRAMS))
+
+
+def portion_factor(portion: str | None, group_id: int | None = None) -> float:
+    if not portion:
+        return 1.0
+    table = GROUP_PORTION_FACTORS.get(int(group_id), PORTION_FACTORS) if group_id is not None else PORTION_FACTORS
+    return table.get(portion, 1.0)
+
+
+def unit_grams(unit: str, group_id: int | None, food_id: int | None, serving: float) -> float:
+    # 1単位のグラム数（食品 → 食品群 → 1人前 の順に探す）
+    if unit in WEIGHT_G:
+        return WEIGHT_G[unit]
+    if unit in VOLUME_ML:
+        density = GROUP_DENSITY.get(int(group_id), 1.0) if group_id is not None else 1.0
+        return VOLUME_ML[unit] * density
+    if food_id is not None:
+        grams = FOOD_UNIT_GRAMS.get(int(food_id), {}).get(unit)
+        if grams is not None:
+            return float(grams)
+    if group_id is not None:
+        grams = GROUP_UNIT_GRAMS.get(int(group_id), {}).get(unit)
+        if grams is not None:
+            return float(grams)
+    return serving
+
+
+def to_grams(text: str, group_id: int | None = None, food_id: int | None = None,
+             serving: float | None = None) -> float | None:
+    """
+    量の表記をグラムにする。serving を省略すると食品群の1人前を使う。
+    例: to_grams("大盛り", group_id=1, food_id=1088, serving=150) → 250.5
+    """
+    parsed = parse(text)
+    if parsed is None:
+        return None
+    amount, unit, portion = parsed
+    if serving is None:
+        serving = serving_grams(group_id)
+    per_unit = serving if unit is None else unit_grams(unit, group_id, food_id, serving)
+    return amount * per_unit * portion_factor(portion, group_id)
+
+
+def portion_grams(portion: str | None, serving: float, group_id: int | None = None) -> float:
+    # 量が分からないときの目安量（少なめ/普通/大盛り）
+    return serving * portion_factor(portion, group_id)
+
+
+def to_grams_many(texts: list, group_ids=None, food_ids=None, servings=None) -> np.ndarray:
+    """
+    まとめて換算する（1日分の記録などをまとめて処理する用）。読み取れないものは NaN。
+    group_ids / food_ids / servings は texts と同じ長さ（省略可）。
+    """
+    n = len(texts)
+    group_ids = [None] * n if group_ids is None else group_ids
+    food_ids = [None] * n if food_ids is None else food_ids
+    servings = [None] * n if servings is None else servings
+    out = np.full(n, np.nan)
+    for i, (t, g, f, s) in enumerate(zip(texts, group_ids, food_ids, servings)):
+        grams = to_grams(t, g, f, s)
+        if grams is not None:
+            out[i] = grams
+    return out
@@ -0,0 +1,413 @@
+# session_memory.py
+"""
+セッションごとの st.session_state の大きさを数え、溜まりすぎないように小さくする。
+main_app からページを表示する前に毎回 track()、表示し終えたら finish() を呼ぶ。
+
+- AI質問の古い発言（要約に畳み済みのもの）はディスクに退避し、メモリには直近だけ残す
+- 大きすぎる計算結果は捨てる（ボタンを押せば作り直せる）
+- プロセスの RSS が予算を超えたら、しばらく操作のないセッションを再実行させ、その再実行の終わりに
+  状態をディスクに退避する。次に操作されたときの再実行のはじめに戻す
+  （session_state は持ち主のスレッド以外から書き換えない。Streamlit が再実行の前後に
+  ロックなしで中身をたどるため）
+
+    DIET_APP_MEMORY_BUDGET_MB=0           RSS の予算（0 なら退避しない）
+    DIET_APP_SESSION_IDLE_SECONDS=300     これより長く操作のないセッションを退避の対象にする
+    DIET_APP_CHAT_KEEP=100                メモリに残す会話の件数
+    DIET_APP_MAX_RESULT_KB=256            計算結果1件あたりの上限
+    DIET_APP_SESSION_SPILL_DIR=data/sessions
+    DIET_APP_SESSION_COMPACT=0            小さくする処理を止める（数えるだけ）
+"""
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+from pathlib import Path
+
+import streamlit as st
+from pydantic import BaseModel
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import instrumentation
+
+ROOT = Path(__file__).resolve().parent
+SPILL_DIR = Path(os.getenv("DIET_APP_SESSION_SPILL_DIR", str(ROOT / "data" / "sessions")))
+MEMORY_BUDGET_BYTES = int(float(os.getenv("DIET_APP_MEMORY_BUDGET_MB", "0")) * 1024 * 1024)
+IDLE_SECONDS = float(os.getenv("DIET_APP_SESSION_IDLE_SECONDS", "300"))
+CHAT_KEEP = int(os.getenv("DIET_APP_CHAT_KEEP", "100"))
+MAX_RESULT_BYTES = int(float(os.getenv("DIET_APP_MAX_RESULT_KB", "256")) * 1024)
+COMPACT = os.getenv("DIET_APP_SESSION_COMPACT", "1") != "0"
+
+# 一度に退避する発言の最小件数（毎回少しずつ書かないように）
+CHAT_SPILL_BATCH = 20
+# 予算を超えたとき、RSS がこの割合を下回る見込みになるまで退避する
+LOW_WATERMARK = 0.8
+# RSS を確認する間隔（秒）
+PRESSURE_CHECK_SECONDS = 5.0
+# 1セッションの大きさを数え直す間隔（秒）。長い会話だと数えるのに数ms かかるので毎回はしない
+MEASURE_SECONDS = 2.0
+# 退避のための再実行がこの秒数のうちに終わらなければ（タブが閉じられたなど）、頼み直す
+EVICT_RETRY_SECONDS = 30.0
+# 退避したまま戻ってこないセッションのファイルを消すまでの秒数
+SPILL_TTL_SECONDS = 24 * 3600
+
+# 大きくなりうる計算結果と、捨てたときの値
+RESULT_KEYS = {"calorie_result": "", "calorie_items": [], "calorie_meal": None, "pfc_result": None}
+# 操作のないセッションから退避するキー（ページを開いたときに作り直される値は含めない）
+EVICT_KEYS = ("messages", "chat_context", "chat_spilled", "dishes", *RESULT_KEYS)
+
+
+# --------------------------
+# 大きさの見積もり
+# --------------------------
+def deep_size(obj) -> int:
+    """dict・list などをたどった合計バイト数（同じオブジェクトは1回だけ数える）。"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        # ndarray・DataFrame は getsizeof が中身まで数える
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif isinstance(o, BaseModel):
+            stack.append(o.__dict__)
+    return total
+
+
+def state_sizes(state) -> dict:
+    return {k: deep_size(state[k]) for k in list(state.keys())}
+
+
+def rss_bytes() -> int:
+    # 現在の RSS（Linux 以外は最大 RSS で代用）
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# --------------------------
+# 1セッション分を小さくする
+# --------------------------
+def _chat_path(session_id: str, spill_dir: Path) -> Path:
+    return spill_dir / f"{session_id}.chat.jsonl"
+
+
+def _state_path(session_id: str, spill_dir: Path) -> Path:
+    return spill_dir / f"{session_id}.state.pkl"
+
+
+def spill_chat(state, session_id: str, spill_dir: Path = SPILL_DIR, keep: int = CHAT_KEEP) -> int:
+    """
+    要約に畳み済みの古い発言をディスクに書き出してリストから除く。
+    chat_context の要約済み位置もずらす。退避した件数を返す。
+    """
+    messages = state.get("messages")
+    context = state.get("chat_context")
+    if not messages or not context:
+        return 0
+    system = 1 if messages[0]["role"] == "system" else 0
+    n = min(context["summarized_upto"], len(messages) - system - keep)
+    if n < CHAT_SPILL_BATCH:
+        return 0
+    spill_dir.mkdir(parents=True, exist_ok=True)
+    with open(_chat_path(session_id, spill_dir), "a", encoding="utf-8") as f:
+        for m in messages[system:system + n]:
+            f.write(json.dumps({"role": m["role"], "content": m["content"]}, ensure_ascii=False) + "\n")
+    del messages[system:system + n]
+    context["summarized_upto"] -= n
+    state["chat_spilled"] = state.get("chat_spilled", 0) + n
+    instrumentation.record_session_compaction("chat_spill", n)
+    return n
+
+
+def load_chat(session_id: str, last: int, spill_dir: Path = SPILL_DIR) -> list:
+    """退避した発言のうち最後の last 件（表示用）。"""
+    if last <= 0:
+        return []
+    try:
+        with open(_chat_path(session_id, spill_dir), encoding="utf-8") as f:
+            return [json.loads(line) for line in deque(f, maxlen=last)]
+    except (OSError, ValueError):
+        return []
+
+
+def cap_results(state, sizes: dict, limit: int = MAX_RESULT_BYTES) -> list:
+    # 上限を超えた計算結果を初期値に戻す（戻したキーを返す）
+    dropped = []
+    for key, empty in RESULT_KEYS.items():
+        if sizes.get(key, 0) > limit:
+            state[key] = [] if isinstance(empty, list) else empty
+            sizes[key] = deep_size(state[key])
+            dropped.append(key)
+            instrumentation.record_session_compaction("result_cap")
+    return dropped
+
+
+# --------------------------
+# プロセス全体の管理
+# --------------------------
+def request_rerun(session_id: str) -> bool:
+    """
+    ほかのスレッドから、そのセッションの再実行を頼む（ブラウザからの操作と同じく、前回の入力値で動く）。
+    セッションがつながっていなければ False。
+    """
+    from streamlit.runtime import Runtime
+
+    if not Runtime.exists():
+        return False
+    try:
+        info = Runtime.instance()._session_mgr.get_active_session_info(session_id)
+        if info is None:
+            return False
+        session = info.session
+        # AppSession はイベントループのスレッドからしか触れない
+        session._event_loop.call_soon_threadsafe(session.request_rerun, None)
+    except (AttributeError, RuntimeError):
+        # Streamlit の内部が変わった・ループが止まっている
+        return False
+    return True
+
+
+class SessionRegistry:
+    """
+    セッションごとの状態の大きさと最後に操作された時刻を持つ。
+    RSS が予算を超えたら、操作のないセッションから順に再実行させて退避する（退避するのは持ち主のスレッド）。
+    rerun はセッションIDを受け取って再実行を頼む関数（つながっていなければ False を返す）。
+    """
+
+    def __init__(self, budget_bytes: int = MEMORY_BUDGET_BYTES, idle_seconds: float = IDLE_SECONDS,
+                 spill_dir: Path = SPILL_DIR, compact: bool = COMPACT, rerun=request_rerun):
+        self.budget_bytes = budget_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = Path(spill_dir)
+        self.compact = compact
+        self.rerun = rerun
+        self.sessions = {}
+        self.evicted_total = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cleanup_spill_dir()
+
+    def start(self) -> "SessionRegistry":
+        """RSS を確認するスレッドを始める（どのセッションも操作されていなくても退避できるように）。"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="session-memory", daemon=True)
+            self._thread.start()
+        return self
+
+    def _watch(self):
+        while True:
+            time.sleep(PRESSURE_CHECK_SECONDS)
+            try:
+                self.check_pressure()
+            except Exception as e:
+                # 確認に失敗してもスレッドは止めない（次の回にまた確認する）
+                instrumentation.emit({"type": "session_memory_error", "error": f"{type(e).__name__}: {e}"})
+
+    def _cleanup_spill_dir(self):
+        # 前のプロセスが残した古いファイル
+        if not self.spill_dir.is_dir():
+            return
+        cutoff = time.time() - SPILL_TTL_SECONDS
+        for path in self.spill_dir.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def track(self, session_id: str, state, raw_state=None, page: str = "") -> dict:
+        """
+        再実行のはじめに呼ぶ。退避されていれば戻し、古い発言・大きな結果を片づけ、大きさを数える。
+        raw_state は閉じたセッションを見分けるための SessionState（弱参照で持つ）。
+        """
+        now = time.time()
+        with self._lock:
+            info = self.sessions.get(session_id)
+            if info is None:
+                info = self.sessions[session_id] = {
+                    "bytes": 0, "keys": {}, "evicted": False, "evict_requested": False,
+                    "requested_at": 0.0, "measured_at": 0.0, "last_seen": now,
+                }
+            if info["evicted"]:
+                self._restore(session_id, state)
+                info["evicted"] = False
+                info["measured_at"] = 0.0
+            # 退避のために頼んだ再実行は操作に数えない
+            if not info["evict_requested"]:
+                info["last_seen"] = now
+            info["page"] = page
+            if raw_state is not None:
+                info["ref"] = weakref.ref(raw_state)
+
+        spilled = spill_chat(state, session_id, self.spill_dir) if self.compact else 0
+        if spilled or now - info["measured_at"] >= MEASURE_SECONDS:
+            sizes = state_sizes(state)
+            if self.compact:
+                cap_results(state, sizes)
+            total = sum(sizes.values())
+            with self._lock:
+                info["keys"] = sizes
+                info["bytes"] = total
+                info["measured_at"] = now
+            instrumentation.record_session_state(page, total)
+        return info
+
+    def check_pressure(self) -> int:
+        """
+        予算を超えていれば操作のないセッションを再実行させて退避する。頼んだセッション数を返す。
+        前に頼んだ退避が終わっていなければ、それが RSS に出るまで次は頼まない。
+        """
+        rss = rss_bytes()
+        requested = []
+        with self._lock:
+            self._drop_dead()
+            now = time.time()
+            pending = False
+            for info in self.sessions.values():
+                if info["evict_requested"]:
+                    if now - info["requested_at"] < EVICT_RETRY_SECONDS:
+                        pending = True
+                    else:
+                        info["evict_requested"] = False
+            if self.compact and self.budget_bytes and rss > self.budget_bytes and not pending:
+                # どのセッションまで退避するかは見積もりで決める（空いたと数えるのは退避し終えてから）
+                need = rss - self.budget_bytes * LOW_WATERMARK
+                cutoff = now - self.idle_seconds
+                idle = sorted(
+                    (info["last_seen"], sid) for sid, info in self.sessions.items()
+                    if not info["evicted"] and info["last_seen"] < cutoff
+                )
+                for _, sid in idle:
+                    if need <= 0:
+                        break
+                    size = sum(self.sessions[sid]["keys"].get(k, 0) for k in EVICT_KEYS)
+                    if size:
+                        need -= size
+                        requested.append(sid)
+                        self.sessions[sid]["evict_requested"] = True
+                        self.sessions[sid]["requested_at"] = now
+            stats = self._stats(rss)
+        # 再実行を頼むのはロックの外で（頼んだ再実行がすぐ track() に来ても待たせない）
+        count = 0
+        for sid in requested:
+            if self.rerun(sid):
+                count += 1
+                continue
+            with self._lock:
+                if sid in self.sessions:
+                    self.sessions[sid]["evict_requested"] = False
+        instrumentation.record_sessions(stats["sessions"], stats["state_bytes"], rss, stats["evicted_total"])
+        return count
+
+    def _drop_dead(self):
+        # 閉じたセッション（SessionState が回収されたもの・長く来ていないもの）を忘れ、退避ファイルも消す
+        cutoff = time.time() - SPILL_TTL_SECONDS
+        dead = [
+            sid for sid, info in self.sessions.items()
+            if ("ref" in info and info["ref"]() is None) or info["last_seen"] < cutoff
+        ]
+        for sid in dead:
+            del self.sessions[sid]
+            _chat_path(sid, self.spill_dir).unlink(missing_ok=True)
+            _state_path(sid, self.spill_dir).unlink(missing_ok=True)
+
+    def evict_if_requested(self, session_id: str, state) -> int:
+        """
+        再実行の終わりに持ち主のスレッドから呼ぶ。退避を頼まれていれば状態をディスクに書き出して消す。
+        空いたバイト数を返す。
+        """
+        with self._lock:
+            info = self.sessions.get(session_id)
+            if info is None or not info["evict_requested"]:
+                return 0
+            info["evict_requested"] = False
+        data = {k: state[k] for k in EVICT_KEYS if k in state}
+        if not data:
+            return 0
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        with open(_state_path(session_id, self.spill_dir), "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for k in data:
+            del state[k]
+        with self._lock:
+            freed = sum(info["keys"].get(k, 0) for k in data)
+            info["evicted"] = True
+            info["bytes"] -= freed
+            self.evicted_total += 1
+        instrumentation.record_session_compaction("evict")
+        return freed
+
+    def _restore(self, session_id: str, state):
+        path = _state_path(session_id, self.spill_dir)
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        for k, v in data.items():
+            state[k] = v
+        path.unlink(missing_ok=True)
+        instrumentation.record_session_compaction("restore")
+
+    def _stats(self, rss: int) -> dict:
+        resident = [info["bytes"] for info in self.sessions.values() if not info["evicted"]]
+        return {
+            "sessions": len(self.sessions),
+            "resident_sessions": len(resident),
+            "evicted_sessions": len(self.sessions) - len(resident),
+            "evict_requested_sessions": sum(info["evict_requested"] for info in self.sessions.values()),
+            "state_bytes": sum(resident),
+            "max_session_bytes": max(resident, default=0),
+            "rss_bytes": rss,
+            "budget_bytes": self.budget_bytes,
+            "evicted_total": self.evicted_total,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return self._stats(rss_bytes())
+
+
+@st.cache_resource(show_spinner=False)
+def get_registry() -> SessionRegistry:
+    return SessionRegistry().start()
+
+
+def session_id() -> str:
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "-"
+
+
+def track(page: str = "") -> dict:
+    """main_app からページを表示する前に毎回呼ぶ。"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return {}
+    # セッションが閉じたか（SessionState が回収されたか）を見るため、ラッパーの中の SessionState を持っておく
+    raw = getattr(ctx.session_state, "_state", None)
+    return get_registry().track(ctx.session_id, st.session_state, raw, page)
+
+
+def finish() -> int:
+    """main_app からページを表示し終えたら呼ぶ（st.stop や st.rerun のときも）。"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return 0
+    return get_registry().evict_if_requested(ctx.session_id, st.session_state)
@@ -0,0 +1,308 @@
+# structured_output.py
+"""
+LLM の応答を JSON スキーマで受け取るためのモデルと、ストリーミング中の JSON を少しずつ読むパーサー。
+
+    response_format=response_format(PFCPlan) を付けて呼ぶと、応答はスキーマどおりの JSON になる。
+    届いた断片を IncrementalJSON に渡していけば、途中でも読めたところまで（partial）を取り出せる。
+    最後に finish(PFCPlan) で検証する。途中で切れた応答は、最後に完結している値まで戻して
+    括弧を閉じ、それで検証を通れば使い、通らなければ StructuredOutputError にする
+    （もう一度問い合わせることはしない）。
+
+    LLM_STRUCTURED_OUTPUT=0   response_format を送らない（対応していないモデル・互換APIのとき）
+"""
+import functools
+import json
+import os
+
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator, model_validator
+
+import instrumentation
+import llm_cache
+
+ENABLED = os.getenv("LLM_STRUCTURED_OUTPUT", "1") != "0"
+
+# 途中で切れた応答を直すとき、さかのぼって試す区切りの数
+MAX_REPAIR_CUTS = 16
+
+
+class StructuredOutputError(ValueError):
+    """応答を JSON として読めない、またはスキーマに合わない。"""
+
+
+# --------------------------
+# モデル
+# --------------------------
+class _Strict(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+class DishNutrition(_Strict):
+    """料理1品の推定値（LLM が返す部分。料理名はこちらで付ける）。"""
+    kcal: float
+    P: float
+    F: float
+    C: float
+
+    @field_validator("kcal", "P", "F", "C")
+    @classmethod
+    def _not_negative(cls, v: float) -> float:
+        if v < 0:
+            raise ValueError("負の値です")
+        return v
+
+
+class DishEstimate(DishNutrition):
+    """料理1品の結果（成分表で計算したときは食品名とグラム数も入る）。"""
+    name: str
+    food_name: str | None = None
+    grams: float | None = None
+
+
+class MealEstimate(_Strict):
+    """1回の食事（料理の一覧）と合計。"""
+    dishes: list[DishEstimate]
+
+    def total(self) -> dict:
+        return {k: sum(getattr(d, k) for d in self.dishes) for k in ("kcal", "P", "F", "C")}
+
+    def items(self) -> list:
+        return [d.model_dump() for d in self.dishes]
+
+
+class FoodGrams(_Strict):
+    name: str
+    grams: float
+
+
+class PFCShare(_Strict):
+    P: float
+    F: float
+    C: float
+
+
+class PFCPlan(_Strict):
+    """グラム計算アプリの食材ごとのグラム数と合計。"""
+    foods: list[FoodGrams]
+    total_kcal: float
+    pfc: PFCShare | None
+
+    @model_validator(mode="before")
+    @classmethod
+    def _from_legacy(cls, data):
+        # 以前の形式 {"食材グラム": {...}, "合計カロリー": ..., "合計PFC": {...}} も読む
+        if isinstance(data, dict) and "食材グラム" in data:
+            grams = data.get("食材グラム") or {}
+            return {
+                "foods": [{"name": k, "grams": v} for k, v in grams.items()],
+                "total_kcal": data.get("合計カロリー"),
+                "pfc": data.get("合計PFC"),
+            }
+        return data
+
+    def to_result(self, min_gram: float = 0) -> dict:
+        # PFC_app の表示に使う形（最低グラムを下回る食材は引き上げる）
+        result = {
+            "食材グラム": {f.name: max(f.grams, min_gram) for f in self.foods},
+            "合計カロリー": self.total_kcal,
+        }
+        if self.pfc is not None:
+            result["合計PFC"] = self.pfc.model_dump()
+        return result
+
+
+@functools.lru_cache(maxsize=None)
+def response_format(model: type) -> dict:
+    """chat.completions.create の response_format に渡す JSON スキーマ（strict）。"""
+    schema = _strict_schema(model.model_json_schema())
+    return {"type": "json_schema", "json_schema": {"name": model.__name__, "schema": schema, "strict": True}}
+
+
+def _strict_schema(node):
+    # strict モードでは全プロパティが required、追加プロパティなしでなければならない
+    # （説明文は送らない。項目の意味はプロンプトに書く）
+    if isinstance(node, dict):
+        node = {k: _strict_schema(v) for k, v in node.items() if k not in ("title", "description", "default")}
+        if "properties" in node:
+            node["required"] = list(node["properties"])
+            node["additionalProperties"] = False
+        return node
+    if isinstance(node, list):
+        return [_strict_schema(v) for v in node]
+    return node
+
+
+# --------------------------
+# 少しずつ読む JSON パーサー
+# --------------------------
+class IncrementalJSON:
+    """
+    届いた断片を順に feed し、最初の { から対応する } までを1つの JSON として読む。
+    前後のコードフェンスや説明文は無視する。文字列の中かどうかと括弧の深さを1文字ずつ追い、
+    値が完結した位置（, の直前や閉じ括弧の直後）を「区切り」として覚えておく。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.start = -1
+        self.end = -1
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        # (位置, そこで閉じるのに必要な括弧)
+        self._cuts = []
+
+    def feed(self, delta: str) -> bool:
+        """断片を追加する。新しく値が完結したら True。"""
+        if not delta or self.end >= 0:
+            return False
+        self.text += delta
+        before = len(self._cuts)
+        self._scan()
+        return len(self._cuts) > before or self.end >= 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end >= 0
+
+    def _closers(self) -> str:
+        return "".join(reversed(self._stack))
+
+    def _scan(self):
+        text = self.text
+        i = self._pos
+        while i < len(text) and self.end < 0:
+            ch = text[i]
+            if self.start < 0:
+                if ch == "{":
+                    self.start = i
+                    self._stack.append("}")
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append("}" if ch == "{" else "]")
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self.end = i + 1
+                else:
+                    self._cuts.append((i + 1, self._closers()))
+            elif ch == ",":
+                self._cuts.append((i, self._closers()))
+            i += 1
+        self._pos = i
+
+    def document(self) -> str | None:
+        """閉じ括弧まで届いていれば JSON 部分の文字列。"""
+        return self.text[self.start:self.end] if self.complete else None
+
+    def _candidates(self, eager: bool = True):
+        # 読める可能性が高い順に、補った JSON 文字列を返す
+        if self.start < 0:
+            return
+        if self.complete:
+            yield self.document()
+            return
+        # 1) 今の位置で、開いている文字列と括弧を閉じる（途中の数値・文字列も読むので表示用だけ）
+        if eager:
+            yield self._closed_tail()
+        # 2) 最後に値が完結していた位置まで戻って閉じる
+        for pos, closers in reversed(self._cuts[-MAX_REPAIR_CUTS:]):
+            yield self.text[self.start:pos] + closers
+
+    def _closed_tail(self) -> str:
+        tail = self.text[self.start:]
+        if self._in_string:
+            tail = tail[:-1] if self._escape else tail
+            tail += '"'
+        tail = tail.rstrip()
+        if tail.endswith(","):
+            tail = tail[:-1]
+        return tail + self._closers()
+
+    def partial(self):
+        """ここまでに読める部分を dict で返す（まだ何も読めなければ None）。"""
+        for candidate in self._candidates():
+            try:
+                return json.loads(candidate)
+            except ValueError:
+                continue
+        return None
+
+    def finish(self, model: type, task: str = ""):
+        """
+        model で検証して返す。途中で切れていれば補える範囲で補い、
+        どう補っても model に合わなければ StructuredOutputError。
+        """
+        errors = []
+        # 切れた数値や文字列を正しい値と取り違えないよう、完結した値までしか使わない
+        for n, candidate in enumerate(self._candidates(eager=False)):
+            try:
+                parsed = model.model_validate_json(candidate)
+            except ValidationError as e:
+                errors.append(e)
+                continue
+            instrumentation.record_structured(task, "ok" if n == 0 and self.complete else "repaired")
+            return parsed
+        instrumentation.record_structured(task, "rejected")
+        detail = f": {errors[0].errors()[0]['msg']}" if errors else ""
+        raise StructuredOutputError(f"応答を {model.__name__} として読み取れませんでした{detail}")
+
+
+def parse(text: str, model: type, task: str = ""):
+    """応答の全文を model として読む（前後の余計な文字や途中切れにも対応）。"""
+    parser = IncrementalJSON()
+    parser.feed(text or "")
+    return parser.finish(model, task)
+
+
+def parse_stream(deltas, model: type, on_partial=None, task: str = ""):
+    """
+    断片のイテレーターを読みながら、値が完結するたびに on_partial(dict) を呼ぶ。
+    戻り値は (model のインスタンス, 応答の全文)。
+    """
+    parser = IncrementalJSON()
+    for delta in deltas:
+        if parser.feed(delta) and on_partial is not None:
+            partial = parser.partial()
+            if partial is not None:
+                on_partial(partial)
+    return parser.finish(model, task), parser.text
+
+
+# --------------------------
+# キャッシュつきの呼び出し
+# --------------------------
+def _deltas(stream):
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def cached_structured(create, model: str, messages: list, schema: type, key_parts: dict,
+                      on_partial=None, task: str = "", cache=None):
+    """
+    llm_cache.cached_stream の構造化出力版。schema のインスタンスを返す。
+    キャッシュには検証済みの JSON（余計な文字を除いたもの）だけを保存する。
+    """
+    cache = cache or llm_cache.get_cache()
+    key = llm_cache.make_key(model, **key_parts)
+    hit = cache.get(key)
+    if hit is not None:
+        try:
+            return parse(hit, schema, task)
+        except StructuredOutputError:
+            # 読めない古いエントリは問い合わせ直して上書きする
+            pass
+    kwargs = {"response_format": response_format(schema)} if ENABLED else {}
+    parsed, _ = parse_stream(_deltas(create(model=model, messages=messages, stream=True, **kwargs)), schema, on_partial, task)
+    cache.set(key, parsed.model_dump_json(), model)
+    return parsed
@@ -0,0 +1,171 @@
+# tdee_batch.py
+"""
+顧客名簿（CSV / Parquet）をまとめてTDEE計算する。
+
+    python tdee_batch.py roster.csv -o targets.csv
+    python tdee_batch.py roster.parquet -o targets.parquet --chunksize 500000
+
+入力列: sex, age, weight, height, activity, [body_fat], [unit], [formula]
+  - sex: 男性/女性（male/female, M/F も可）
+  - activity: tdee_app.ACTIVITY_FACTORS のラベル
+  - unit: 省略時はメートル法。"ヤード・ポンド法" または lb/imperial で lb・in として扱う
+  - formula: 省略時は体脂肪率があれば Katch-McArdle、なければ Mifflin-St Jeor
+出力列: bmr, tdee, cut_10, bulk_10, error（計算できなかった行は理由を入れ、数値は空）
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tdee_app import ACTIVITY_FACTORS
+
+LB_TO_KG = 0.45359237
+IN_TO_CM = 2.54
+
+_MALE = {"男性", "男", "male", "m"}
+# 種類の少ない文字列列は category として読み込む
+CATEGORY_COLUMNS = ("sex", "activity", "unit", "formula")
+_IMPERIAL_PREFIXES = ("ヤード", "lb", "imperial")
+
+
+# --------------------------
+# ベクトル化した計算式（tdee_app のスカラー版と同じ演算順）
+# --------------------------
+def mifflin_st_jeor_bmr(is_male, weight_kg, height_cm, age):
+    return 10 * weight_kg + 6.25 * height_cm - 5 * age + np.where(is_male, 5, -161)
+
+
+def katch_mcardle_bmr(weight_kg, body_fat_percent):
+    lbm = weight_kg * (1 - body_fat_percent / 100.0)
+    return 370 + 21.6 * lbm
+
+
+def _column(df: pd.DataFrame, name: str, default=np.nan) -> pd.Series:
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index)
+
+
+def _map_values(series: pd.Series, func, dtype) -> np.ndarray:
+    # 文字列列は種類が少ないので、ユニーク値だけ変換してから展開する
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    mapped = np.array([func(u) for u in uniques] + [func(None)], dtype=dtype)
+    return mapped[codes]
+
+
+def _text(value) -> str:
+    return "" if value is None or value is pd.NA or value != value else str(value).strip().lower()
+
+
+def compute_targets(df: pd.DataFrame) -> pd.DataFrame:
+    """名簿の DataFrame に bmr, tdee, cut_10, bulk_10, error 列を付けて返す。"""
+    n = len(df)
+    age = pd.to_numeric(_column(df, "age"), errors="coerce").to_numpy(dtype=np.float64)
+    weight = pd.to_numeric(_column(df, "weight"), errors="coerce").to_numpy(dtype=np.float64)
+    height = pd.to_numeric(_column(df, "height"), errors="coerce").to_numpy(dtype=np.float64)
+    body_fat = pd.to_numeric(_column(df, "body_fat", 0.0), errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+    factor = _map_values(_column(df, "activity", ""), lambda v: ACTIVITY_FACTORS.get(v, np.nan), np.float64)
+    is_male = _map_values(_column(df, "sex", ""), lambda v: _text(v) in _MALE, bool)
+
+    imperial = _map_values(_column(df, "unit", ""), lambda v: _text(v).startswith(_IMPERIAL_PREFIXES), bool)
+    weight_kg = np.where(imperial, weight * LB_TO_KG, weight)
+    height_cm = np.where(imperial, height * IN_TO_CM, height)
+
+    # formula: 0=省略, 1=Katch-McArdle, 2=Mifflin-St Jeor
+    formula = _map_values(
+        _column(df, "formula", ""),
+        lambda v: 0 if _text(v) == "" else (1 if _text(v).startswith("katch") else 2),
+        np.int8,
+    )
+    katch = np.where(formula == 0, body_fat > 0.0, formula == 1)
+
+    # 入力チェック（st.stop() の代わりに行ごとのエラーにする）
+    error = np.full(n, "", dtype=object)
+    checks = [
+        (~np.isfinite(factor), "活動レベルが不明です。"),
+        (katch & (body_fat <= 0.0), "Katch-McArdle を選ぶ場合は体脂肪率を入力してください。"),
+        (~(np.isfinite(height) & (height > 0)), "身長 は正の数を入力してください。"),
+        (~(np.isfinite(weight) & (weight > 0)), "体重 は正の数を入力してください。"),
+        (~(np.isfinite(age) & (age > 0)), "年齢 は正の数を入力してください。"),
+    ]
+    # 後ろから上書きして、スカラー版と同じ順番（年齢→体重→身長→…）で最初のエラーを残す
+    for bad, message in checks:
+        error[bad] = message
+    ok = error == ""
+
+    with np.errstate(invalid="ignore"):
+        bmr = np.where(
+            katch,
+            katch_mcardle_bmr(weight_kg, body_fat),
+            mifflin_st_jeor_bmr(is_male, weight_kg, height_cm, np.trunc(age)),
+        )
+        tdee = bmr * factor
+    out = df.copy()
+    for name, values in (("bmr", bmr), ("tdee", tdee), ("cut_10", tdee * 0.9), ("bulk_10", tdee * 1.1)):
+        # round() と同じ偶数丸め。エラー行は欠損にする
+        out[name] = pd.arrays.IntegerArray(np.where(ok, np.rint(values), 0).astype(np.int64), ~ok)
+    out["error"] = error
+    return out
+
+
+# --------------------------
+# 名簿ファイルのストリーミング処理
+# --------------------------
+def _iter_chunks(path: Path, chunksize: int):
+    if path.suffix.lower() == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            df = batch.to_pandas()
+            yield df.astype({c: "category" for c in CATEGORY_COLUMNS if c in df.columns})
+    else:
+        # UTF-8 BOM付きのCSVにも対応
+        dtype = {c: "category" for c in CATEGORY_COLUMNS}
+        yield from pd.read_csv(path, chunksize=chunksize, encoding="utf-8-sig", dtype=dtype)
+
+
+def process_file(src: Path, dst: Path, chunksize: int = 200_000) -> int:
+    src, dst = Path(src), Path(dst)
+    writer = None
+    total = 0
+    try:
+        for i, chunk in enumerate(_iter_chunks(src, chunksize)):
+            result = compute_targets(chunk)
+            if dst.suffix.lower() == ".parquet":
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(result, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(dst, table.schema)
+                writer.write_table(table)
+            else:
+                result.to_csv(dst, mode="w" if i == 0 else "a", header=i == 0, index=False)
+            total += len(result)
+    finally:
+        if writer is not None:
+            writer.close()
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="名簿をまとめてTDEE（維持・減量・増量）計算する")
+    parser.add_argument("input", type=Path, help="入力 CSV / Parquet")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="出力 CSV / Parquet")
+    parser.add_argument("--chunksize", type=int, default=200_000, help="1回に読み込む行数")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    rows = process_file(args.input, args.output, args.chunksize)
+    elapsed = time.perf_counter() - t0
+    print(f"{rows} 行を {elapsed:.2f} 秒で処理しました（{rows / max(elapsed, 1e-9):,.0f} 行/秒）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
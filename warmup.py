@@ -0,0 +1,337 @@
+# warmup.py
+"""
+起動直後の準備（重いモジュールの import、成分表・各種インデックスの構築、API への接続）を
+バックグラウンドで済ませ、終わったら準備完了ファイルを書く。
+
+    streamlit run main_app.py        最初のセッションで main_app から開始する
+    python warmup.py serve [streamlit run のオプション...]
+                                     サーバー起動と同時に開始する（最初の利用者も待たない）
+    python warmup.py check           準備完了なら終了コード0（ロードバランサのヘルスチェック用）
+    python warmup.py run             その場で全ステップを実行して所要時間を表示
+
+    DIET_APP_READY_FILE=logs/ready.json   準備完了ファイルの場所
+"""
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import streamlit as st
+
+import instrumentation
+
+ROOT = Path(__file__).resolve().parent
+READY_FILE = Path(os.getenv("DIET_APP_READY_FILE", str(ROOT / "logs" / "ready.json")))
+# 準備中に来たリクエストを待たせる最大秒数（過ぎたらそのまま表示する）
+READY_WAIT_SECONDS = float(os.getenv("DIET_APP_READY_WAIT", "30"))
+# API に接続しておくか（0 で無効）
+PRIME_HTTP = os.getenv("DIET_APP_WARMUP_HTTP", "1") != "0"
+# serve のとき、サーバーの起動と自分自身へのセッションを待つ最大秒数
+SESSION_TIMEOUT = 60.0
+
+# 先に import しておくモジュール（ページと重いライブラリ）
+PRELOAD_MODULES = (
+    "numpy",
+    "pandas",
+    "scipy.optimize",
+    "scipy.sparse",
+    "scipy.spatial",
+    "httpx",
+    "openai",
+    "tenacity",
+    "tdee_app",
+    "PFC_app",
+    "calorie_app",
+    "AI_question_app",
+    "food_query_app",
+)
+
+
+# --------------------------
+# 各ステップ
+# --------------------------
+def _import_modules():
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+
+def _nutrient_store():
+    import nutrient_store
+
+    store = nutrient_store.get_store()
+    # mmap の全ページを一度読んでおく
+    float(store.values.sum())
+
+
+def _food_search():
+    import calorie_engine
+    import food_search
+
+    food_search.get_index()
+    calorie_engine.resolve_food("ご飯")
+
+
+def _composite_dishes():
+    import composite_dishes
+
+    composite_dishes.get_table()
+
+
+def _faq_index():
+    import faq_index
+
+    faq_index.get_index()
+
+
+def _food_substitutes():
+    import food_substitutes
+
+    food_substitutes.get_index()
+
+
+def _food_query():
+    import food_query
+
+    food_query.get_engine()
+
+
+def _storage():
+    import llm_cache
+    import meal_log
+
+    llm_cache.get_cache()
+    meal_log.get_log()
+
+
+def _http():
+    # TLS 接続を張ってプールに残しておく（エラー応答でも接続はできているので成功扱い）
+    import openai
+
+    import llm_client
+    import llm_dispatch
+
+    llm_dispatch.get_dispatcher()
+    if not llm_client.get_api_key():
+        return
+    try:
+        llm_client.get_client().models.list()
+    except openai.APIStatusError:
+        pass
+
+
+def _session():
+    # serve のときだけ: 自分のサーバーに1回つないで main_app を実行し、Streamlit 側のセッション初期化も済ませる
+    import asyncio
+
+    from streamlit import config
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+    from tornado.websocket import websocket_connect
+
+    base = config.get_option("server.baseUrlPath").strip("/")
+    url = f"ws://127.0.0.1:{config.get_option('server.port')}/{base + '/' if base else ''}_stcore/stream"
+
+    async def prime():
+        deadline = time.monotonic() + SESSION_TIMEOUT
+        while True:
+            try:
+                ws = await websocket_connect(url)
+                break
+            except OSError:
+                # サーバーがまだ待ち受けていない
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+        try:
+            msg = BackMsg()
+            msg.rerun_script.query_string = ""
+            await ws.write_message(msg.SerializeToString(), binary=True)
+            while True:
+                raw = await asyncio.wait_for(ws.read_message(), max(deadline - time.monotonic(), 0.1))
+                if raw is None:
+                    break
+                fwd = ForwardMsg()
+                fwd.ParseFromString(raw)
+                if fwd.WhichOneof("type") == "script_finished":
+                    break
+        finally:
+            ws.close()
+
+    asyncio.run(prime())
+
+
+# (名前, 関数, 必須か)。必須のステップが終わればページの表示を始めてよい（loaded）。
+# 全ステップが終わったら準備完了ファイルを書く。必須のステップが1つでも失敗していたら ready にしない
+# （ヘルスチェックで外してもらう）。必須でないステップ（http / session）の失敗は ready のまま
+STEPS = (
+    ("modules", _import_modules, True),
+    ("nutrient_store", _nutrient_store, True),
+    ("food_search", _food_search, True),
+    ("composite_dishes", _composite_dishes, True),
+    ("faq_index", _faq_index, True),
+    ("food_substitutes", _food_substitutes, True),
+    ("food_query", _food_query, True),
+    ("storage", _storage, True),
+    ("http", _http, False),
+)
+SERVE_STEPS = STEPS + (("session", _session, False),)
+
+
+class Warmup:
+    """STEPS を別スレッドで順に実行し、状態を準備完了ファイルに書く。"""
+
+    def __init__(self, steps=STEPS, ready_file: Path = READY_FILE, prime_http: bool = PRIME_HTTP):
+        self.steps = [s for s in steps if prime_http or s[0] != "http"]
+        self.ready_file = Path(ready_file)
+        self.loaded = threading.Event()
+        self.ready = threading.Event()
+        self.results = {}
+        self.started_at = None
+        self.loaded_at = None
+        self.ready_at = None
+        self._thread = None
+
+    def start(self) -> "Warmup":
+        if self._thread is None:
+            # 前のプロセスの準備完了ファイルが残っていたら消す
+            self.ready_file.unlink(missing_ok=True)
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def run(self):
+        self.started_at = self.started_at or time.time()
+        try:
+            for name, fn, required in self.steps:
+                if not required:
+                    self._mark_loaded()
+                self._run_step(name, fn, required)
+        finally:
+            self._mark_loaded()
+            self.ready_at = time.time()
+            self.ready.set()
+            if not self.failed():
+                instrumentation.METRICS.inc("diet_app_ready", ())
+            self._write()
+
+    def _run_step(self, name: str, fn, required: bool = True):
+        start = time.perf_counter()
+        error = None
+        try:
+            fn()
+        except Exception as e:
+            # 失敗しても起動は止めない（そのステップは最初のリクエストで改めて作られる）
+            error = f"{type(e).__name__}: {e}"
+        duration = time.perf_counter() - start
+        self.results[name] = {"ms": round(duration * 1000, 1), "error": error, "required": required}
+        instrumentation.record_warmup(name, duration, error)
+
+    def _mark_loaded(self):
+        if not self.loaded.is_set():
+            self.loaded_at = time.time()
+            self.loaded.set()
+
+    def failed(self) -> list:
+        # 失敗した必須のステップ
+        return [name for name, r in self.results.items() if r["required"] and r["error"]]
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.loaded.wait(timeout)
+
+    def _elapsed_ms(self, at: float | None):
+        return None if at is None else round((at - self.started_at) * 1000, 1)
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready.is_set() and not self.failed(),
+            "finished": self.ready.is_set(),
+            "failed": self.failed(),
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "loaded_after_ms": self._elapsed_ms(self.loaded_at),
+            "ready_after_ms": self._elapsed_ms(self.ready_at),
+            "steps": dict(self.results),
+        }
+
+    def _write(self):
+        try:
+            self.ready_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.ready_file.with_name(f"{self.ready_file.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(self.status(), ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, self.ready_file)
+        except OSError:
+            pass
+
+
+# serve から起動したときは自分自身へのセッションも準備に含める
+_serving = False
+
+
+@st.cache_resource(show_spinner=False)
+def get_warmup() -> Warmup:
+    # プロセスで1回だけ開始する
+    return Warmup(SERVE_STEPS if _serving else STEPS).start()
+
+
+def wait_until_ready(timeout: float = READY_WAIT_SECONDS) -> bool:
+    """main_app から呼ぶ。データの準備中ならスピナーを出して終わるまで待つ。"""
+    warm = get_warmup()
+    if warm.loaded.is_set():
+        return True
+    with st.spinner("起動準備中です…"):
+        return warm.wait(timeout)
+
+
+# --------------------------
+# CLI
+# --------------------------
+def check(ready_file: Path = READY_FILE) -> bool:
+    # 準備完了ファイルがあり、書いたプロセスが生きていて、必須のステップが失敗していなければ準備完了
+    try:
+        status = json.loads(Path(ready_file).read_text(encoding="utf-8"))
+        os.kill(int(status["pid"]), 0)
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    return bool(status.get("ready")) and not status.get("failed")
+
+
+def serve(streamlit_args: list):
+    # 準備を始めてから同じプロセスで Streamlit を起動する（キャッシュはプロセス内で共有される）
+    from streamlit.web import cli
+
+    global _serving
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    _serving = True
+    get_warmup()
+    sys.argv = ["streamlit", "run", str(ROOT / "main_app.py"), *streamlit_args]
+    sys.exit(cli.main())
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "run"
+    if command == "check":
+        ok = check()
+        print("ready" if ok else "not ready")
+        sys.exit(0 if ok else 1)
+    if command == "serve":
+        serve(argv[1:])
+    elif command == "run":
+        warm = Warmup()
+        warm.run()
+        print(json.dumps(warm.status(), ensure_ascii=False, indent=2))
+    else:
+        print(__doc__, file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    # `python warmup.py` で実行しても main_app と同じモジュール（とキャッシュ）を使う
+    import warmup
+
+    warmup.main()